@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+Compare the time of the hot lookups of nereid before and after the indexes
+created by the nereid module:
+
+    * users by email and company (login, registration, Basic auth)
+    * static files by folder name and name
+    * nereid translations by language, type and module (catalog loads)
+
+The tables have the columns used by the queries and the unique constraints
+Tryton creates on users and static files. The indexes of the constraints
+already serve the lookups of users and static files, so nereid only
+creates their indexes where the constraints are missing (like on databases
+where they could not be created), which --without-constraints benchmarks.
+The benchmark uses an in-memory SQLite database by default, or a
+PostgreSQL database with the psycopg2 DSN given as argument::
+
+    python benchmarks/indexes.py
+    python benchmarks/indexes.py --without-constraints
+    python benchmarks/indexes.py "dbname=nereid_benchmark"
+"""
+import sys
+import random
+import timeit
+
+USER_COUNT = 200000
+COMPANY_COUNT = 5
+FOLDER_COUNT = 100
+FILE_COUNT = 100000
+TRANSLATION_COUNT = 500000
+LANGS = ('en_US', 'fr_FR', 'de_DE', 'es_ES', 'it_IT')
+TYPES = ('nereid', 'nereid_template', 'field', 'model', 'selection')
+MODULES = ['module%d' % index for index in xrange(40)]
+LOOKUP_COUNT = 200
+
+TABLES = [
+    '''CREATE TABLE nereid_user (
+        id INTEGER PRIMARY KEY, email VARCHAR, company INTEGER,
+        active BOOLEAN, password_hash VARCHAR%s)''',
+    '''CREATE TABLE nereid_static_folder (
+        id INTEGER PRIMARY KEY, name VARCHAR UNIQUE)''',
+    '''CREATE TABLE nereid_static_file (
+        id INTEGER PRIMARY KEY, name VARCHAR, folder INTEGER%s)''',
+    '''CREATE TABLE ir_translation (
+        id INTEGER PRIMARY KEY, lang VARCHAR, type VARCHAR, name VARCHAR,
+        module VARCHAR, src TEXT, value TEXT, fuzzy BOOLEAN)''',
+]
+
+CONSTRAINTS = [
+    ', UNIQUE (email, company, active)',
+    ', UNIQUE (name, folder)',
+]
+
+#: The indexes created by nereid where the constraints are missing
+CONSTRAINT_INDEXES = [
+    'CREATE INDEX nereid_user_email_company_index '
+    'ON nereid_user (email, company)',
+    'CREATE INDEX nereid_static_file_folder_name_index '
+    'ON nereid_static_file (folder, name)',
+]
+
+INDEXES = [
+    'CREATE INDEX ir_translation_lang_type_module_index '
+    'ON ir_translation (lang, type, module)',
+]
+
+
+def connect(dsn):
+    if dsn:
+        import psycopg2
+        connection = psycopg2.connect(dsn)
+        param = '%s'
+    else:
+        import sqlite3
+        connection = sqlite3.connect(':memory:')
+        param = '?'
+    return connection, param
+
+
+def get_translation(index):
+    """
+    Returns the language, type, module and source of a translation
+    """
+    # Sources of templates are often long texts
+    source = (u'Source message %d ' % index) * (index % 20 + 1)
+    return (
+        LANGS[index % len(LANGS)], TYPES[index // len(LANGS) % len(TYPES)],
+        MODULES[index % len(MODULES)], source,
+    )
+
+
+def populate(connection, param, constraints=True):
+    cursor = connection.cursor()
+    for table in ('ir_translation', 'nereid_static_file',
+                  'nereid_static_folder', 'nereid_user'):
+        cursor.execute('DROP TABLE IF EXISTS %s' % table)
+    user_table, folder_table, file_table, translation_table = TABLES
+    user_constraint, file_constraint = \
+        CONSTRAINTS if constraints else ('', '')
+    for query in (
+            user_table % user_constraint, folder_table,
+            file_table % file_constraint, translation_table):
+        cursor.execute(query)
+
+    def insert(table, columns, rows):
+        cursor.executemany(
+            'INSERT INTO %s (%s) VALUES (%s)' % (
+                table, ', '.join(columns), ', '.join([param] * len(columns))
+            ), rows
+        )
+
+    insert('nereid_user', ('email', 'company', 'active', 'password_hash'), (
+        ('user%d@example.com' % index, index % COMPANY_COUNT + 1, True, 'x')
+        for index in xrange(USER_COUNT)
+    ))
+    insert('nereid_static_folder', ('id', 'name'), (
+        (index + 1, 'folder%d' % index) for index in xrange(FOLDER_COUNT)
+    ))
+    insert('nereid_static_file', ('name', 'folder'), (
+        ('file%d.png' % index, index % FOLDER_COUNT + 1)
+        for index in xrange(FILE_COUNT)
+    ))
+
+    def translations():
+        for index in xrange(TRANSLATION_COUNT):
+            lang, type_, module, source = get_translation(index)
+            yield (
+                lang, type_, 'template%d.jinja' % (index % 1000), module,
+                source, source, False,
+            )
+    insert('ir_translation', (
+        'lang', 'type', 'name', 'module', 'src', 'value', 'fuzzy',
+    ), translations())
+    connection.commit()
+
+
+def get_lookups(param):
+    """
+    Returns the queries of the lookups with their parameters
+    """
+    users = [
+        ('user%d@example.com' % index, index % COMPANY_COUNT + 1)
+        for index in random.sample(xrange(USER_COUNT), LOOKUP_COUNT)
+    ]
+    files = [
+        ('folder%d' % (index % FOLDER_COUNT), 'file%d.png' % index)
+        for index in random.sample(xrange(FILE_COUNT), LOOKUP_COUNT)
+    ]
+    catalogs = [
+        (random.choice(LANGS), 'nereid_template', random.choice(MODULES))
+        for index in xrange(LOOKUP_COUNT // 10)
+    ]
+
+    def where(*columns):
+        return ' AND '.join(
+            '%s = %s' % (column, param) for column in columns
+        )
+    return [
+        ('user by email and company',
+         'SELECT id FROM nereid_user WHERE ' + where('email', 'company'),
+         users),
+        ('static file by folder and name',
+         'SELECT id FROM nereid_static_file WHERE folder IN ('
+         'SELECT id FROM nereid_static_folder WHERE ' + where('name') +
+         ') AND ' + where('name'),
+         files),
+        ('catalog by language, type and module',
+         'SELECT src, value FROM ir_translation WHERE ' +
+         where('lang', 'type', 'module') +
+         " AND value != '' AND value IS NOT NULL AND fuzzy = " + param,
+         [c + (False,) for c in catalogs]),
+    ]
+
+
+def time_lookups(connection, lookups):
+    cursor = connection.cursor()
+    results = []
+    for name, query, params in lookups:
+        def run():
+            for param in params:
+                cursor.execute(query, param)
+                cursor.fetchall()
+        # Best of the runs, per lookup, in milliseconds
+        results.append(
+            min(timeit.repeat(run, number=1, repeat=3)) / len(params) * 1000
+        )
+    return results
+
+
+def main(dsn=None, constraints=True):
+    random.seed(0)
+    connection, param = connect(dsn)
+    populate(connection, param, constraints)
+    lookups = get_lookups(param)
+
+    before = time_lookups(connection, lookups)
+    cursor = connection.cursor()
+    indexes = INDEXES
+    if not constraints:
+        indexes = CONSTRAINT_INDEXES + indexes
+    for query in indexes:
+        cursor.execute(query)
+    cursor.execute('ANALYZE')
+    connection.commit()
+    after = time_lookups(connection, lookups)
+
+    print '%-38s %12s %12s %8s' % (
+        'lookup', 'before (ms)', 'after (ms)', 'speedup')
+    for (name, _, _), before_time, after_time in zip(lookups, before, after):
+        print '%-38s %12.3f %12.3f %7.0fx' % (
+            name, before_time, after_time, before_time / after_time
+        )
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    constraints = '--without-constraints' not in args
+    args = [arg for arg in args if arg != '--without-constraints']
+    main(*args[:1], constraints=constraints)
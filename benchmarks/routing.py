@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+Compare the URL matching latency of the werkzeug map and the trie map
+used when `TRIE_URL_MATCHING` is enabled.
+
+The rules are mounted under `/<locale>` like the URL map of a website
+with locales. Run with::
+
+    python benchmarks/routing.py
+"""
+import random
+import timeit
+
+from werkzeug.routing import Map, Rule, Submount
+from nereid.routing import TrieMap
+
+RULE_COUNTS = (100, 1000, 5000)
+PATH_COUNT = 1000
+
+
+def get_rules(count):
+    """
+    Return `count` rules spread over modules like the ones contributed by
+    the route decorator.
+    """
+    rules = []
+    for index in xrange(count):
+        module, kind = divmod(index, 4)
+        if kind == 0:
+            rules.append(Rule(
+                '/m%d/items' % module, endpoint='m%d.list' % module
+            ))
+        elif kind == 1:
+            rules.append(Rule(
+                '/m%d/items/<int:id>' % module, endpoint='m%d.get' % module
+            ))
+        elif kind == 2:
+            rules.append(Rule(
+                '/m%d/items/<int:id>/edit' % module,
+                endpoint='m%d.edit' % module, methods=['POST'],
+            ))
+        else:
+            rules.append(Rule(
+                '/m%d/<uri>' % module, endpoint='m%d.uri' % module
+            ))
+    rules.append(Rule('/static/<path:filename>', endpoint='static'))
+    return [
+        Rule('/', redirect_to='/en_US'),
+        Submount('/<locale>', rules),
+    ]
+
+
+def get_paths(count):
+    """
+    Return paths which match rules spread uniformly over the map
+    """
+    paths = []
+    modules = count // 4
+    for index in xrange(PATH_COUNT):
+        module = random.randrange(modules)
+        paths.append(random.choice([
+            '/en_US/m%d/items' % module,
+            '/en_US/m%d/items/%d' % (module, index),
+            '/en_US/m%d/some-page' % module,
+            '/en_US/static/css/site.css',
+        ]))
+    return paths
+
+
+def time_matching(map_class, count, paths):
+    adapter = map_class(get_rules(count)).bind('localhost')
+    for path in paths:
+        # Warm up (sort the rules, build the trie) and check every path
+        # is matched
+        adapter.match(path)
+
+    def run():
+        for path in paths:
+            adapter.match(path)
+
+    # Best of the runs, per match, in microseconds
+    return min(timeit.repeat(run, number=1, repeat=5)) / len(paths) * 10 ** 6
+
+
+def main():
+    random.seed(0)
+    print '%8s %14s %14s %8s' % (
+        'rules', 'Map (us)', 'TrieMap (us)', 'speedup'
+    )
+    for count in RULE_COUNTS:
+        paths = get_paths(count)
+        map_time = time_matching(Map, count, paths)
+        trie_time = time_matching(TrieMap, count, paths)
+        print '%8d %14.2f %14.2f %7.1fx' % (
+            count, map_time, trie_time, map_time / trie_time
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -4,8 +4,11 @@
 from __future__ import with_statement
 
 import os  # noqa
+import time
 import warnings
 import inspect
+from hashlib import md5
+from multiprocessing.pool import ThreadPool
 
 from flask import Flask
 from flask.config import ConfigAttribute
@@ -27,12 +30,15 @@ from trytond.transaction import Transaction
 from .wrappers import Request, Response
 from .session import NereidSessionInterface
 from .templating import nereid_default_template_ctx_processor, \
-    NEREID_TEMPLATE_FILTERS, ModuleTemplateLoader, LazyRenderer
+    NEREID_TEMPLATE_FILTERS, ModuleTemplateLoader, LazyRenderer, \
+    TranslatedTemplateLoader
 from .helpers import url_for, root_transaction_if_required
 from .ctx import RequestContext
 from .csrf import NereidCsrfProtect
 from .signals import transaction_start, transaction_stop, transaction_commit
 from .routing import Rule
+from .throttling import Limit, check_throttle
+from .jobs import run_job
 from .globals import current_locale, current_website
 
 
@@ -153,6 +159,40 @@ class Nereid(Flask):
         'TOKEN_VALIDITY_DURATION'
     )
 
+    #: Time in seconds for which verified Basic auth credentials are
+    #: remembered in the cache, so that API clients sending their
+    #: credentials on every request do not hash the password every time.
+    #: Set to 0 to disable.
+    basic_auth_cache_timeout = ConfigAttribute('BASIC_AUTH_CACHE_TIMEOUT')
+
+    #: The throttle limits of the URL rules by endpoint, which override the
+    #: limits set with the throttle option of the rule. An empty list
+    #: disables the throttling of the endpoint. See
+    #: :class:`~nereid.throttling.Limit`
+    throttle = ConfigAttribute('THROTTLE')
+
+    #: The throttle limits of Basic authentication attempts which are not
+    #: in the cache of verified credentials. See
+    #: :class:`~nereid.throttling.Limit`
+    basic_auth_throttle = ConfigAttribute('BASIC_AUTH_THROTTLE')
+
+    #: The number of threads which run the jobs deferred with
+    #: :func:`~nereid.jobs.defer` after the transaction of the request is
+    #: committed. With 0 the jobs are run before the response is returned.
+    deferred_job_workers = ConfigAttribute('DEFERRED_JOB_WORKERS')
+
+    #: Match URLs with a :class:`~nereid.routing.TrieMap` which only tries
+    #: the rules that could match the static segments of the path. Useful
+    #: when many modules contribute URL rules.
+    trie_url_matching = ConfigAttribute('TRIE_URL_MATCHING')
+
+    #: Compile a variant of the templates for every language with the
+    #: translation of constant strings in them. See
+    #: :class:`~nereid.templating.TranslatedTemplateLoader`
+    template_compile_translations = ConfigAttribute(
+        'TEMPLATE_COMPILE_TRANSLATIONS'
+    )
+
     def __init__(self, **config):
         """
         The import_name is forced into `Nereid`
@@ -164,6 +204,12 @@ class Nereid(Flask):
             'TRYTON_CONFIG': None,
             'TEMPLATE_PREFIX_WEBSITE_NAME': True,
             'TOKEN_VALIDITY_DURATION': 60 * 60,
+            'BASIC_AUTH_CACHE_TIMEOUT': 60,
+            'BASIC_AUTH_THROTTLE': [
+                Limit(60, 60, key='ip'), Limit(10, 300, key='email'),
+            ],
+            'THROTTLE': {},
+            'DEFERRED_JOB_WORKERS': 2,
 
             'CACHE_TYPE': 'werkzeug.contrib.cache.NullCache',
             'CACHE_DEFAULT_TIMEOUT': 300,
@@ -172,6 +218,9 @@ class Nereid(Flask):
             'CACHE_KEY_PREFIX': '',
 
             'EAGER_TEMPLATE_RENDER': False,
+
+            'TRIE_URL_MATCHING': False,
+            'TEMPLATE_COMPILE_TRANSLATIONS': False,
         })
 
     def initialise(self):
@@ -238,16 +287,17 @@ class Nereid(Flask):
         # Finally set the initialised attribute
         self.initialised = True
 
-    def get_urls(self):
+    def find_url_rule_definitions(self):
         """
-        Return the URL rules for routes formed by decorating methods with the
-        :func:`~nereid.helpers.route` decorator.
+        Return the definitions of the routes formed by decorating methods
+        with the :func:`~nereid.helpers.route` decorator as a list of
+        `(rule, endpoint, options)` tuples.
 
         This method goes through all the models and their methods in the pool
         of the loaded database and looks for the `_url_rules` attribute in
-        them. If there are URLs defined, it is added to the url map.
+        them.
         """
-        rules = []
+        definitions = []
         models = Pool._pool[self.database_name]['model']
 
         for model_name, model in models.iteritems():
@@ -257,20 +307,135 @@ class Nereid(Flask):
                 if not hasattr(f, '_url_rules'):
                     continue
 
-                for rule in f._url_rules:
-                    rule_obj = self.url_rule_class(
-                        rule[0],
-                        endpoint='.'.join([model_name, f_name]),
-                        **rule[1]
+                for rule, options in f._url_rules:
+                    definitions.append(
+                        (rule, '.'.join([model_name, f_name]), options)
                     )
-                    rules.append(rule_obj)
-                    if rule_obj.is_csrf_exempt:
-                        self.csrf_protection._exempt_views.add(
-                            rule_obj.endpoint
-                        )
+
+        return definitions
+
+    @locked_cached_property
+    def deferred_job_pool(self):
+        """
+        The pool of threads which run the deferred jobs, or None if they are
+        run in the thread of the request. The pool is created on first use,
+        so each worker process gets its own.
+        """
+        if not self.deferred_job_workers:
+            return None
+        return ThreadPool(self.deferred_job_workers)
+
+    def run_deferred_job(self, job):
+        """
+        Run a job deferred with :func:`~nereid.jobs.defer`
+        """
+        run_job(self, job)
+
+    @locked_cached_property
+    def url_rules_version(self):
+        """
+        A version of the routes of the models in the pool. It changes when
+        the module files defining the models change.
+        """
+        filenames = set()
+        models = Pool._pool[self.database_name]['model']
+        for model in models.itervalues():
+            for klass in inspect.getmro(model):
+                try:
+                    filenames.add(inspect.getfile(klass))
+                except TypeError:
+                    # Built-in classes like object
+                    pass
+
+        version = md5(self.database_name)
+        for filename in sorted(filenames):
+            try:
+                mtime = os.path.getmtime(filename)
+            except OSError:
+                mtime = None
+            version.update('%s:%s' % (filename, mtime))
+        return version.hexdigest()
+
+    @property
+    def url_rules_cache_key(self):
+        """
+        The key under which the route definitions are stored in the cache
+        """
+        return '%s-url-rules-%s' % (self.database_name, self.url_rules_version)
+
+    @locked_cached_property
+    def url_rule_definitions(self):
+        """
+        The definitions of the routes returned by
+        :meth:`find_url_rule_definitions`.
+
+        The definitions are stored in the application cache, so that with a
+        shared cache (like memcached or the filesystem cache) only one of the
+        processes walks through the models. The others wait for it and load
+        the definitions from the cache.
+        """
+        key = self.url_rules_cache_key
+        lock_key = key + '-lock'
+        lock_timeout = 60
+
+        definitions = self.cache.get(key)
+        if definitions is not None:
+            return definitions
+
+        deadline = time.time() + lock_timeout
+        while not self.cache.add(lock_key, True, timeout=lock_timeout):
+            # Another process is finding the definitions
+            time.sleep(0.05)
+            definitions = self.cache.get(key)
+            if definitions is not None:
+                return definitions
+            if time.time() > deadline:
+                break
+
+        try:
+            definitions = self.find_url_rule_definitions()
+            self.cache.set(key, definitions, timeout=0)
+        finally:
+            self.cache.delete(lock_key)
+        return definitions
+
+    def get_urls(self):
+        """
+        Return the URL rules for routes formed by decorating methods with the
+        :func:`~nereid.helpers.route` decorator.
+
+        The rules are built from :attr:`url_rule_definitions`.
+        """
+        rules = []
+
+        for rule, endpoint, options in self.url_rule_definitions:
+            rule_obj = self.url_rule_class(rule, endpoint=endpoint, **options)
+            rules.append(rule_obj)
+            if rule_obj.is_csrf_exempt:
+                self.csrf_protection._exempt_views.add(rule_obj.endpoint)
 
         return rules
 
+    @locked_cached_property
+    def url_rules_hash(self):
+        """
+        A hash of the URL rules of the application (the routes from
+        :meth:`get_urls` and the rules in the url map). Websites share
+        compiled URL maps with the same rules hash.
+        """
+        definitions = [
+            (
+                rule.rule, rule.endpoint, sorted(rule.methods or []),
+                sorted((rule.defaults or {}).items()), rule.subdomain,
+                rule.host, rule.build_only, rule.strict_slashes,
+                rule.redirect_to, getattr(rule, 'readonly', None),
+                getattr(rule, 'is_csrf_exempt', False),
+                getattr(rule, 'throttle', None),
+            )
+            for rule in self.get_urls() + list(self.url_map.iter_rules())
+        ]
+        return md5(repr((self.static_url_path, definitions))).hexdigest()
+
     @root_transaction_if_required
     def get_context_processors(self):
         """
@@ -420,6 +585,9 @@ class Nereid(Flask):
            and req.method == 'OPTIONS':
             return self.make_default_options_response()
 
+        # Reject throttled requests before any database work
+        check_throttle(self.get_throttle_limits(rule), rule.endpoint)
+
         with Transaction().start(self.database_name, 0):
             Cache.clean(self.database_name)
             Cache.resets(self.database_name)
@@ -435,18 +603,22 @@ class Nereid(Flask):
         # pop locale if specified in the view_args
         req.view_args.pop('locale', None)
         active_id = req.view_args.pop('active_id', None)
+        readonly = rule.is_readonly_for(req.method)
 
         for count in range(int(config.get('database', 'retry')), -1, -1):
             with Transaction().start(
                     self.database_name, user,
                     context=website_context,
-                    readonly=rule.is_readonly) as txn:
+                    readonly=readonly) as txn:
                 try:
                     transaction_start.send(self)
                     rv = self._dispatch_request(
                         req, language=language, active_id=active_id
                     )
                     txn.commit()
+                    # Publish the caches cleared by the request to the
+                    # other workers once its changes are visible to them
+                    Cache.resets(self.database_name)
                     transaction_commit.send(self)
                 except DatabaseOperationalError:
                     # Strict transaction handling may cause this.
@@ -465,6 +637,16 @@ class Nereid(Flask):
                 finally:
                     transaction_stop.send(self)
 
+    def get_throttle_limits(self, rule):
+        """
+        Returns the throttle limits of the rule, from the THROTTLE setting
+        or the throttle option of the rule.
+        """
+        throttle = self.throttle
+        if throttle and rule.endpoint in throttle:
+            return throttle[rule.endpoint]
+        return getattr(rule, 'throttle', None)
+
     def _dispatch_request(self, req, language, active_id):
         """
         Implement the nereid specific _dispatch
@@ -538,6 +720,11 @@ class Nereid(Flask):
         rv.install_gettext_callables(
             translations.gettext, translations.ngettext
         )
+
+        if self.template_compile_translations:
+            # The translated variants are cached by the loader
+            rv.loader = TranslatedTemplateLoader(rv.loader)
+            rv.cache = None
         return rv
 
     @locked_cached_property
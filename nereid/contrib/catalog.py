@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+    Binary translation catalogs in the GNU .mo format.
+
+    The catalogs are written with the hash table of the format, so that
+    a :class:`MappedCatalog` can look messages up in a memory mapped file
+    without loading the messages into a dictionary. Workers mapping the same
+    file share its pages.
+"""
+import os
+import mmap
+import struct
+import tempfile
+
+MAGIC = 0x950412de
+
+#: Separates the context from the message in the keys of a catalog
+CONTEXT_SEPARATOR = '\x04'
+
+
+def catalog_key(ttype, module, source):
+    """
+    Returns the key of a message in the catalog. The type and module of
+    the translation are stored as the context of the message. A module of
+    None is the context for the translation from any module.
+    """
+    if isinstance(source, str):
+        source = source.decode('utf-8')
+    return (u'%s:%s%s%s' % (
+        ttype, module or '', CONTEXT_SEPARATOR, source
+    )).encode('utf-8')
+
+
+def hashpjw(string):
+    """
+    The hash function used for the hash table of GNU gettext catalogs
+    """
+    value = 0
+    for char in bytearray(string):
+        value = (value << 4) + char
+        high = value & 0xf0000000
+        if high:
+            value ^= high >> 24
+            value ^= high
+    return value
+
+
+def _is_prime(number):
+    if number % 2 == 0:
+        return number == 2
+    divisor = 3
+    while divisor * divisor <= number:
+        if number % divisor == 0:
+            return False
+        divisor += 2
+    return True
+
+
+def _next_prime(number):
+    while not _is_prime(number):
+        number += 1
+    return number
+
+
+def write_mo(fileobj, messages):
+    """
+    Write the messages to the file object as a GNU .mo catalog with a hash
+    table.
+
+    :param messages: A dictionary of translations by message. Both are
+                     byte strings (utf-8 encoded).
+    """
+    messages = dict(messages)
+    # The header entry, which gettext tools use for the charset
+    messages.setdefault('', 'Content-Type: text/plain; charset=UTF-8\n')
+
+    keys = sorted(messages)
+    count = len(keys)
+    hash_size = _next_prime(max(3, count * 4 // 3))
+
+    keys_offset = 7 * 4
+    values_offset = keys_offset + count * 8
+    hash_offset = values_offset + count * 8
+    strings_offset = hash_offset + hash_size * 4
+
+    key_table, value_table, strings = [], [], []
+    offset = strings_offset
+    for key in keys:
+        key_table.append((len(key), offset))
+        strings.append(key + '\0')
+        offset += len(key) + 1
+    for key in keys:
+        value = messages[key]
+        value_table.append((len(value), offset))
+        strings.append(value + '\0')
+        offset += len(value) + 1
+
+    hash_table = [0] * hash_size
+    for index, key in enumerate(keys):
+        value = hashpjw(key)
+        position = value % hash_size
+        increment = 1 + value % (hash_size - 2)
+        while hash_table[position]:
+            position = (position + increment) % hash_size
+        hash_table[position] = index + 1
+
+    fileobj.write(struct.pack(
+        '<7I', MAGIC, 0, count, keys_offset, values_offset,
+        hash_size, hash_offset
+    ))
+    for length, offset in key_table + value_table:
+        fileobj.write(struct.pack('<2I', length, offset))
+    fileobj.write(struct.pack('<%dI' % hash_size, *hash_table))
+    fileobj.write(''.join(strings))
+
+
+def save_mo(path, messages):
+    """
+    Write the messages to a .mo catalog at the given path. The catalog is
+    written to a temporary file first and renamed, so that workers reading
+    the previous catalog keep a consistent mapping.
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.mo.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fileobj:
+            write_mo(fileobj, messages)
+        os.rename(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+
+class MappedCatalog(object):
+    """
+    A read only GNU .mo catalog mapped in memory. Messages are looked up
+    with the hash table of the catalog.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fileobj:
+            stat = os.fstat(fileobj.fileno())
+            self._mmap = mmap.mmap(
+                fileobj.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        #: Identifies the mapped file: exports replace the file, so a new
+        #: export has a different identity
+        self.identity = (stat.st_ino, stat.st_mtime)
+
+        magic, = struct.unpack_from('<I', self._mmap, 0)
+        if magic == MAGIC:
+            self._endian = '<'
+        elif magic == struct.unpack('>I', struct.pack('<I', MAGIC))[0]:
+            self._endian = '>'
+        else:
+            raise ValueError('%s is not a .mo catalog' % path)
+        (
+            _, _, self.count, self._keys_offset, self._values_offset,
+            self._hash_size, self._hash_offset
+        ) = struct.unpack_from(self._endian + '7I', self._mmap, 0)
+
+    def __len__(self):
+        return self.count
+
+    def _string(self, table_offset, index):
+        length, offset = struct.unpack_from(
+            self._endian + '2I', self._mmap, table_offset + index * 8
+        )
+        return self._mmap[offset:offset + length]
+
+    def _find(self, key):
+        """
+        Returns the index of the key in the catalog or None
+        """
+        hash_size = self._hash_size
+        if hash_size > 2:
+            value = hashpjw(key)
+            position = value % hash_size
+            increment = 1 + value % (hash_size - 2)
+            entry_format = self._endian + 'I'
+            while True:
+                entry, = struct.unpack_from(
+                    entry_format, self._mmap, self._hash_offset + position * 4
+                )
+                if not entry:
+                    return None
+                if self._string(self._keys_offset, entry - 1) == key:
+                    return entry - 1
+                position = (position + increment) % hash_size
+
+        # No hash table, do a binary search on the sorted keys
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            current = self._string(self._keys_offset, middle)
+            if current == key:
+                return middle
+            if current < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def get(self, key, default=None):
+        """
+        Returns the translation (unicode) of the key (a utf-8 byte string)
+        """
+        index = self._find(key)
+        if index is None:
+            return default
+        return self._string(self._values_offset, index).decode('utf-8')
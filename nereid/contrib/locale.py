@@ -3,7 +3,7 @@
 import gettext
 
 import flask.ext.babel
-from speaklater import is_lazy_string, make_lazy_string
+from speaklater import is_lazy_string, _LazyString
 from flask.ext.babel import Babel  # noqa
 from babel import Locale
 from pytz import timezone
@@ -91,10 +91,55 @@ class TrytonTranslations(gettext.NullTranslations, object):
             self.ungettext(singular, plural, n)
         ) % variables
 
+    def get_version(self):
+        """
+        Returns a key of the current language and the version of its
+        catalog. Translations of the catalog do not change while the key
+        is the same.
+        """
+        IRTranslation = Pool().get('ir.translation')
+
+        language = Transaction().language
+        return language, IRTranslation.get_nereid_translation_version(
+            self.module, self.ttype, language
+        )
+
     gettext = ugettext
     ngettext = ungettext
 
 
+class LazyTranslation(_LazyString):
+    """
+    A lazy string which translates with a method of
+    :class:`TrytonTranslations`. The translated value is memoized for the
+    language and version of the catalog it was translated with, so that
+    labels used on every page are not looked up every time they are
+    rendered.
+    """
+    __slots__ = ('_memo', )
+
+    def __init__(self, func, args, kwargs):
+        super(LazyTranslation, self).__init__(func, args, kwargs)
+        self._memo = None
+
+    @property
+    def value(self):
+        if Transaction().database is None:
+            return self._func(*self._args, **self._kwargs)
+
+        key = self._func.__self__.get_version()
+        memo = self._memo
+        if memo is not None and memo[0] == key:
+            return memo[1]
+        value = self._func(*self._args, **self._kwargs)
+        self._memo = (key, value)
+        return value
+
+    def __setstate__(self, tup):
+        super(LazyTranslation, self).__setstate__(tup)
+        self._memo = None
+
+
 def get_translations():
     """
     Returns the correct gettext translations that should be used for
@@ -189,12 +234,13 @@ def make_lazy_gettext(module):
         _ = make_lazy_gettext('module_name')
 
     """
+    translations = TrytonTranslations(module, 'nereid')
+
     def lazy_gettext(string, **variables):
         if is_lazy_string(string):
             return string
-        translations = TrytonTranslations(module, 'nereid')
-        return make_lazy_string(
-            translations.lazy_ugettext, string, **variables
+        return LazyTranslation(
+            translations.lazy_ugettext, (string, ), variables
         )
     return lazy_gettext
 
@@ -211,9 +257,10 @@ def make_lazy_ngettext(module):
         ngettext = make_lazy_ngettext('module_name')
 
     """
+    translations = TrytonTranslations(module, 'nereid')
+
     def lazy_gettext(singular, plural, number, **variables):
-        translations = TrytonTranslations(module, 'nereid')
-        return make_lazy_string(
-            translations.lazy_ungettext, singular, plural, number, **variables
+        return LazyTranslation(
+            translations.lazy_ungettext, (singular, plural, number), variables
         )
     return lazy_gettext
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+    Incremental reading and writing of gettext PO files.
+
+    :func:`iter_po_entries` parses the entries of a PO file one at a time
+    and :class:`POWriter` writes entries as they are produced, so that large
+    catalogs are never held in memory as a whole. Both work with
+    :class:`polib.POEntry` objects.
+"""
+import re
+
+import polib
+
+_field_re = re.compile(
+    r'^(msgctxt|msgid_plural|msgid|msgstr(?:\[(\d+)\])?)\s+'
+)
+
+
+def _unquote(string, lineno):
+    string = string.strip()
+    if len(string) < 2 or string[0] != '"' or string[-1] != '"':
+        raise ValueError('Syntax error in PO file (line %s)' % lineno)
+    return polib.unescape(string[1:-1])
+
+
+def iter_po_entries(fileobj, encoding='utf-8'):
+    """
+    Yields the entries of a PO file as :class:`polib.POEntry` objects. The
+    header entry and obsolete entries are skipped.
+
+    :param fileobj: a file object open in binary mode
+    :param encoding: the encoding of the file
+    """
+    entry, field, index, seen_msgstr = None, None, None, False
+    obsolete = False
+
+    def finish(entry):
+        if entry is None or obsolete:
+            return None
+        if entry.msgid == '' and entry.msgctxt is None:
+            # The header entry holds the metadata
+            return None
+        return entry
+
+    for lineno, line in enumerate(fileobj, 1):
+        line = line.decode(encoding).strip()
+
+        if not line:
+            done = finish(entry)
+            if done is not None:
+                yield done
+            entry, field, seen_msgstr, obsolete = None, None, False, False
+            continue
+
+        if line.startswith('#~'):
+            obsolete = True
+            continue
+
+        if line.startswith('#') or \
+                line.startswith('msgctxt') or line.startswith('msgid '):
+            if seen_msgstr:
+                # A new entry starts without a blank line in between
+                done = finish(entry)
+                if done is not None:
+                    yield done
+                entry, field, seen_msgstr, obsolete = None, None, False, False
+            if entry is None:
+                entry = polib.POEntry()
+
+        if line.startswith('#'):
+            if line.startswith('#,'):
+                entry.flags.extend(
+                    flag.strip() for flag in line[2:].split(',')
+                    if flag.strip()
+                )
+            elif line.startswith('#.'):
+                entry.comment = '\n'.join(
+                    filter(None, [entry.comment, line[2:].strip()])
+                )
+            elif line.startswith('#:'):
+                for occurrence in line[2:].split():
+                    path, _, occurrence_lineno = occurrence.rpartition(':')
+                    if path:
+                        entry.occurrences.append((path, occurrence_lineno))
+                    else:
+                        entry.occurrences.append((occurrence, ''))
+            elif not line.startswith('#|'):
+                entry.tcomment = '\n'.join(
+                    filter(None, [entry.tcomment, line[1:].strip()])
+                )
+            continue
+
+        if line.startswith('"'):
+            if entry is None or field is None:
+                raise ValueError(
+                    'Syntax error in PO file (line %s)' % lineno
+                )
+            value = _unquote(line, lineno)
+            if field == 'msgstr_plural':
+                entry.msgstr_plural[index] += value
+            else:
+                setattr(entry, field, getattr(entry, field) + value)
+            continue
+
+        match = _field_re.match(line)
+        if match is None or entry is None:
+            raise ValueError('Syntax error in PO file (line %s)' % lineno)
+        value = _unquote(line[match.end():], lineno)
+        name = match.group(1)
+        if name.startswith('msgstr['):
+            field, index = 'msgstr_plural', int(match.group(2))
+            entry.msgstr_plural[index] = value
+            seen_msgstr = True
+        else:
+            field = name
+            setattr(entry, field, value)
+            if field == 'msgstr':
+                seen_msgstr = True
+
+    done = finish(entry)
+    if done is not None:
+        yield done
+
+
+class POWriter(object):
+    """
+    Writes a PO file entry by entry to a file object in binary mode.
+
+    :param metadata: a dictionary of the metadata of the header entry
+    """
+
+    def __init__(self, fileobj, metadata=None, wrapwidth=78,
+                 encoding='utf-8'):
+        self.fileobj = fileobj
+        self.wrapwidth = wrapwidth
+        self.encoding = encoding
+        self.count = 0
+
+        header = polib.POFile(wrapwidth=wrapwidth, encoding=encoding)
+        header.metadata = metadata or {}
+        self.fileobj.write(unicode(header).encode(encoding))
+
+    def write(self, entry):
+        """
+        Write an entry to the file
+        """
+        self.fileobj.write(
+            (u'\n' + entry.__unicode__(self.wrapwidth)).encode(self.encoding)
+        )
+        self.count += 1
@@ -16,3 +16,7 @@ class RequestContext(RequestContextBase):
         super(RequestContext, self).__init__(app, environ, request)
         self.transaction = None
         self.cache = app.cache
+
+        #: URLs built by :func:`~nereid.helpers.url_for` during this request,
+        #: keyed by the endpoint and the values passed to it.
+        self.url_build_cache = {}
@@ -3,6 +3,10 @@
 from flask.globals import (_request_ctx_stack, current_app,  # noqa
     request, session, g, LocalProxy, _find_app)
 from flask.ext.login import current_user                     # noqa
+from trytond.transaction import Transaction
+from trytond.cache import freeze
+
+from .signals import transaction_start, transaction_stop
 
 
 def _find_cache():
@@ -14,12 +18,48 @@ def _find_cache():
     return app.cache
 
 
+def _get_record(model, record_id):
+    """
+    Returns the record shared by the current request and transaction, so
+    that the fields read through a global are read once per request.
+
+    Records are bound to the transaction and the context they are
+    instantiated in, so a record is only shared within the transaction it
+    was created in and with the same context (e.g. language). A record is
+    not shared when the context cannot be hashed.
+    """
+    ctx = _request_ctx_stack.top
+    transaction = Transaction()
+    records = getattr(ctx, 'nereid_records', None)
+    if records is None or records[0] is not transaction:
+        records = ctx.nereid_records = (transaction, {})
+    key = (model, record_id, freeze(transaction.context))
+    try:
+        record = records[1].get(key)
+    except TypeError:
+        return current_app.pool.get(model)(record_id)
+    if record is None:
+        record = records[1][key] = current_app.pool.get(model)(record_id)
+    return record
+
+
+@transaction_start.connect
+@transaction_stop.connect
+def _clear_records(app):
+    """
+    Clear the records shared by the request when its transaction starts or
+    stops
+    """
+    ctx = _request_ctx_stack.top
+    if ctx is not None:
+        ctx.nereid_records = None
+
+
 def _get_locale():
-    Locale = current_app.pool.get('nereid.website.locale')
     locale_id = getattr(_request_ctx_stack.top, 'locale', None)
     if locale_id is None:
         locale_id = _set_locale()
-    return Locale(locale_id)
+    return _get_record('nereid.website.locale', locale_id)
 
 
 def _set_locale():
@@ -30,11 +70,10 @@ def _set_locale():
 
 
 def _get_website():
-    Website = current_app.pool.get('nereid.website')
     website_id = getattr(_request_ctx_stack.top, 'website', None)
     if website_id is None:
         website_id = _set_website()
-    return Website(website_id)
+    return _get_record('nereid.website', website_id)
 
 
 def _set_website():
@@ -22,12 +22,30 @@ from werkzeug import Headers, wrap_file, redirect, abort
 from werkzeug.exceptions import NotFound
 from flask.ext.login import login_required      # noqa
 
-from .globals import current_app, request, current_locale, current_website, current_user  # noqa
+from .globals import current_app, request, current_locale, current_website, current_user, _request_ctx_stack  # noqa
 
 
 _SLUGIFY_STRIP_RE = re.compile(r'[^\w\s-]')
 _SLUGIFY_HYPHENATE_RE = re.compile(r'[-\s]+')
 
+_missing = object()
+
+
+def _get_url_locale():
+    """
+    Returns the locale code to be added to URLs built in the current
+    request, or None if the website does not use locales.
+
+    The decision needs a read of the locales of the website and is hence
+    made only once per request.
+    """
+    ctx = _request_ctx_stack.top
+    rv = getattr(ctx, 'url_locale', _missing)
+    if rv is _missing:
+        rv = current_locale.code if current_website.locales else None
+        ctx.url_locale = rv
+    return rv
+
 
 def url_for(endpoint, **values):
     """
@@ -60,13 +78,33 @@ def url_for(endpoint, **values):
             DeprecationWarning, stacklevel=2
         )
 
+    # URLs built within a request depend only on the endpoint and the
+    # values, so memoize them for the rest of the request.
+    build_cache = getattr(_request_ctx_stack.top, 'url_build_cache', None)
+    cache_key = None
+    if build_cache is not None:
+        try:
+            cache_key = (endpoint, frozenset(values.iteritems()))
+        except TypeError:
+            # Unhashable values (like a list of query arguments) cannot be
+            # used in the key. Build the URL without caching it.
+            pass
+        else:
+            rv = build_cache.get(cache_key)
+            if rv is not None:
+                return rv
+
     # 'static' is Flask's default endpoint for static files.
     # There is no need to set language in URL for static files
-    if endpoint != 'static' and \
-            'locale' not in values and current_website.locales:
-        values['locale'] = current_locale.code
-
-    return flask_url_for(endpoint, **values)
+    if endpoint != 'static' and 'locale' not in values:
+        locale = _get_url_locale()
+        if locale is not None:
+            values['locale'] = locale
+
+    rv = flask_url_for(endpoint, **values)
+    if cache_key is not None:
+        build_cache[cache_key] = rv
+    return rv
 
 
 def secure(function):
@@ -0,0 +1,159 @@
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+    Jobs deferred until the transaction of the request is committed.
+
+    Work which is not needed for the response, like rendering and queueing
+    emails, is deferred with :func:`defer`. The jobs are collected while the
+    request is handled and submitted to the job pool of the application
+    once the transaction of the request is committed, so that the response
+    is returned without waiting for them and nothing is done for a request
+    whose transaction is rolled back.
+
+    Each job runs in a transaction of its own with the user and context of
+    the request, and in a copy of the request context so that templates can
+    build URLs and use the website and locale of the request.
+"""
+from StringIO import StringIO
+
+from trytond import backend
+from trytond.config import config
+from trytond.model import Model
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+
+from .globals import _request_ctx_stack
+from .signals import transaction_start, transaction_commit, transaction_stop
+
+
+class Job(object):
+    """
+    A deferred call with the state of the request it was deferred in
+    """
+
+    def __init__(self, func, args, kwargs):
+        # Records are bound to the transaction of the request, so the job
+        # keeps the model and id to read the record again.
+        record = getattr(func, 'im_self', None)
+        if isinstance(record, Model):
+            self.method = (record.__name__, record.id, func.__name__)
+            func = None
+        else:
+            self.method = None
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+        transaction = Transaction()
+        self.user = transaction.user
+        self.context = transaction.context.copy()
+
+        ctx = _request_ctx_stack.top
+        environ = dict(ctx.request.environ)
+        # The body of the request is consumed by the request itself
+        environ['wsgi.input'] = StringIO()
+        environ['CONTENT_LENGTH'] = '0'
+        environ.pop('werkzeug.request', None)
+        self.environ = environ
+        self.website = getattr(ctx, 'website', None)
+        self.locale = getattr(ctx, 'locale', None)
+
+    def __repr__(self):
+        if self.method:
+            return '<Job %s(%s).%s>' % self.method
+        return '<Job %s>' % getattr(self.func, '__name__', self.func)
+
+    def __call__(self):
+        """
+        Call the function of the job in the current transaction
+        """
+        func = self.func
+        if self.method:
+            model, id_, name = self.method
+            func = getattr(Pool().get(model)(id_), name)
+        return func(*self.args, **self.kwargs)
+
+
+def defer(func, *args, **kwargs):
+    """
+    Call the function with the arguments once the transaction of the
+    current request is committed. Outside of a request dispatched by the
+    application (in tests or Tryton RPC calls for example), the function is
+    called immediately.
+
+    The records of bound methods are read again in the transaction of the
+    job. Records in the arguments should be passed as ids.
+    """
+    ctx = _request_ctx_stack.top
+    jobs = getattr(ctx, 'deferred_jobs', None)
+    if jobs is None:
+        return func(*args, **kwargs)
+    jobs.append(Job(func, args, kwargs))
+
+
+def run_job(app, job):
+    """
+    Run the job in a transaction of its own and a copy of the request
+    context it was deferred in. Failing jobs are logged.
+    """
+    DatabaseOperationalError = backend.get('DatabaseOperationalError')
+
+    with app.request_context(job.environ) as ctx:
+        if job.website is not None:
+            ctx.website = job.website
+        if job.locale is not None:
+            ctx.locale = job.locale
+
+        for count in range(int(config.get('database', 'retry')), -1, -1):
+            # The transaction is committed when the job returns and rolled
+            # back when it raises
+            try:
+                with Transaction(new=True).start(
+                        app.database_name, job.user, context=job.context):
+                    job()
+            except DatabaseOperationalError:
+                if count:
+                    continue
+                app.logger.exception('Deferred job %r failed', job)
+            except Exception:
+                app.logger.exception('Deferred job %r failed', job)
+            return
+
+
+@transaction_start.connect
+def collect_jobs(app):
+    """
+    Start collecting the jobs deferred during the request
+    """
+    ctx = _request_ctx_stack.top
+    if ctx is not None:
+        ctx.deferred_jobs = []
+
+
+@transaction_commit.connect
+def submit_jobs(app):
+    """
+    Submit the jobs deferred during the request once its transaction is
+    committed
+    """
+    ctx = _request_ctx_stack.top
+    jobs = getattr(ctx, 'deferred_jobs', None)
+    if not jobs:
+        return
+    ctx.deferred_jobs = []
+    pool = app.deferred_job_pool
+    for job in jobs:
+        if pool is None:
+            app.run_deferred_job(job)
+        else:
+            pool.apply_async(app.run_deferred_job, (job,))
+
+
+@transaction_stop.connect
+def discard_jobs(app):
+    """
+    Discard the jobs of a transaction which was not committed
+    """
+    ctx = _request_ctx_stack.top
+    if ctx is not None:
+        ctx.deferred_jobs = None
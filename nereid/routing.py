@@ -11,7 +11,10 @@
     :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
     :license: BSD, see LICENSE for more details.
 """
+from threading import Lock
+
 from werkzeug import routing
+from werkzeug._compat import to_unicode
 from nereid import request
 
 
@@ -40,12 +43,62 @@ class Map(routing.Map):
                     return rv
 
 
+class _AllMethods(object):
+    """
+    A set of HTTP methods which contains every method
+    """
+    def __contains__(self, method):
+        return True
+
+
+_ALL_METHODS = _AllMethods()
+
+
 class Rule(routing.Rule):
+    """
+    A werkzeug rule with the nereid specific options:
+
+    :param readonly: If not None, the transaction of the request is readonly
+                     (or not) for all methods. By default only GET and HEAD
+                     requests get a readonly transaction.
+    :param exempt_csrf: Exempt the view from CSRF protection.
+    :param writes_on_get: Declares that the view writes to the database on
+                          GET (and HEAD) requests, which then get a read-write
+                          transaction. Such rules can be audited by listing
+                          the rules of the map with this attribute set.
+    :param throttle: A :class:`~nereid.throttling.Limit` or a list of them
+                     for the requests to the rule. Requests over the limit
+                     are rejected before any database work. The limits can
+                     be overridden by endpoint with the THROTTLE setting
+                     of the application.
+    """
+
+    #: Methods for which a readonly transaction is used by default
+    readonly_methods = frozenset(['GET', 'HEAD'])
 
     def __init__(self, *args, **kwargs):
         self.readonly = kwargs.pop('readonly', None)
         self.is_csrf_exempt = kwargs.pop('exempt_csrf', False)
+        self.writes_on_get = kwargs.pop('writes_on_get', False)
+        self.throttle = kwargs.pop('throttle', None)
         super(Rule, self).__init__(*args, **kwargs)
+        self._readonly_methods = None
+
+    def bind(self, map, rebind=False):
+        super(Rule, self).bind(map, rebind)
+        self._readonly_methods = self._get_readonly_methods()
+
+    def _get_readonly_methods(self):
+        """
+        Returns the set of methods for which the transaction is readonly
+        """
+        if self.readonly is not None:
+            # If a value that is not None is explicitly set for the URL,
+            # then use that for all methods.
+            return _ALL_METHODS if self.readonly else frozenset()
+        if self.writes_on_get:
+            return frozenset()
+        return self.readonly_methods
 
     def empty(self):
         """Return an unbound copy of this rule.  This can be useful if you
@@ -59,14 +112,201 @@ class Rule(routing.Rule):
         return self.__class__(
             self.rule, defaults, self.subdomain, self.methods,
             self.build_only, self.endpoint, self.strict_slashes,
-            self.redirect_to, self.alias, self.host
+            self.redirect_to, self.alias, self.host,
+            readonly=self.readonly, exempt_csrf=self.is_csrf_exempt,
+            writes_on_get=self.writes_on_get, throttle=self.throttle,
         )
 
+    def is_readonly_for(self, method):
+        """
+        Returns True if the transaction for a request with the given method
+        should be readonly.
+        """
+        readonly_methods = self._readonly_methods
+        if readonly_methods is None:
+            # Not bound to a map yet
+            readonly_methods = self._get_readonly_methods()
+        return method in readonly_methods
+
     @property
     def is_readonly(self):
-        if self.readonly is not None:
-            # If a value that is not None is explicitly set for the URL,
-            # then return that.
-            return self.readonly
-        # By default GET and HEAD requests are allocated a readonly cursor
-        return request.method in ('HEAD', 'GET')
+        return self.is_readonly_for(request.method)
+
+
+class _TrieNode(object):
+    """
+    A node in the trie of :class:`TrieMap`. Rules are stored as their index
+    in the map so that the candidates can be returned in matching order.
+    """
+    __slots__ = ('static', 'dynamic', 'rules', 'tail')
+
+    def __init__(self):
+        #: Children for static segments keyed by the segment
+        self.static = {}
+
+        #: Child for segments with converters that match a single segment
+        self.dynamic = None
+
+        #: Rules ending at this node
+        self.rules = []
+
+        #: Rules whose remaining part could span more than one segment
+        #: (like a path converter). They are candidates for every path
+        #: below this node.
+        self.tail = []
+
+    def collect(self, segments, pos, rv):
+        rv.extend(self.tail)
+        if pos == len(segments):
+            rv.extend(self.rules)
+            # Rules with a trailing slash match (and redirect) the path
+            # without it
+            child = self.static.get(u'')
+            if child is not None:
+                rv.extend(child.rules)
+            return
+        child = self.static.get(segments[pos])
+        if child is not None:
+            child.collect(segments, pos + 1, rv)
+        if self.dynamic is not None:
+            self.dynamic.collect(segments, pos + 1, rv)
+
+
+def _is_segment_converter(converter):
+    """
+    Returns True if the converter can only match within a single segment
+    of the path. Unknown converters could match anything and are hence
+    treated as if they span segments.
+    """
+    if isinstance(converter, routing.AnyConverter):
+        return '/' not in converter.regex
+    return isinstance(converter, (
+        routing.UnicodeConverter,
+        routing.NumberConverter,
+        routing.UUIDConverter,
+    ))
+
+
+def _rule_segments(rule):
+    """
+    Split the path of a bound rule into segments. Each segment is a list of
+    static strings and converter objects.
+    """
+    segments = [[]]
+    for converter, arguments, variable in routing.parse_rule(rule.rule):
+        if converter is None:
+            pieces = variable.split('/')
+            segments[-1].append(pieces[0])
+            segments.extend([piece] for piece in pieces[1:])
+        else:
+            segments[-1].append(rule._converters[variable])
+    # The rule starts with a slash, so the first segment is always empty
+    return segments[1:]
+
+
+class TrieMap(routing.Map):
+    """
+    A URL map which partitions the rules into a trie on the static
+    segments of their path. Matching a path only tries the regular
+    expressions of the rules that could match it, instead of all the
+    rules of the map.
+
+    The candidate rules are tried in the same order as the map would, so
+    the matching semantics (redirects for missing trailing slashes, method
+    not allowed etc.) are the same as those of :class:`werkzeug.Map`.
+
+    Enabled with the `TRIE_URL_MATCHING` config of the application.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # Map.__init__ adds the given rules, so set these up first
+        self._trie = None
+        self._trie_lock = Lock()
+        super(TrieMap, self).__init__(*args, **kwargs)
+
+    def add(self, rulefactory):
+        super(TrieMap, self).add(rulefactory)
+        self._trie = None
+
+    def bind(self, *args, **kwargs):
+        adapter = super(TrieMap, self).bind(*args, **kwargs)
+        return TrieMapAdapter(
+            self, adapter.server_name, adapter.script_name,
+            adapter.subdomain, adapter.url_scheme, adapter.path_info,
+            adapter.default_method, adapter.query_args
+        )
+
+    def _build_trie(self):
+        root = _TrieNode()
+        for index, rule in enumerate(self._rules):
+            node = root
+            for segment in _rule_segments(rule):
+                if all(isinstance(part, basestring) for part in segment):
+                    node = node.static.setdefault(
+                        u''.join(segment), _TrieNode()
+                    )
+                elif all(
+                    isinstance(part, basestring) or
+                    _is_segment_converter(part) for part in segment
+                ):
+                    if node.dynamic is None:
+                        node.dynamic = _TrieNode()
+                    node = node.dynamic
+                else:
+                    node.tail.append(index)
+                    break
+            else:
+                node.rules.append(index)
+        return root
+
+    def get_candidates(self, path_info):
+        """
+        Returns the rules which could match the given path, in the order
+        in which they should be tried.
+        """
+        self.update()
+        trie = self._trie
+        if trie is None:
+            with self._trie_lock:
+                if self._trie is None:
+                    self._trie = self._build_trie()
+                trie = self._trie
+        indices = []
+        trie.collect(path_info.lstrip(u'/').split(u'/'), 0, indices)
+        return [self._rules[index] for index in sorted(set(indices))]
+
+
+class _CandidateMap(object):
+    """
+    A view of a map that exposes only the given rules for matching.
+    """
+    __slots__ = ('_map', '_rules')
+
+    def __init__(self, map, rules):
+        self._map = map
+        self._rules = rules
+
+    def __getattr__(self, name):
+        return getattr(self._map, name)
+
+
+class TrieMapAdapter(routing.MapAdapter):
+    """
+    Adapter returned by :meth:`TrieMap.bind`. Matching is delegated to
+    werkzeug with only the candidate rules from the trie.
+    """
+
+    def match(self, path_info=None, method=None, return_rule=False,
+              query_args=None):
+        if path_info is None:
+            path = self.path_info
+        else:
+            path = to_unicode(path_info, self.map.charset)
+        url_map = self.map
+        self.map = _CandidateMap(url_map, url_map.get_candidates(path))
+        try:
+            return super(TrieMapAdapter, self).match(
+                path_info, method, return_rule, query_args
+            )
+        finally:
+            self.map = url_map
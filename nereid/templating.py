@@ -10,6 +10,8 @@ from jinja2 import (BaseLoader, TemplateNotFound, nodes, Template,  # noqa
         ChoiceLoader, FileSystemLoader, BaseLoader)
 from speaklater import _LazyString
 from jinja2.ext import Extension
+from jinja2.utils import LRUCache
+from jinja2.visitor import NodeTransformer
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.MIMEBase import MIMEBase
@@ -17,6 +19,7 @@ from email.header import Header
 from email import Encoders, Charset
 import trytond.tools as tools
 from trytond.transaction import Transaction
+from trytond.pool import Pool
 
 from .globals import request, current_app, current_website  # noqa
 from .helpers import _rst_to_html_filter, make_crumbs
@@ -249,6 +252,111 @@ class ModuleTemplateLoader(ChoiceLoader):
         return self._loaders
 
 
+class _TranslationFolder(NodeTransformer):
+    """
+    Replaces the calls to gettext (or _) with a constant string in a
+    template by the translated string.
+    """
+    gettext_functions = ('_', 'gettext')
+
+    def __init__(self, translate):
+        self.translate = translate
+
+    def visit_Call(self, node):
+        node = self.generic_visit(node)
+        if not isinstance(node.node, nodes.Name) or \
+                node.node.name not in self.gettext_functions:
+            return node
+        if len(node.args) != 1 or node.kwargs or \
+                node.dyn_args is not None or node.dyn_kwargs is not None:
+            return node
+        message = node.args[0]
+        if not isinstance(message, nodes.Const) or \
+                not isinstance(message.value, basestring):
+            return node
+        rv = nodes.Const(
+            self.translate(message.value) or message.value,
+            lineno=node.lineno
+        )
+        rv.environment = node.environment
+        return rv
+
+
+class TranslatedTemplateLoader(BaseLoader):
+    """
+    A loader which wraps the loader of the environment and compiles a
+    variant of every template for each language, with the constant strings
+    passed to gettext (and `{% trans %}` blocks) replaced by their
+    translation. Strings with variables are still formatted at render time.
+
+    The strings are translated with the same lookup as gettext at render
+    time (the memory mapped catalog when `mapped_translations` is set) and
+    the variants are cached by the language and the version of these
+    translations, so a change to the translations of a language compiles
+    the templates of that language again.
+
+    Used when the `TEMPLATE_COMPILE_TRANSLATIONS` config is set. The
+    environment must not cache templates itself since it does not know
+    about the language.
+    """
+
+    def __init__(self, loader, cache_size=400):
+        self.loader = loader
+        self.cache = LRUCache(cache_size)
+
+    def get_source(self, environment, template):
+        return self.loader.get_source(environment, template)
+
+    def list_templates(self):
+        return self.loader.list_templates()
+
+    def get_catalog(self):
+        """
+        Returns a tuple of the key of the catalog (language and version) and
+        a function which returns the translation of a template string in
+        the current transaction, or None. Both are None outside of a
+        transaction.
+        """
+        transaction = Transaction()
+        if transaction.database is None:
+            return None, None
+        IRTranslation = Pool().get('ir.translation')
+        language = transaction.language
+        # Get the version first: if the catalog is reloaded in between,
+        # the template is compiled again for the new version.
+        version = IRTranslation.get_nereid_translation_version(
+            None, 'nereid_template', language
+        )
+
+        def translate(source):
+            return IRTranslation.get_translation_4_nereid(
+                None, 'nereid_template', language, source
+            )
+        return (language, version), translate
+
+    def load(self, environment, name, globals=None):
+        catalog_key, translate = self.get_catalog()
+        cache_key = (name, catalog_key)
+
+        template = self.cache.get(cache_key)
+        if template is not None and (
+                not environment.auto_reload or template.is_up_to_date):
+            return template
+
+        if translate is None:
+            template = self.loader.load(environment, name, globals)
+        else:
+            source, filename, uptodate = self.get_source(environment, name)
+            node = environment.parse(source, name, filename)
+            _TranslationFolder(translate).visit(node)
+            code = environment.compile(node, name, filename)
+            template = environment.template_class.from_code(
+                environment, code, globals or {}, uptodate
+            )
+        self.cache[cache_key] = template
+        return template
+
+
 class FragmentCacheExtension(Extension):
     # a set of names that trigger the extension.
     tags = set(['cache'])
@@ -5,8 +5,10 @@ from contextlib import contextmanager
 import jinja2
 import unittest
 from nereid.sessions import Session
+from nereid.throttling import check_throttle
 from nereid.contrib.locale import Babel
 from werkzeug.contrib.sessions import FilesystemSessionStore
+from trytond.transaction import Transaction
 
 from nereid import Nereid, current_app
 from flask.globals import _request_ctx_stack
@@ -21,6 +23,8 @@ class NereidTestApp(Nereid):
     def __init__(self, **config):
         super(NereidTestApp, self).__init__(**config)
         self.config['WTF_CSRF_ENABLED'] = False
+        # Deferred jobs run in the transaction of the test
+        self.config['DEFERRED_JOB_WORKERS'] = 0
 
     @property
     def root_transaction(self):
@@ -41,6 +45,14 @@ class NereidTestApp(Nereid):
         self._database = DB
         self._pool = POOL
 
+    def run_deferred_job(self, job):
+        """
+        Run the job in the transaction of the test
+        """
+        with Transaction().set_user(job.user), \
+                Transaction().set_context(job.context):
+            job()
+
     def dispatch_request(self):
         """
         Skip the transaction handling and call the _dispatch_request
@@ -57,6 +69,8 @@ class NereidTestApp(Nereid):
            and req.method == 'OPTIONS':
             return self.make_default_options_response()
 
+        check_throttle(self.get_throttle_limits(rule), rule.endpoint)
+
         Website = current_app.pool.get('nereid.website')
         website = Website.get_from_host(req.host)
         locale = website.get_current_locale(req)
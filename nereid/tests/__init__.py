@@ -6,6 +6,8 @@ from .test_templates import TestTemplateLoading, TestLazyRendering
 from .test_helpers import TestURLfor, TestHelperFunctions
 from .test_signals import SignalsTestCase
 from .test_pagination import TestPagination
+from .test_routing import TestTrieMap, TestRule
+from .test_throttling import TestThrottling
 
 
 def suite():
@@ -18,5 +20,8 @@ def suite():
         unittest.TestLoader().loadTestsFromTestCase(TestHelperFunctions),
         unittest.TestLoader().loadTestsFromTestCase(SignalsTestCase),
         unittest.TestLoader().loadTestsFromTestCase(TestPagination),
+        unittest.TestLoader().loadTestsFromTestCase(TestTrieMap),
+        unittest.TestLoader().loadTestsFromTestCase(TestRule),
+        unittest.TestLoader().loadTestsFromTestCase(TestThrottling),
     ])
     return test_suite
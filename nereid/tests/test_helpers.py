@@ -65,6 +65,34 @@ class TestURLfor(BaseTestCase):
                 )
                 self.assertEqual(len(w), 1)
 
+    @with_transaction()
+    def test_0040_memoized_in_request(self):
+        """
+        URLs built in a request are memoized on the request context
+        """
+        self.setup_defaults()
+        app = self.get_app()
+
+        with app.test_request_context('/') as ctx:
+            self.assertEqual(ctx.url_build_cache, {})
+            self.assertEqual(url_for('nereid.website.home'), '/')
+            self.assertEqual(len(ctx.url_build_cache), 1)
+
+            # Building the same URL again uses the memoized value
+            self.assertEqual(url_for('nereid.website.home'), '/')
+            self.assertEqual(len(ctx.url_build_cache), 1)
+
+            # Different values are a different URL
+            self.assertEqual(
+                url_for('nereid.website.home', _external=True),
+                'http://localhost/'
+            )
+            self.assertEqual(len(ctx.url_build_cache), 2)
+
+            # Unhashable values are not memoized
+            url_for('nereid.website.home', q=['a', 'b'])
+            self.assertEqual(len(ctx.url_build_cache), 2)
+
 
 class NereidWebsite:
     __metaclass__ = PoolMeta
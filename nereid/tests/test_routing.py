@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import unittest
+
+from werkzeug.routing import Map, Rule, Submount, RequestRedirect
+from werkzeug.exceptions import NotFound, MethodNotAllowed
+from nereid.routing import TrieMap, Rule as NereidRule
+from nereid.throttling import Limit
+
+
+def get_rules():
+    """
+    Rules which cover the different kinds of segments the trie handles
+    """
+    rules = [
+        Rule('/', endpoint='home'),
+        Rule('/products/', endpoint='products'),
+        Rule('/products/new', endpoint='product.new', methods=['POST']),
+        Rule('/products/<int:id>', endpoint='product.id'),
+        Rule('/products/<uri>', endpoint='product.uri'),
+        Rule('/page-<int:page>/list', endpoint='page'),
+        Rule('/sort/<any(asc, desc):order>', endpoint='sort'),
+        Rule('/static/<path:filename>', endpoint='static'),
+        Rule('/old-products', redirect_to='/products/'),
+    ]
+    rules.extend([
+        Rule('/module%d/items/<int:id>' % index, endpoint='module%d' % index)
+        for index in xrange(50)
+    ])
+    return [
+        Rule('/', redirect_to='/en_US'),
+        Submount('/<locale>', rules),
+        Rule('/files/<path:path>/edit', endpoint='file.edit'),
+    ]
+
+
+class TestTrieMap(unittest.TestCase):
+    """
+    Test that the trie URL map matches like the werkzeug map
+    """
+
+    def match(self, adapter, path, method):
+        try:
+            return adapter.match(path, method)
+        except RequestRedirect, exc:
+            return 'redirect', exc.new_url
+        except MethodNotAllowed, exc:
+            return 405, sorted(exc.valid_methods)
+        except NotFound:
+            return 404
+
+    def test_0010_same_as_map(self):
+        """
+        Every path is matched the same way by both maps
+        """
+        map_adapter = Map(get_rules()).bind('localhost')
+        trie_adapter = TrieMap(get_rules()).bind('localhost')
+
+        paths = [
+            '/', '/en_US', '/en_US/', '/en_US/products', '/en_US/products/',
+            '/en_US/products/new', '/en_US/products/10',
+            '/en_US/products/shirt', '/en_US/page-2/list',
+            '/en_US/sort/asc', '/en_US/sort/up', '/en_US/static/css/a.css',
+            '/en_US/old-products', '/en_US/module7/items/1',
+            '/en_US/module7/items/shirt', '/en_US/module49/items/1/',
+            '/files/a/b/edit', '/does-not-exist',
+        ]
+        for path in paths:
+            for method in ('GET', 'POST'):
+                self.assertEqual(
+                    self.match(trie_adapter, path, method),
+                    self.match(map_adapter, path, method),
+                )
+
+    def test_0020_candidates(self):
+        """
+        Only the rules that could match the path are tried
+        """
+        url_map = TrieMap(get_rules())
+        self.assertEqual(
+            [
+                rule.endpoint for rule in
+                url_map.get_candidates(u'/en_US/module7/items/1')
+            ],
+            ['module7']
+        )
+
+        # Rules added after matching are candidates too
+        url_map.add(Rule('/<locale>/module7/items/new', endpoint='new'))
+        self.assertEqual(
+            [
+                rule.endpoint for rule in
+                url_map.get_candidates(u'/en_US/module7/items/new')
+            ],
+            ['new', 'module7']
+        )
+
+
+class TestRule(unittest.TestCase):
+    """
+    Test the readonly decision of nereid rules
+    """
+
+    def test_0010_readonly_for(self):
+        """
+        The readonly decision for each method
+        """
+        url_map = Map([
+            NereidRule('/a', endpoint='a', methods=['GET', 'POST']),
+            NereidRule('/b', endpoint='b', readonly=False),
+            NereidRule('/c', endpoint='c', methods=['POST'], readonly=True),
+            NereidRule('/d', endpoint='d', writes_on_get=True),
+        ])
+        rules = dict((rule.endpoint, rule) for rule in url_map.iter_rules())
+
+        self.assertTrue(rules['a'].is_readonly_for('GET'))
+        self.assertTrue(rules['a'].is_readonly_for('HEAD'))
+        self.assertFalse(rules['a'].is_readonly_for('POST'))
+        self.assertFalse(rules['b'].is_readonly_for('GET'))
+        self.assertTrue(rules['c'].is_readonly_for('POST'))
+        self.assertFalse(rules['d'].is_readonly_for('GET'))
+        self.assertTrue(rules['d'].writes_on_get)
+
+    def test_0020_empty(self):
+        """
+        The nereid options are kept on copies of the rule, like the ones
+        mounted under the locale
+        """
+        limit = Limit(5, 60)
+        url_map = Map([
+            Submount('/<locale>', [
+                NereidRule('/a', endpoint='a', exempt_csrf=True),
+                NereidRule('/b', endpoint='b', readonly=False),
+                NereidRule('/d', endpoint='d', writes_on_get=True),
+                NereidRule('/e', endpoint='e', throttle=limit),
+            ])
+        ])
+        rules = dict((rule.endpoint, rule) for rule in url_map.iter_rules())
+
+        self.assertIs(rules['e'].throttle, limit)
+        self.assertTrue(rules['a'].is_csrf_exempt)
+        self.assertFalse(rules['b'].readonly)
+        self.assertFalse(rules['b'].is_readonly_for('GET'))
+        self.assertFalse(rules['d'].is_readonly_for('GET'))
+
+
+def suite():
+    "Nereid Routing test suite"
+    test_suite = unittest.TestSuite()
+    test_suite.addTests([
+        unittest.TestLoader().loadTestsFromTestCase(TestTrieMap),
+        unittest.TestLoader().loadTestsFromTestCase(TestRule),
+    ])
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
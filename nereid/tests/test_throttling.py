@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import unittest
+
+from flask import Flask
+from werkzeug.contrib.cache import SimpleCache, NullCache
+from werkzeug.exceptions import TooManyRequests
+from nereid.throttling import Limit, check_throttle
+
+
+class TestThrottling(unittest.TestCase):
+    """
+    Test the sliding window counters of throttle limits
+    """
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.cache = SimpleCache()
+        self.app.database_name = 'test'
+
+    def test_0010_sliding_window(self):
+        """
+        The count of the previous window is weighted by its overlap with
+        the sliding window
+        """
+        limit = Limit(4, 60)
+        with self.app.test_request_context(
+                '/', environ_base={'REMOTE_ADDR': '10.0.0.2'}):
+            # Four attempts at the end of a window are allowed
+            for index in xrange(4):
+                self.assertIsNone(limit.hit('login', now=6000 + 50))
+            # The fifth is over the limit until the next window
+            self.assertEqual(limit.hit('login', now=6000 + 55), 5)
+
+            # Early in the next window the previous attempts still count
+            self.assertIsNotNone(limit.hit('login', now=6060 + 6))
+
+            # Once most of the previous window slid out, the attempts are
+            # allowed again
+            self.assertIsNone(limit.hit('login', now=6060 + 50))
+
+            # Other scopes and identities are counted separately
+            self.assertIsNone(limit.hit('reset', now=6060 + 6))
+        with self.app.test_request_context(
+                '/', environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+            self.assertIsNone(limit.hit('login', now=6060 + 6))
+
+    def test_0020_keys(self):
+        """
+        Attempts are counted per email and method
+        """
+        limit = Limit(1, 60, key='email', methods=['POST'])
+        with self.app.test_request_context('/', method='GET'):
+            self.assertIsNone(limit.hit('login', email='a@example.com'))
+            self.assertIsNone(limit.hit('login', email='a@example.com'))
+        with self.app.test_request_context(
+                '/', method='POST', data={'email': 'A@example.com '}):
+            self.assertIsNone(limit.hit('login'))
+            self.assertIsNotNone(limit.hit('login', email='a@example.com'))
+            self.assertIsNone(limit.hit('login', email='b@example.com'))
+        with self.app.test_request_context('/', method='POST'):
+            # Requests without an email are not counted
+            self.assertIsNone(limit.hit('login'))
+            self.assertIsNone(limit.hit('login'))
+
+    def test_0030_check_throttle(self):
+        """
+        Requests over a limit are rejected with a Retry-After header
+        """
+        limits = [Limit(10, 60), Limit(1, 3600, key=lambda req: 'client')]
+        with self.app.test_request_context('/'):
+            check_throttle(limits, 'login')
+            with self.assertRaises(TooManyRequests) as context:
+                check_throttle(limits, 'login')
+            response = context.exception.get_response()
+            self.assertEqual(response.status_code, 429)
+            self.assertTrue(int(response.headers['Retry-After']) > 0)
+
+            # Nothing is throttled without a cache
+            self.app.cache = NullCache()
+            check_throttle(limits, 'login')
+            check_throttle(limits, 'login')
+
+
+def suite():
+    "Nereid Throttling test suite"
+    test_suite = unittest.TestSuite()
+    test_suite.addTests([
+        unittest.TestLoader().loadTestsFromTestCase(TestThrottling),
+    ])
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
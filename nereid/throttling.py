@@ -0,0 +1,175 @@
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+    Throttling of requests with sliding window counters kept in the cache of
+    the application.
+
+    A :class:`Limit` allows a number of attempts per period for an identity
+    of the request (the remote address or the email submitted). The
+    attempts are counted per fixed window with the atomic ``inc`` of the
+    cache and the count of the sliding window is estimated from the count
+    of the current window and the count of the previous window weighted by
+    its overlap with the sliding window.
+
+    The counters must be shared by the workers, so throttling needs a shared
+    cache like memcached. With the default NullCache nothing is throttled.
+"""
+import math
+import time
+from hashlib import md5
+
+from flask.globals import current_app, request
+from werkzeug.exceptions import TooManyRequests
+
+
+class Limit(object):
+    """
+    A limit of `count` attempts per `period` seconds.
+
+    .. code-block:: python
+
+        @classmethod
+        @route('/login', methods=['GET', 'POST'], throttle=[
+            Limit(20, 60, key='ip'), Limit(5, 300, key='email'),
+        ])
+        def login(cls):
+            ...
+
+    :param count: The number of attempts allowed in a period
+    :param period: The length of the sliding window in seconds
+    :param key: The identity of the request the attempts are counted for.
+                `ip` for the remote address, `email` for the email in the
+                URL arguments or submitted values of the request, or a
+                callable which returns the identity for a request. Requests
+                without an identity are not counted. The limits of routes
+                are stored with the route definitions in the cache, so a
+                callable must be a module level function which can be
+                pickled.
+    :param methods: The HTTP methods of the requests which are counted, all
+                    methods if None.
+    """
+
+    def __init__(self, count, period, key='ip', methods=None):
+        self.count = count
+        self.period = period
+        self.key = key
+        self.methods = methods and frozenset(methods)
+
+    def __repr__(self):
+        return 'Limit(%r, %r, key=%r, methods=%r)' % (
+            self.count, self.period, self.key,
+            self.methods and sorted(self.methods)
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, Limit):
+            return NotImplemented
+        return (self.count, self.period, self.key, self.methods) == \
+            (other.count, other.period, other.key, other.methods)
+
+    def __ne__(self, other):
+        rv = self.__eq__(other)
+        if rv is NotImplemented:
+            return rv
+        return not rv
+
+    def __hash__(self):
+        return hash((self.count, self.period, self.key, self.methods))
+
+    def get_identity(self, email=None):
+        """
+        Returns the identity of the current request for this limit
+        """
+        if callable(self.key):
+            return self.key(request)
+        if self.key == 'ip':
+            return request.remote_addr
+        if self.key == 'email':
+            if email is None:
+                email = (request.view_args or {}).get('email') or \
+                    request.values.get('email')
+            return email and email.strip().lower()
+        raise ValueError('Unknown throttle key %r' % (self.key,))
+
+    def _get_cache_key(self, scope, identity, window):
+        if isinstance(identity, unicode):
+            identity = identity.encode('utf-8')
+        return '%s-throttle-%s-%s-%s-%s-%d' % (
+            current_app.database_name, scope, self.key
+            if not callable(self.key) else self.key.__name__,
+            self.period, md5(identity).hexdigest(), window
+        )
+
+    def hit(self, scope, email=None, now=None):
+        """
+        Count an attempt of the current request and return the number of
+        seconds after which it could be retried if the limit is exceeded, or
+        None.
+
+        :param scope: The name of the group of requests the attempts are
+                      counted for, usually the endpoint
+        :param email: The email of the attempt if it is not submitted in the
+                      request (Basic authentication for example)
+        """
+        if self.methods is not None and request.method not in self.methods:
+            return None
+        identity = self.get_identity(email)
+        if not identity:
+            return None
+        if now is None:
+            now = time.time()
+
+        cache = current_app.cache
+        window, elapsed = divmod(now, self.period)
+        key = self._get_cache_key(scope, identity, int(window))
+        # The counter of a window is needed until the end of the next one
+        cache.add(key, 0, timeout=int(math.ceil(self.period * 2)))
+        current = cache.inc(key) or 0
+        previous = cache.get(
+            self._get_cache_key(scope, identity, int(window) - 1)
+        ) or 0
+
+        weight = 1 - float(elapsed) / self.period
+        if current + previous * weight <= self.count:
+            return None
+        if current > self.count or not previous:
+            # Retry in the next window
+            return max(int(math.ceil(self.period - elapsed)), 1)
+        # Retry once enough of the previous window slid out
+        excess = current + previous * weight - self.count
+        return max(int(math.ceil(excess * self.period / previous)), 1)
+
+
+def check_throttle(limits, scope, email=None):
+    """
+    Count an attempt of the current request against the limits and raise
+    :class:`~werkzeug.exceptions.TooManyRequests` if any of them is
+    exceeded. The response has a Retry-After header.
+
+    :param limits: A :class:`Limit` or a list of them
+    :param scope: The name of the group of requests the attempts are
+                  counted for
+    :param email: The email of the attempt if it is not submitted in the
+                  request
+    """
+    if not limits:
+        return
+    if isinstance(limits, Limit):
+        limits = [limits]
+    retry_after = None
+    for limit in limits:
+        rv = limit.hit(scope, email=email)
+        if rv is not None:
+            retry_after = max(retry_after, rv)
+    if retry_after is None:
+        return
+
+    current_app.logger.info(
+        'Throttled %s from %s (retry after %ss)',
+        scope, request.remote_addr, retry_after
+    )
+    exception = TooManyRequests()
+    response = exception.get_response(request.environ)
+    response.headers['Retry-After'] = str(retry_after)
+    exception.response = response
+    raise exception
@@ -13,6 +13,21 @@ __metaclass__ = PoolMeta
 __all__ = ['Country', 'Subdivision']
 
 
+def _serialize_many(Model, records, field_names):
+    """
+    Returns the id and the values of the fields of the records read at once
+    """
+    values = dict(
+        (v['id'], v) for v in Model.read(
+            [r.id for r in records], field_names
+        )
+    )
+    return [
+        dict((f, values[r.id][f]) for f in ['id'] + field_names)
+        for r in records
+    ]
+
+
 class Country:
     "Country"
 
@@ -24,19 +39,21 @@ class Country:
         """
         Returns serialized list of all countries
         """
-        return jsonify(countries=[
-            country.serialize() for country in cls.search([])
-        ])
+        return jsonify(countries=cls.serialize_many(cls.search([])))
 
     def serialize(self, purpose=None):
         """
         Serialize country data
         """
-        return {
-            'id': self.id,
-            'name': self.name,
-            'code': self.code
-        }
+        return self.serialize_many([self], purpose)[0]
+
+    @classmethod
+    def serialize_many(cls, countries, purpose=None):
+        """
+        Serialize the data of the countries with a single read, in the order
+        of the countries
+        """
+        return _serialize_many(cls, countries, ['name', 'code'])
 
     @route("/countries/<int:active_id>/subdivisions", methods=["GET"])
     def get_subdivisions(self):
@@ -46,9 +63,7 @@ class Country:
         Subdivision = Pool().get('country.subdivision')
 
         subdivisions = Subdivision.search([('country', '=', self.id)])
-        return jsonify(
-            result=[s.serialize() for s in subdivisions]
-        )
+        return jsonify(result=Subdivision.serialize_many(subdivisions))
 
 
 class Subdivision:
@@ -60,8 +75,12 @@ class Subdivision:
         """
         Serialize subdivision data
         """
-        return {
-            'id': self.id,
-            'name': self.name,
-            'code': self.code,
-        }
+        return self.serialize_many([self], purpose)[0]
+
+    @classmethod
+    def serialize_many(cls, subdivisions, purpose=None):
+        """
+        Serialize the data of the subdivisions with a single read, in the
+        order of the subdivisions
+        """
+        return _serialize_many(cls, subdivisions, ['name', 'code'])
@@ -8,6 +8,7 @@ from nereid.helpers import send_file, url_for
 from nereid.globals import _request_ctx_stack
 from werkzeug import abort
 
+from trytond import backend
 from trytond.model import ModelSQL, ModelView, fields, Unique
 from trytond.config import config
 from trytond.transaction import Transaction
@@ -120,6 +121,22 @@ class NereidStaticFile(ModelSQL, ModelView):
                 (2) file name contains '/'""",
         })
 
+    @classmethod
+    def __register__(cls, module_name):
+        TableHandler = backend.get('TableHandler')
+
+        super(NereidStaticFile, cls).__register__(module_name)
+
+        table = TableHandler(cls, module_name)
+        # Static files are served by the name of their folder and their
+        # name. The index of the unique constraint serves the lookup, but
+        # the constraint is not created on every backend or when existing
+        # files violate it.
+        if table.table_name + '_name_folder_uniq' in table._constraints:
+            table.index_action(['folder', 'name'], 'remove')
+        else:
+            table.index_action(['folder', 'name'], 'add')
+
     @staticmethod
     def default_sequence():
         return 10
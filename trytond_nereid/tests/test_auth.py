@@ -1,22 +1,47 @@
 #!/usr/bin/env python
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
+import sys
+import logging
 import urllib
 import unittest
 import base64
+import hashlib
 import json
+import threading
+from multiprocessing.pool import ThreadPool
+
+from mock import patch
 
 import trytond.tests.test_tryton
+from trytond import backend
 from trytond.tests.test_tryton import POOL, USER, with_transaction
 from trytond.transaction import Transaction
 from trytond.config import config
+from trytond.cache import Cache
 from nereid.testing import NereidTestCase
-from nereid import permissions_required
+from nereid import permissions_required, request, current_website, \
+    current_locale
+from nereid.globals import _request_ctx_stack
+from nereid.jobs import defer, run_job
+from nereid.throttling import Limit
+from nereid.signals import transaction_start, transaction_commit, \
+    transaction_stop
 from werkzeug.exceptions import Forbidden
 
 config.set('email', 'from', 'from@xyz.com')
 
 
+def commit_data_managers(transaction):
+    """
+    Replaces the commit of transactions in the tests: the in-memory test
+    database has a single connection shared by all the transactions, so
+    only the data managers of the transaction are committed.
+    """
+    for datamanager in transaction._datamanagers:
+        datamanager.tpc_finish(transaction)
+
+
 class TestAuth(NereidTestCase):
     """
     Test Authentication Layer
@@ -281,6 +306,326 @@ class TestAuth(NereidTestCase):
             # Email should now be verified
             self.assertTrue(registered_user.email_verified)
 
+    @with_transaction()
+    def test_0016_password_hash(self):
+        """
+        Passwords are hashed with the configured method and legacy or
+        weaker hashes are upgraded on login
+        """
+        NereidUser = self.nereid_user_obj
+        self.setup_defaults()
+        app = self.get_app()
+
+        party, = self.party_obj.create([{'name': 'Registered user'}])
+        nereid_user, = NereidUser.create([{
+            'party': party,
+            'name': 'Registered User',
+            'email': 'email@example.com',
+            'password': 'password',
+            'company': self.company,
+        }])
+        self.assertTrue(
+            nereid_user.password_hash.startswith('pbkdf2_sha256$')
+        )
+        self.assertIsNone(nereid_user.password)
+        self.assertTrue(nereid_user.match_password('password'))
+        self.assertTrue(nereid_user.match_password(u'password'))
+        self.assertFalse(nereid_user.match_password('wrong'))
+        self.assertFalse(
+            NereidUser.password_needs_rehash(nereid_user.password_hash)
+        )
+        with patch.object(NereidUser, '_get_pbkdf2_rounds', return_value=1):
+            sha1_hash = NereidUser.hash_sha1('password')
+            self.assertTrue(NereidUser.check_password('password', sha1_hash))
+            self.assertTrue(NereidUser.password_needs_rehash(sha1_hash))
+        with patch.object(
+                NereidUser, '_get_pbkdf2_rounds', return_value=10 ** 6):
+            self.assertTrue(
+                NereidUser.password_needs_rehash(nereid_user.password_hash)
+            )
+
+        # A password hashed by the Sha field of previous versions
+        table = NereidUser.__table__()
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.update(
+            columns=[table.password, table.salt, table.password_hash],
+            values=[
+                hashlib.sha1('password' + 'abcdefgh').hexdigest(),
+                'abcdefgh', None,
+            ],
+            where=table.id == nereid_user.id
+        ))
+        NereidUser.write([nereid_user], {})  # Clear the caches
+        nereid_user = NereidUser(nereid_user.id)
+        version = nereid_user.credential_version
+        self.assertTrue(nereid_user.match_password('password'))
+        self.assertFalse(nereid_user.match_password('wrong'))
+
+        with app.test_request_context('/'):
+            self.assertIsNone(
+                NereidUser.authenticate('email@example.com', 'wrong')
+            )
+            self.assertEqual(NereidUser(nereid_user.id).salt, 'abcdefgh')
+            self.assertEqual(
+                NereidUser.authenticate('email@example.com', 'password'),
+                nereid_user
+            )
+
+        nereid_user = NereidUser(nereid_user.id)
+        self.assertIsNone(nereid_user.password)
+        self.assertIsNone(nereid_user.salt)
+        self.assertTrue(
+            nereid_user.password_hash.startswith('pbkdf2_sha256$')
+        )
+        self.assertTrue(nereid_user.match_password('password'))
+        # The password did not change, so the auth tokens remain valid
+        self.assertEqual(nereid_user.credential_version, version)
+
+        # Unknown methods and methods whose library is not installed
+        user_module = sys.modules['trytond.modules.nereid.user']
+        logger = logging.getLogger('nereid.user')
+        with patch.object(user_module, 'bcrypt', None):
+            for hash_method in ('unknown', 'bcrypt'):
+                with patch.object(
+                        NereidUser, 'hash_method', return_value=hash_method):
+                    self.assertRaises(
+                        ValueError, NereidUser.hash_password, 'password'
+                    )
+                with patch.object(logger, 'warning') as warning:
+                    self.assertFalse(NereidUser.check_password(
+                        'password', hash_method + '$hash'
+                    ))
+                    self.assertTrue(warning.called)
+
+    @with_transaction()
+    def test_0017_deferred_emails(self):
+        """
+        The emails are queued once the transaction of the request is
+        committed, and not at all if it is rolled back
+        """
+        EmailQueue = POOL.get('email.queue')
+        NereidUser = self.nereid_user_obj
+        self.setup_defaults()
+        app = self.get_app()
+
+        party, = self.party_obj.create([{'name': 'Registered user'}])
+        nereid_user, = NereidUser.create([{
+            'party': party,
+            'name': 'Registered User',
+            'email': 'email@example.com',
+            'password': 'password',
+            'company': self.company,
+        }])
+
+        with app.test_request_context('/'):
+            # Outside of a transaction of the application, the email is
+            # queued immediately
+            nereid_user.send_activation_email()
+            self.assertEqual(EmailQueue.search([], count=True), 1)
+
+            transaction_start.send(app)
+            nereid_user.send_activation_email()
+            nereid_user.send_reset_email()
+            self.assertEqual(EmailQueue.search([], count=True), 1)
+            transaction_commit.send(app)
+            transaction_stop.send(app)
+            self.assertEqual(EmailQueue.search([], count=True), 3)
+
+            # Rolled back
+            transaction_start.send(app)
+            nereid_user.send_reset_email()
+            transaction_stop.send(app)
+            self.assertEqual(EmailQueue.search([], count=True), 3)
+
+    @with_transaction()
+    def test_0018_provision_users(self):
+        """
+        Users are created in bulk and the existing ones are skipped
+        """
+        NereidUser = self.nereid_user_obj
+        ContactMechanism = POOL.get('party.contact_mechanism')
+        self.setup_defaults()
+
+        party, = self.party_obj.create([{'name': 'Existing party'}])
+        NereidUser.create([{
+            'party': party,
+            'name': 'Existing User',
+            'email': 'existing@example.com',
+            'password': 'password',
+            'company': self.company,
+        }])
+        other_party, = self.party_obj.create([{'name': 'Other party'}])
+
+        users = [{
+            'email': 'User%s@example.com' % index,
+            'name': 'User %s' % index,
+            'password': 'password%s' % index,
+        } for index in xrange(5)]
+        users.extend([{
+            'email': 'existing@example.com',
+            'password': 'other',
+        }, {
+            'email': 'user0@example.com',
+            'password': 'other',
+        }, {
+            'email': 'hashed@example.com',
+            'password_hash': NereidUser.hash_sha1('hashed'),
+            'party': other_party.id,
+            'email_verified': True,
+        }])
+
+        progress = []
+        self.assertEqual(NereidUser.provision_users(
+            iter(users), self.company, chunk_size=3, processes=2,
+            progress=lambda *args: progress.append(args)
+        ), (6, 2))
+        self.assertEqual(progress, [(3, 0), (5, 1), (6, 2)])
+
+        user, = NereidUser.search([('email', '=', 'user0@example.com')])
+        self.assertEqual(user.name, 'User 0')
+        self.assertEqual(user.party.name, 'User 0')
+        self.assertEqual(user.company, self.company)
+        self.assertTrue(user.match_password('password0'))
+        self.assertEqual(
+            [(c.type, c.value) for c in user.party.contact_mechanisms],
+            [('email', 'User0@example.com')]
+        )
+
+        user, = NereidUser.search([('email', '=', 'hashed@example.com')])
+        self.assertEqual(user.party, other_party)
+        self.assertTrue(user.email_verified)
+        self.assertTrue(user.match_password('hashed'))
+        self.assertFalse(ContactMechanism.search([
+            ('party', '=', other_party.id),
+        ]))
+
+        user, = NereidUser.search([('email', '=', 'existing@example.com')])
+        self.assertTrue(user.match_password('password'))
+
+        # Restarting skips all the users created before
+        self.assertEqual(
+            NereidUser.provision_users(users, self.company, processes=1),
+            (0, 8)
+        )
+
+    @with_transaction()
+    def test_0019_run_deferred_jobs(self):
+        """
+        The deferred jobs are submitted to the job pool and run in a
+        transaction of their own with a copy of the request context. Failing
+        jobs are rolled back and logged, and retried on database operational
+        errors.
+        """
+        EmailQueue = POOL.get('email.queue')
+        NereidUser = self.nereid_user_obj
+        DatabaseOperationalError = backend.get('DatabaseOperationalError')
+        self.setup_defaults()
+        app = self.get_app()
+
+        party, = self.party_obj.create([{'name': 'Registered user'}])
+        nereid_user, = NereidUser.create([{
+            'party': party,
+            'name': 'Registered User',
+            'email': 'email@example.com',
+            'password': 'password',
+            'company': self.company,
+        }])
+        test_transaction = Transaction()
+
+        # The jobs are submitted to the pool once the transaction commits
+        submitted = []
+
+        def submit(job):
+            submitted.append((job, threading.current_thread()))
+
+        pool = ThreadPool(1)
+        app.__dict__['deferred_job_pool'] = pool
+        with app.test_request_context('/en_US/'):
+            website_id = current_website.id
+            locale_id = current_locale.id
+            transaction_start.send(app)
+            nereid_user.send_activation_email()
+            with patch.object(app, 'run_deferred_job', side_effect=submit):
+                transaction_commit.send(app)
+                pool.close()
+                pool.join()
+            transaction_stop.send(app)
+        (job, thread), = submitted
+        self.assertIsNot(thread, threading.current_thread())
+        self.assertEqual(EmailQueue.search([], count=True), 0)
+
+        # The in-memory test database has a single connection shared by all
+        # the transactions, so the commits and rollbacks of the jobs are
+        # only recorded.
+        with patch.object(Transaction, 'commit', autospec=True) as commit, \
+                patch.object(Transaction, 'rollback', autospec=True) \
+                as rollback:
+            run_job(app, job)
+            self.assertEqual(EmailQueue.search([], count=True), 1)
+            (transaction,), _ = commit.call_args
+            self.assertIsNot(transaction, test_transaction)
+            self.assertFalse(rollback.called)
+
+        # The job runs with the user, context, website and locale of the
+        # request it was deferred in
+        seen = []
+
+        def check_context():
+            seen.append((
+                Transaction(), Transaction().user, request.path,
+                current_website.id, current_locale.id,
+            ))
+
+        with app.test_request_context('/en_US/'):
+            current_website.id
+            transaction_start.send(app)
+            defer(check_context)
+            job, = _request_ctx_stack.top.deferred_jobs
+            transaction_stop.send(app)
+        with patch.object(Transaction, 'commit', autospec=True), \
+                patch.object(Transaction, 'rollback', autospec=True):
+            run_job(app, job)
+        (transaction, user, path, website, locale), = seen
+        self.assertIsNot(transaction, test_transaction)
+        self.assertEqual(user, test_transaction.user)
+        self.assertEqual(path, '/en_US/')
+        self.assertEqual(website, website_id)
+        self.assertEqual(locale, locale_id)
+
+        # Failing jobs are rolled back and logged
+        def fail():
+            raise ValueError('job failed')
+
+        def conflict():
+            if len(attempts) < 2:
+                attempts.append(Transaction())
+                raise DatabaseOperationalError('conflict')
+            attempts.append(Transaction())
+
+        attempts = []
+        with app.test_request_context('/en_US/'):
+            transaction_start.send(app)
+            defer(fail)
+            defer(conflict)
+            fail_job, conflict_job = _request_ctx_stack.top.deferred_jobs
+            transaction_stop.send(app)
+        with patch.object(Transaction, 'commit', autospec=True) as commit, \
+                patch.object(Transaction, 'rollback', autospec=True) \
+                as rollback, \
+                patch.object(app.logger, 'exception') as log_exception:
+            run_job(app, fail_job)
+            self.assertFalse(commit.called)
+            self.assertEqual(rollback.call_count, 1)
+            self.assertEqual(log_exception.call_count, 1)
+
+            # Retried in a new transaction on operational errors
+            run_job(app, conflict_job)
+            self.assertEqual(len(attempts), 3)
+            self.assertEqual(len(set(map(id, attempts))), 3)
+            self.assertEqual(commit.call_count, 1)
+            self.assertEqual(rollback.call_count, 3)
+            self.assertEqual(log_exception.call_count, 1)
+
     @with_transaction()
     def test_0020_activation(self):
         """
@@ -814,6 +1159,106 @@ class TestAuth(NereidTestCase):
             perm_any=[p3.value, p4.value]
         ))
 
+    @with_transaction()
+    def test_0105_permissions_cache(self):
+        '''
+        Permissions are cached per user until they change
+        '''
+        NereidUser = self.nereid_user_obj
+        Permission = self.nereid_permission_obj
+        self.setup_defaults()
+
+        user1, user2 = NereidUser.create([{
+            'party': self.party_obj.create([{'name': 'User 1'}])[0],
+            'email': 'user1@example.com',
+            'password': 'password',
+            'company': self.company,
+        }, {
+            'party': self.party_obj.create([{'name': 'User 2'}])[0],
+            'email': 'user2@example.com',
+            'password': 'password',
+            'company': self.company,
+        }])
+        p1, p2 = Permission.create([
+            {'name': 'p1', 'value': 'nereid.perm1'},
+            {'name': 'p2', 'value': 'nereid.perm2'},
+        ])
+        NereidUser.write([user1], {'permissions': [('add', [p1, p2])]})
+        NereidUser.write([user2], {'permissions': [('add', [p2])]})
+
+        self.assertEqual(
+            NereidUser.get_permissions_many([user1, user2]), {
+                user1.id: frozenset(['nereid.perm1', 'nereid.perm2']),
+                user2.id: frozenset(['nereid.perm2']),
+            }
+        )
+        self.assertEqual(
+            NereidUser.has_permissions_many(
+                [user1, user2], perm_all=['nereid.perm1']
+            ),
+            {user1.id: True, user2.id: False}
+        )
+
+        # Cached permissions do not hit the database
+        with patch.object(
+                NereidUser._permissions_cache, 'set',
+                side_effect=AssertionError('permissions loaded')):
+            self.assertTrue(user1.has_permissions(perm_any=['nereid.perm1']))
+            self.assertFalse(user2.has_permissions(perm_any=['nereid.perm1']))
+
+        # Assigning a permission
+        NereidUser.write([user2], {'permissions': [('add', [p1])]})
+        self.assertTrue(user2.has_permissions(perm_any=['nereid.perm1']))
+
+        # Changing the value of a permission
+        Permission.write([p1], {'value': 'nereid.perm1.changed'})
+        self.assertEqual(
+            user1.get_permissions(),
+            frozenset(['nereid.perm1.changed', 'nereid.perm2'])
+        )
+
+        # Removing a permission
+        NereidUser.write([user1], {'permissions': [('remove', [p2])]})
+        self.assertEqual(
+            user1.get_permissions(), frozenset(['nereid.perm1.changed'])
+        )
+        Permission.delete([p1])
+        self.assertEqual(user1.get_permissions(), frozenset())
+
+    @with_transaction()
+    def test_0106_permissions_cache_commit(self):
+        '''
+        Permissions cached before a change is committed are cleared
+        '''
+        NereidUser = self.nereid_user_obj
+        Permission = self.nereid_permission_obj
+        self.setup_defaults()
+        dbname = Transaction().database.name
+
+        user, = NereidUser.create([{
+            'party': self.party,
+            'email': 'user@example.com',
+            'password': 'password',
+            'company': self.company,
+        }])
+        permission, = Permission.create([
+            {'name': 'p1', 'value': 'nereid.perm1'},
+        ])
+        NereidUser.write([user], {'permissions': [('add', [permission])]})
+        permissions = user.get_permissions()
+        self.assertEqual(permissions, frozenset(['nereid.perm1']))
+
+        with patch.object(
+                Transaction, 'commit', autospec=True,
+                side_effect=commit_data_managers):
+            with Transaction().new_transaction():
+                Permission.delete([Permission(permission.id)])
+                # A request which read the permissions before the commit
+                NereidUser._permissions_cache.set(user.id, permissions)
+                Cache._resets.setdefault(dbname, set()).clear()
+            self.assertIn('nereid.user.permissions', Cache._resets[dbname])
+            self.assertIsNone(NereidUser._permissions_cache.get(user.id))
+
     @with_transaction()
     def test_0110_user_management(self):
         """
@@ -848,6 +1293,66 @@ class TestAuth(NereidTestCase):
             response = c.get('/me')
             self.assertEqual(response.status_code, 302)
 
+    @with_transaction()
+    def test_0120_load_user_snapshot(self):
+        """
+        Users loaded by Flask-Login are cached until they are written
+        (only the written users are evicted)
+        """
+        NereidUser = self.nereid_user_obj
+        self.setup_defaults()
+
+        user, = NereidUser.create([{
+            'party': self.party.id,
+            'name': 'Registered User',
+            'email': 'email@example.com',
+            'password': 'password',
+            'company': self.company.id,
+            'active': False,
+        }])
+
+        self.assertIsNone(NereidUser.load_user('abc'))
+        self.assertIsNone(NereidUser.load_user(user.id + 100))
+
+        loaded = NereidUser.load_user(unicode(user.id))
+        self.assertEqual(loaded, user)
+        self.assertFalse(loaded.is_active)
+
+        # The snapshot is used without reading the user again
+        with patch.object(
+                NereidUser, 'read',
+                side_effect=AssertionError('user read')):
+            loaded = NereidUser.load_user(unicode(user.id))
+            self.assertFalse(loaded.is_active)
+            self.assertEqual(loaded.email, 'email@example.com')
+            self.assertEqual(loaded.name, 'Registered User')
+            self.assertEqual(loaded.party, self.party)
+            self.assertEqual(loaded.company, self.company)
+
+        other_user, = NereidUser.create([{
+            'party': self.party.id,
+            'name': 'Other User',
+            'email': 'other@example.com',
+            'password': 'password',
+            'company': self.company.id,
+        }])
+        NereidUser.load_user(unicode(other_user.id))
+
+        # Writing the user evicts its snapshot only
+        NereidUser.write([user], {'active': True, 'name': 'Active User'})
+        loaded = NereidUser.load_user(unicode(user.id))
+        self.assertTrue(loaded.is_active)
+        self.assertEqual(loaded.name, 'Active User')
+        with patch.object(
+                NereidUser, 'read',
+                side_effect=AssertionError('user read')):
+            loaded = NereidUser.load_user(unicode(other_user.id))
+            self.assertEqual(loaded.name, 'Other User')
+
+        # And so does deleting it
+        NereidUser.delete([user])
+        self.assertIsNone(NereidUser.load_user(unicode(user.id)))
+
     @with_transaction()
     def test_200_basic_authentication(self):
         """
@@ -889,6 +1394,64 @@ class TestAuth(NereidTestCase):
             )
             self.assertEqual(response.data, data['display_name'])
 
+    @with_transaction()
+    def test_201_basic_authentication_cache(self):
+        """
+        Verified Basic auth credentials are remembered for a short time
+        """
+        NereidUser = self.nereid_user_obj
+        self.setup_defaults()
+        app = self.get_app(CACHE_TYPE='werkzeug.contrib.cache.SimpleCache')
+
+        party, = self.party_obj.create([{'name': 'Registered user'}])
+        nereid_user, = NereidUser.create([{
+            'party': party,
+            'name': 'Registered User',
+            'email': 'email@example.com',
+            'password': 'password',
+            'company': self.company,
+            'active': True,
+        }])
+
+        def get_me(client, credentials):
+            return client.get('/me', headers={
+                'Authorization': 'Basic ' + base64.b64encode(credentials)
+            })
+
+        with app.test_client() as c:
+            response = get_me(c, b'email@example.com:password')
+            self.assertEqual(response.data, 'Registered User')
+
+            # The password is not hashed again
+            with patch.object(
+                    NereidUser, 'check_password',
+                    side_effect=AssertionError('password hashed')):
+                response = get_me(c, b'email@example.com:password')
+                self.assertEqual(response.data, 'Registered User')
+                response = get_me(c, b'EMAIL@example.com:password')
+                self.assertEqual(response.data, 'Registered User')
+
+            # Other credentials are not remembered
+            response = get_me(c, b'email@example.com:Password')
+            self.assertEqual(response.status_code, 302)
+
+            # Changing the password forgets the credentials
+            NereidUser.write([nereid_user], {'password': 'new-password'})
+            response = get_me(c, b'email@example.com:password')
+            self.assertEqual(response.status_code, 302)
+            response = get_me(c, b'email@example.com:new-password')
+            self.assertEqual(response.data, 'Registered User')
+
+        app.config['BASIC_AUTH_CACHE_TIMEOUT'] = 0
+        with app.test_client() as c:
+            with patch.object(
+                    NereidUser, 'check_password',
+                    side_effect=AssertionError('password hashed')):
+                self.assertRaises(
+                    AssertionError, get_me, c,
+                    b'email@example.com:new-password'
+                )
+
     @with_transaction()
     def test_205_basic_authentication_with_separator(self):
         """
@@ -1030,6 +1593,128 @@ class TestAuth(NereidTestCase):
             )
             self.assertEqual(response.status_code, 302)
 
+    @with_transaction()
+    def test_215_token_revocation(self):
+        """
+        Tokens are checked against the credential version of the user and
+        can be revoked
+        """
+        NereidUser = self.nereid_user_obj
+        self.setup_defaults()
+        app = self.get_app(CACHE_TYPE='werkzeug.contrib.cache.SimpleCache')
+
+        party, = self.party_obj.create([{'name': 'Registered user'}])
+        nereid_user, = NereidUser.create([{
+            'party': party,
+            'name': 'Registered User',
+            'email': 'email@example.com',
+            'password': 'password',
+            'company': self.company,
+            'active': True,
+        }])
+
+        def get_me(client, token):
+            return client.get('/me', headers={
+                'Authorization': 'token ' + token
+            })
+
+        with app.test_client() as c:
+            with app.test_request_context('/'):
+                self.assertIs(
+                    NereidUser.get_token_serializer(),
+                    NereidUser.get_token_serializer()
+                )
+                token = nereid_user.get_auth_token()
+                other_token = nereid_user.get_auth_token()
+            self.assertEqual(get_me(c, token).data, 'Registered User')
+
+            # The user table is not read once the user is cached
+            with patch.object(
+                    NereidUser, 'read',
+                    side_effect=AssertionError('user read')):
+                with app.test_request_context('/'):
+                    user = NereidUser.load_user_from_token(token)
+                    self.assertEqual(user, nereid_user)
+                    self.assertTrue(user.is_active)
+
+            # Revoke a single token
+            with self.get_app().test_request_context('/'):
+                # The NullCache cannot keep the revocation
+                self.assertFalse(NereidUser.revoke_auth_token(token))
+            self.assertEqual(get_me(c, token).data, 'Registered User')
+            with app.test_request_context('/'):
+                self.assertTrue(NereidUser.revoke_auth_token(token))
+            self.assertEqual(get_me(c, token).status_code, 302)
+            self.assertEqual(get_me(c, other_token).data, 'Registered User')
+
+            # Revoke all the tokens of the user
+            self.assertIsNone(NereidUser(nereid_user.id).write_date)
+            NereidUser.revoke_auth_tokens([nereid_user])
+            self.assertEqual(get_me(c, other_token).status_code, 302)
+            self.assertIsNotNone(NereidUser(nereid_user.id).write_date)
+
+            # Changing the password invalidates tokens too
+            with app.test_request_context('/'):
+                token = NereidUser(nereid_user.id).get_auth_token()
+            self.assertEqual(get_me(c, token).data, 'Registered User')
+            NereidUser.write([nereid_user], {'password': 'new-password'})
+            self.assertEqual(get_me(c, token).status_code, 302)
+
+            # Tokens issued before credential versions are still accepted
+            nereid_user = NereidUser(nereid_user.id)
+            with app.test_request_context('/'):
+                token = NereidUser.get_token_serializer().dumps({
+                    'id': nereid_user.id,
+                    'password': nereid_user.password,
+                })
+            self.assertEqual(get_me(c, token).data, 'Registered User')
+
+    @with_transaction()
+    def test_216_token_revocation_commit(self):
+        """
+        Tokens revoked in a transaction are rejected in the other
+        transactions once it is committed, even if a request of the worker
+        cached the user before the commit, and the reset of the cache is
+        published to the other workers
+        """
+        NereidUser = self.nereid_user_obj
+        self.setup_defaults()
+        app = self.get_app()
+        dbname = Transaction().database.name
+
+        party, = self.party_obj.create([{'name': 'Registered user'}])
+        nereid_user, = NereidUser.create([{
+            'party': party,
+            'name': 'Registered User',
+            'email': 'email@example.com',
+            'password': 'password',
+            'company': self.company,
+            'active': True,
+        }])
+        with app.test_request_context('/'):
+            token = nereid_user.get_auth_token()
+            self.assertEqual(
+                NereidUser.load_user_from_token(token), nereid_user
+            )
+        snapshot = NereidUser.get_user_snapshot(nereid_user.id)
+
+        with patch.object(
+                Transaction, 'commit', autospec=True,
+                side_effect=commit_data_managers):
+            with Transaction().new_transaction():
+                NereidUser.revoke_auth_tokens([NereidUser(nereid_user.id)])
+                # A request of the transaction which read the user before
+                # the commit
+                key, = NereidUser._get_user_snapshot_keys([nereid_user.id])
+                NereidUser._user_snapshot_cache.set(key, snapshot)
+                Cache._resets.setdefault(dbname, set()).clear()
+            # The other workers miss the snapshot by its write date
+            self.assertNotIn('nereid.user.snapshot', Cache._resets[dbname])
+
+            with Transaction().new_transaction():
+                with app.test_request_context('/'):
+                    self.assertIsNone(NereidUser.load_user_from_token(token))
+
     @with_transaction()
     def test_0400_auth_xhr_wrong(self):
         """
@@ -1201,6 +1886,64 @@ class TestAuth(NereidTestCase):
             response = c.get("/me")
             self.assertEqual(response.status_code, 200)
 
+    @with_transaction()
+    def test_0440_login_throttling(self):
+        """
+        Login attempts over the limits are rejected before authentication
+        """
+        NereidUser = self.nereid_user_obj
+        self.setup_defaults()
+        app = self.get_app(
+            CACHE_TYPE='werkzeug.contrib.cache.SimpleCache',
+            THROTTLE={
+                'nereid.website.login': [
+                    Limit(2, 300, key='email', methods=['POST']),
+                ],
+            },
+            BASIC_AUTH_THROTTLE=[Limit(1, 300, key='email')],
+        )
+
+        party, = self.party_obj.create([{'name': 'Registered user'}])
+        NereidUser.create([{
+            'party': party,
+            'name': 'Registered User',
+            'email': 'email@example.com',
+            'password': 'password',
+            'company': self.company,
+        }])
+
+        def login(client, email, password):
+            return client.post('/login', data={
+                'email': email, 'password': password,
+            })
+
+        with app.test_client() as c:
+            self.assertEqual(c.get('/login').status_code, 200)
+            self.assertEqual(
+                login(c, 'email@example.com', 'wrong').status_code, 200
+            )
+            self.assertEqual(
+                login(c, 'EMAIL@example.com', 'wrong').status_code, 200
+            )
+            with patch.object(
+                    NereidUser, 'authenticate',
+                    side_effect=AssertionError('authenticated')):
+                response = login(c, 'email@example.com', 'password')
+            self.assertEqual(response.status_code, 429)
+            self.assertTrue(response.headers['Retry-After'])
+
+            # Other emails and GET requests are not throttled
+            self.assertEqual(
+                login(c, 'other@example.com', 'wrong').status_code, 200
+            )
+            self.assertEqual(c.get('/login').status_code, 200)
+
+            # Basic authentication attempts are throttled too
+            basic_auth = base64.b64encode(b'email@example.com:wrong')
+            headers = {'Authorization': 'Basic ' + basic_auth}
+            self.assertEqual(c.get('/me', headers=headers).status_code, 302)
+            self.assertEqual(c.get('/me', headers=headers).status_code, 429)
+
     @with_transaction()
     def test_0450_login_with_case_sensitive_emails(self):
         """
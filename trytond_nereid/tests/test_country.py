@@ -165,6 +165,48 @@ class TestCountry(NereidTestCase):
             data = json.loads(rv.data)
             self.assertEqual(len(data['result']), 0)
 
+    @with_transaction()
+    def test_0020_serialize_many(self):
+        """
+        Check the batched serialization keeps the order of the records
+        """
+        india, australia = self.Country.create([{
+            'name': 'India',
+            'code': 'IN'
+        }, {
+            'name': 'Australia',
+            'code': 'AU',
+        }])
+        orissa, kerala = self.Subdivision.create([{
+            'country': india.id,
+            'code': 'IN-OR',
+            'name': 'Orissa',
+            'type': 'state',
+        }, {
+            'country': india.id,
+            'code': 'IN-KL',
+            'name': 'Kerala',
+            'type': 'state',
+        }])
+
+        self.assertEqual(
+            self.Country.serialize_many([australia, india]), [
+                {'id': australia.id, 'name': 'Australia', 'code': 'AU'},
+                {'id': india.id, 'name': 'India', 'code': 'IN'},
+            ]
+        )
+        self.assertEqual(
+            india.serialize(),
+            {'id': india.id, 'name': 'India', 'code': 'IN'}
+        )
+        self.assertEqual(
+            self.Subdivision.serialize_many([kerala, orissa]), [
+                {'id': kerala.id, 'name': 'Kerala', 'code': 'IN-KL'},
+                {'id': orissa.id, 'name': 'Orissa', 'code': 'IN-OR'},
+            ]
+        )
+        self.assertEqual(self.Subdivision.serialize_many([]), [])
+
 
 def suite():
     "Country test suite"
@@ -7,10 +7,15 @@
     :copyright: (c) 2012-2013 by Openlabs Technologies & Consulting (P) Ltd.
     :license: GPLv3, see LICENSE for more details.
 """
+import shutil
+import tempfile
 import unittest
 
+from mock import patch
+
 import trytond.tests.test_tryton
 from trytond.tests.test_tryton import POOL, USER, with_transaction
+from trytond.config import config
 from nereid.testing import NereidTestCase
 from nereid import render_template
 from trytond.transaction import Transaction
@@ -223,6 +228,43 @@ class TestI18N(NereidTestCase):
             self.assertEqual(singular, u"1 pomme")
             self.assertEqual(plural, u"2 pommes")
 
+    @with_transaction()
+    def test_0040_lazy_memoized(self):
+        """
+        Lazy strings are looked up once per language and catalog version
+        """
+        IRTranslation = POOL.get('ir.translation')
+
+        s = _("Hi %(name)s", name="Sharoon")
+        self.set_translations()
+        self.update_translations('fr_FR')
+
+        with patch.object(
+                IRTranslation, 'get_translation_4_nereid',
+                wraps=IRTranslation.get_translation_4_nereid) as lookup:
+            self.assertEqual(s, u'Hi Sharoon')
+            self.assertEqual(unicode(s), u'Hi Sharoon')
+            self.assertEqual(lookup.call_count, 1)
+
+            with Transaction().set_context(language="fr_FR"):
+                self.assertEqual(s, u'Hi Sharoon')
+                self.assertEqual(s, u'Hi Sharoon')
+            self.assertEqual(lookup.call_count, 2)
+
+            # A change of the catalog is a new version
+            translation, = IRTranslation.search([
+                ('module', '=', 'nereid'),
+                ('src', '=', 'Hi %(name)s'),
+                ('lang', '=', 'fr_FR')
+            ])
+            translation.value = 'Bonjour %(name)s'
+            translation.save()
+
+            with Transaction().set_context(language="fr_FR"):
+                self.assertEqual(s, u'Bonjour Sharoon')
+                self.assertEqual(s, u'Bonjour Sharoon')
+            self.assertEqual(lookup.call_count, 3)
+
     @with_transaction()
     def test_0110_template(self):
         """
@@ -324,6 +366,118 @@ class TestI18N(NereidTestCase):
                 ))
                 check_fr_fr(rv)
 
+    @with_transaction()
+    def test_0120_compiled_template_translations(self):
+        """
+        Test translations compiled into the templates of each language
+        """
+        IRTranslation = POOL.get('ir.translation')
+
+        self.setup_defaults()
+        app = self.get_app(TEMPLATE_COMPILE_TRANSLATIONS=True)
+
+        class User(object):
+            username = 'Sharoon'
+
+        template_context = {
+            'user': User(),
+            'username': 'Sharoon',
+            'list': [1],
+            'objname': 'name',
+            'apples': [1, 2],
+        }
+
+        def render():
+            return unicode(render_template(
+                'tests/translation-test.html', **template_context
+            ))
+
+        with app.test_request_context('/en_US/'):
+            rv = render()
+            self.assertTrue('Hello World!' in rv)
+            self.assertTrue('<p>Hello Sharoon!</p>' in rv)
+
+        self.set_translations()
+        self.update_translations('fr_FR')
+
+        translation, = IRTranslation.search([
+            ('module', '=', 'nereid_test'),
+            ('type', '=', 'nereid_template'),
+            ('src', '=', 'Hello World!'),
+            ('lang', '=', 'fr_FR')
+        ])
+        translation.value = 'Bonjour le monde!'
+        translation.save()
+
+        translation, = IRTranslation.search([
+            ('module', '=', 'nereid_test'),
+            ('type', '=', 'nereid_template'),
+            ('src', '=', 'Hello %(username)s!'),
+            ('lang', '=', 'fr_FR')
+        ])
+        translation.value = 'Bonjour %(username)s!'
+        translation.save()
+
+        with app.test_request_context('/fr_FR/'):
+            with Transaction().set_context(language="fr_FR"):
+                rv = render()
+                self.assertTrue('Bonjour le monde!' in rv)
+                self.assertTrue('<p>Bonjour Sharoon!</p>' in rv)
+                self.assertTrue('2 apples' in rv)
+
+        # The english variant is not affected
+        with app.test_request_context('/en_US/'):
+            rv = render()
+            self.assertTrue('Hello World!' in rv)
+            self.assertTrue('<p>Hello Sharoon!</p>' in rv)
+
+        # Changes to the translations compile the template again
+        translation.value = 'Salut %(username)s!'
+        translation.save()
+        with app.test_request_context('/fr_FR/'):
+            with Transaction().set_context(language="fr_FR"):
+                rv = render()
+                self.assertTrue('Bonjour le monde!' in rv)
+                self.assertTrue('<p>Salut Sharoon!</p>' in rv)
+
+        # With mapped translations the strings are folded from the exported
+        # catalog, which gettext uses at render time too
+        if not config.has_section('nereid'):
+            config.add_section('nereid')
+        translations_path = tempfile.mkdtemp()
+        config.set('nereid', 'translations_path', translations_path)
+        config.set('nereid', 'mapped_translations', 'True')
+        try:
+            IRTranslation.export_nereid_catalog('fr_FR')
+            IRTranslation._nereid_mapped_catalogs.clear()
+            # Not exported
+            translation, = IRTranslation.search([
+                ('module', '=', 'nereid_test'),
+                ('type', '=', 'nereid_template'),
+                ('src', '=', 'Hello World!'),
+                ('lang', '=', 'fr_FR')
+            ])
+            translation.value = 'Salut le monde!'
+            translation.save()
+            with app.test_request_context('/fr_FR/'):
+                with Transaction().set_context(language="fr_FR"):
+                    rv = render()
+                    self.assertTrue('Bonjour le monde!' in rv)
+                    self.assertTrue('<p>Salut Sharoon!</p>' in rv)
+
+            # Compiled again after the next export
+            IRTranslation.export_nereid_catalog('fr_FR')
+            IRTranslation._nereid_mapped_catalogs.clear()
+            with app.test_request_context('/fr_FR/'):
+                with Transaction().set_context(language="fr_FR"):
+                    rv = render()
+                    self.assertTrue('Salut le monde!' in rv)
+        finally:
+            config.remove_option('nereid', 'mapped_translations')
+            config.remove_option('nereid', 'translations_path')
+            IRTranslation._nereid_mapped_catalogs.clear()
+            shutil.rmtree(translations_path)
+
 
 def suite():
     "Nereid test suite"
@@ -3,6 +3,8 @@
 import unittest
 from decimal import Decimal
 
+from mock import patch
+
 import trytond.tests.test_tryton
 from trytond.tests.test_tryton import POOL, USER, with_transaction
 from trytond.transaction import Transaction
@@ -88,11 +90,11 @@ class TestRouting(NereidTestCase):
         """
         return self.templates.get(name)
 
-    def get_app(self):
+    def get_app(self, **options):
         """
         Inject transaction into the template context for the home template
         """
-        app = super(TestRouting, self).get_app()
+        app = super(TestRouting, self).get_app(**options)
         app.jinja_env.globals['Transaction'] = Transaction
         return app
 
@@ -297,6 +299,92 @@ class TestRouting(NereidTestCase):
             self.assertEqual(response.status_code, 200)
             self.assertEqual(response.data, 'Success')
 
+    @with_transaction()
+    def test_0080_trie_url_matching(self):
+        """
+        Test that routing works the same with the trie URL matcher
+        """
+        self.setup_defaults()
+        app = self.get_app(TRIE_URL_MATCHING=True)
+
+        with app.test_client() as c:
+            response = c.get('/')
+            self.assertEqual(response.status_code, 301)
+            self.assertEqual(
+                response.location,
+                'http://localhost/%s' % self.locale_en_us.code
+            )
+
+            response = c.get('/en_US/')
+            self.assertEqual(response.data, 'en_US')
+
+            response = c.get('/es_ES/')
+            self.assertEqual(response.data, 'es_ES')
+
+            response = c.get('/es_ES/this-does-not-exist')
+            self.assertEqual(response.status_code, 404)
+
+    @with_transaction()
+    def test_0090_shared_url_map(self):
+        """
+        Test that websites with the same routing profile share the URL map
+        """
+        self.setup_defaults()
+        app = self.get_app()
+
+        website2, website3 = self.nereid_website_obj.create([{
+            'name': 'website2',
+            'company': self.company,
+            'application_user': USER,
+            'default_locale': self.locale_en_us,
+            'locales': [('add', [self.locale_en_us.id])],
+        }, {
+            'name': 'website3',
+            'company': self.company,
+            'application_user': USER,
+            'default_locale': self.locale_en_us,
+        }])
+
+        url_map = self.nereid_website.get_url_adapter(app)
+        self.assertIs(website2.get_url_adapter(app), url_map)
+
+        # No locales, so a different URL map
+        self.assertIsNot(website3.get_url_adapter(app), url_map)
+
+        # A different default locale redirects / elsewhere
+        website2.default_locale = self.locale_es_es
+        website2.save()
+        self.nereid_website_obj.clear_url_adapter_cache()
+        self.assertIsNot(website2.get_url_adapter(app), url_map)
+        self.assertIs(self.nereid_website.get_url_adapter(app), url_map)
+
+    @with_transaction()
+    def test_0100_url_rules_in_shared_cache(self):
+        """
+        Test that the route definitions are found once and loaded from
+        the application cache by other processes
+        """
+        self.setup_defaults()
+        app = self.get_app(CACHE_TYPE='werkzeug.contrib.cache.SimpleCache')
+
+        definitions = app.url_rule_definitions
+        self.assertIn(
+            ('/', 'nereid.website.home', {}), definitions
+        )
+        self.assertEqual(app.cache.get(app.url_rules_cache_key), definitions)
+
+        # Another process sharing the cache
+        app2 = self.get_app()
+        app2.cache = app.cache
+        self.assertEqual(app2.url_rules_cache_key, app.url_rules_cache_key)
+        with patch.object(app2, 'find_url_rule_definitions') as find:
+            self.assertEqual(app2.url_rule_definitions, definitions)
+            self.assertFalse(find.called)
+
+        with app2.test_client() as c:
+            response = c.get('/en_US/')
+            self.assertEqual(response.data, 'en_US')
+
 
 def suite():
     "Nereid test suite"
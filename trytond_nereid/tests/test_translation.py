@@ -1,8 +1,18 @@
+# -*- coding: utf-8 -*-
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
+import os
 import unittest
+import shutil
+import tempfile
+
+import polib
+from mock import patch
+
 import trytond.tests.test_tryton
+from trytond import backend
 from trytond.tests.test_tryton import POOL, with_transaction
+from trytond.config import config
 from nereid.testing import NereidTestCase
 
 
@@ -333,6 +343,71 @@ class TestTranslation(NereidTestCase):
         ], count=True)
         self.assertEqual(count, 0)
 
+    @with_transaction()
+    def test_0210_translation_clean_index(self):
+        """
+        The clean looks the installed modules and sources up once and only
+        removes the translations without an equivalent in the sources
+        """
+        TranslationSet = POOL.get('ir.translation.set', type='wizard')
+        TranslationClean = POOL.get('ir.translation.clean', type='wizard')
+        IRTranslation = POOL.get('ir.translation')
+
+        session_id, _, _ = TranslationSet.create()
+        set_wizard = TranslationSet(session_id)
+        set_wizard.transition_set_()
+
+        # Messages from tests are cleaned
+        session_id, _, _ = TranslationClean.create()
+        clean_wizard = TranslationClean(session_id)
+        clean_wizard.transition_clean()
+        self.assertFalse(IRTranslation.search([
+            ('type', '=', 'nereid'),
+            ('name', 'like', 'tests/%'),
+        ]))
+
+        domain = [('type', 'in', ('nereid_template', 'wtforms', 'nereid'))]
+        count_before = IRTranslation.search(domain, count=True)
+
+        template_translation = IRTranslation.search([
+            ('type', '=', 'nereid_template'),
+            ('module', '=', 'nereid_test'),
+        ], limit=1)[0]
+        template_translation.res_id = 10000
+        template_translation.save()
+        wtforms_translation = IRTranslation.search([
+            ('type', '=', 'wtforms'),
+        ], limit=1)[0]
+        wtforms_translation.src = 'Not in wtforms'
+        wtforms_translation.save()
+        nereid_translation, = IRTranslation.create([{
+            'name': 'does/not/exist.py',
+            'res_id': 1,
+            'lang': 'en_US',
+            'src': 'Missing',
+            'type': 'nereid',
+            'module': 'nereid_test',
+        }])
+
+        session_id, _, _ = TranslationClean.create()
+        clean_wizard = TranslationClean(session_id)
+        with patch.object(
+                TranslationSet, '_get_installed_module_directories',
+                wraps=TranslationSet._get_installed_module_directories) \
+                as get_directories:
+            clean_wizard.transition_clean()
+            self.assertEqual(get_directories.call_count, 1)
+
+        self.assertEqual(
+            IRTranslation.search(domain, count=True), count_before - 2
+        )
+        for translation in (
+                template_translation, wtforms_translation,
+                nereid_translation):
+            self.assertFalse(
+                IRTranslation.search([('id', '=', translation.id)])
+            )
+
     @with_transaction()
     def test_0300_translation_update(self):
         """
@@ -401,6 +476,447 @@ class TestTranslation(NereidTestCase):
         IRTranslation.translation_export(new_lang.code, 'nereid_test')
         IRTranslation.translation_export(new_lang.code, 'nereid')
 
+    @with_transaction()
+    def test_0405_translation_import_override(self):
+        """
+        Entries overriding the translations of other modules are applied
+        without searching per entry
+        """
+        IRTranslation = POOL.get('ir.translation')
+        ModelData = POOL.get('ir.model.data')
+
+        menu_data = ModelData.search([
+            ('module', '=', 'nereid'),
+            ('model', '=', 'ir.ui.menu'),
+        ], limit=1)[0]
+        menu_translation, = IRTranslation.search([
+            ('lang', '=', 'en_US'),
+            ('module', '=', 'nereid'),
+            ('type', '=', 'model'),
+            ('name', '=', 'ir.ui.menu,name'),
+            ('res_id', '=', menu_data.db_id),
+        ])
+        field_translation, = IRTranslation.search([
+            ('lang', '=', 'en_US'),
+            ('module', '=', 'nereid'),
+            ('type', '=', 'field'),
+            ('name', '=', 'nereid.website,name'),
+        ])
+
+        pofile = polib.POFile()
+        pofile.append(polib.POEntry(
+            msgctxt='model:ir.ui.menu,name:nereid.%s' % menu_data.fs_id,
+            msgid=menu_translation.src,
+            msgstr=u'Overridden Menu',
+        ))
+        pofile.append(polib.POEntry(
+            msgctxt='field:nereid.website,name:nereid.',
+            msgid=field_translation.src,
+            msgstr=u'Overridden Field',
+            flags=['fuzzy'],
+        ))
+        po_file = tempfile.NamedTemporaryFile(suffix='.po')
+        pofile.save(po_file.name)
+
+        with patch.object(
+                ModelData, 'search',
+                wraps=ModelData.search) as model_data_search:
+            IRTranslation.translation_import(
+                'en_US', 'nereid_test', po_file.name
+            )
+            # Only the model data of the imported module is searched
+            self.assertEqual(model_data_search.call_count, 1)
+        po_file.close()
+
+        menu_translation = IRTranslation(menu_translation.id)
+        self.assertEqual(menu_translation.value, u'Overridden Menu')
+        self.assertEqual(menu_translation.overriding_module, 'nereid_test')
+        self.assertFalse(menu_translation.fuzzy)
+        field_translation = IRTranslation(field_translation.id)
+        self.assertEqual(field_translation.value, u'Overridden Field')
+        self.assertEqual(field_translation.overriding_module, 'nereid_test')
+        self.assertTrue(field_translation.fuzzy)
+
+    @with_transaction()
+    def test_0410_translation_stream(self):
+        """
+        Export and import translations entry by entry
+        """
+        IRTranslation = POOL.get('ir.translation')
+
+        exported = polib.pofile(
+            IRTranslation.translation_export('en_US', 'nereid').decode('utf-8')
+        )
+        po_file = tempfile.NamedTemporaryFile(suffix='.po')
+        count = IRTranslation.translation_export_stream(
+            'en_US', 'nereid', po_file, batch_size=10
+        )
+        po_file.flush()
+        streamed = polib.pofile(po_file.name)
+        self.assertEqual(count, len(exported))
+        self.assertEqual(
+            sorted((e.msgctxt, e.msgid, e.msgstr) for e in streamed),
+            sorted((e.msgctxt, e.msgid, e.msgstr) for e in exported),
+        )
+
+        entry = streamed[0]
+        entry.msgstr = u'Streamed €'
+        streamed.save(po_file.name)
+        translation, res_id = IRTranslation.from_poentry(entry)
+
+        imported = IRTranslation.translation_import_stream(
+            'en_US', 'nereid', po_file.name, batch_size=10
+        )
+        po_file.close()
+        self.assertEqual(
+            imported,
+            IRTranslation.search([
+                ('lang', '=', 'en_US'),
+                ('module', '=', 'nereid'),
+            ], count=True)
+        )
+        self.assertTrue(IRTranslation.search([
+            ('lang', '=', 'en_US'),
+            ('module', '=', 'nereid'),
+            ('type', '=', translation.type),
+            ('name', '=', translation.name),
+            ('value', '=', u'Streamed €'),
+        ]))
+
+    @with_transaction()
+    def test_0500_nereid_catalog(self):
+        """
+        Translations are looked up from a catalog loaded in one query
+        """
+        IRTranslation = POOL.get('ir.translation')
+
+        translation, = IRTranslation.create([{
+            'name': 'nereid_test/templates/home.jinja',
+            'type': 'nereid_template',
+            'lang': 'es_ES',
+            'module': 'nereid_test',
+            'res_id': 1,
+            'src': 'Hello',
+            'value': 'Hola',
+            'fuzzy': False,
+        }])
+
+        self.assertEqual(
+            IRTranslation.get_translation_4_nereid(
+                None, 'nereid_template', 'es_ES', 'Hello'
+            ),
+            'Hola'
+        )
+        self.assertEqual(
+            IRTranslation.get_translation_4_nereid(
+                'nereid_test', 'nereid_template', 'es_ES', 'Hello'
+            ),
+            'Hola'
+        )
+        self.assertIsNone(
+            IRTranslation.get_translation_4_nereid(
+                'nereid', 'nereid_template', 'es_ES', 'Hello'
+            )
+        )
+        self.assertIsNone(
+            IRTranslation.get_translation_4_nereid(
+                None, 'nereid_template', 'es_ES', 'Not translated'
+            )
+        )
+        self.assertEqual(
+            IRTranslation.get_nereid_catalog('es_ES', 'nereid_template'),
+            {'Hello': 'Hola'}
+        )
+
+        # Changes to the translations are seen right away
+        IRTranslation.write([translation], {'value': 'Buenos Dias'})
+        self.assertEqual(
+            IRTranslation.get_translation_4_nereid(
+                None, 'nereid_template', 'es_ES', 'Hello'
+            ),
+            'Buenos Dias'
+        )
+
+        # Fuzzy translations are not used
+        IRTranslation.write([translation], {'fuzzy': True})
+        self.assertIsNone(
+            IRTranslation.get_translation_4_nereid(
+                None, 'nereid_template', 'es_ES', 'Hello'
+            )
+        )
+
+    @with_transaction()
+    def test_0510_nereid_catalog_invalidation(self):
+        """
+        Only the catalogs of the changed translations are reloaded
+        """
+        IRTranslation = POOL.get('ir.translation')
+
+        values = {
+            'name': 'nereid_test/templates/home.jinja',
+            'type': 'nereid_template',
+            'module': 'nereid_test',
+            'res_id': 1,
+            'src': 'Hello',
+            'fuzzy': False,
+        }
+        spanish, = IRTranslation.create([
+            dict(values, lang='es_ES', value='Hola'),
+        ])
+
+        def versions():
+            return [
+                IRTranslation.get_nereid_catalog_version(*key) for key in (
+                    ('es_ES', 'nereid_template', None),
+                    ('es_ES', 'nereid_template', 'nereid_test'),
+                    ('fr_FR', 'nereid_template', None),
+                    ('es_ES', 'nereid', None),
+                )
+            ]
+
+        before = versions()
+        self.assertEqual(before, versions())
+
+        french, = IRTranslation.create([
+            dict(values, lang='fr_FR', value='Bonjour'),
+        ])
+        after = versions()
+        self.assertEqual(after[:2], before[:2])
+        self.assertNotEqual(after[2], before[2])
+        self.assertEqual(after[3], before[3])
+        self.assertEqual(
+            IRTranslation.get_translation_4_nereid(
+                None, 'nereid_template', 'fr_FR', 'Hello'
+            ),
+            'Bonjour'
+        )
+
+        before = after
+        IRTranslation.write([spanish], {'value': 'Buenos Dias'})
+        after = versions()
+        self.assertNotEqual(after[0], before[0])
+        self.assertNotEqual(after[1], before[1])
+        self.assertEqual(after[2:], before[2:])
+
+        # Moving a translation to another language reloads both
+        before = after
+        IRTranslation.write([french], {'lang': 'de_DE'})
+        after = versions()
+        self.assertEqual(after[:2], before[:2])
+        self.assertNotEqual(after[2], before[2])
+        self.assertIsNone(
+            IRTranslation.get_translation_4_nereid(
+                None, 'nereid_template', 'fr_FR', 'Hello'
+            )
+        )
+        self.assertEqual(
+            IRTranslation.get_translation_4_nereid(
+                None, 'nereid_template', 'de_DE', 'Hello'
+            ),
+            'Bonjour'
+        )
+
+        before = after
+        IRTranslation.delete([spanish])
+        after = versions()
+        self.assertNotEqual(after[0], before[0])
+        self.assertEqual(after[2:], before[2:])
+
+    @with_transaction()
+    def test_0520_mapped_catalog(self):
+        """
+        Translations are looked up from an exported binary catalog
+        """
+        IRTranslation = POOL.get('ir.translation')
+
+        translation, = IRTranslation.create([{
+            'name': 'nereid_test/templates/home.jinja',
+            'type': 'nereid_template',
+            'lang': 'es_ES',
+            'module': 'nereid_test',
+            'res_id': 1,
+            'src': u'Hello €',
+            'value': u'Hola €',
+            'fuzzy': False,
+        }])
+
+        if not config.has_section('nereid'):
+            config.add_section('nereid')
+        translations_path = tempfile.mkdtemp()
+        config.set('nereid', 'translations_path', translations_path)
+        config.set('nereid', 'mapped_translations', 'True')
+        try:
+            # Not exported yet
+            self.assertIsNone(IRTranslation.get_nereid_mapped_catalog('es_ES'))
+
+            IRTranslation.export_nereid_catalog('es_ES')
+            IRTranslation._nereid_mapped_catalogs.clear()
+            self.assertEqual(
+                IRTranslation.get_translation_4_nereid(
+                    None, 'nereid_template', 'es_ES', u'Hello €'
+                ),
+                u'Hola €'
+            )
+            self.assertEqual(
+                IRTranslation.get_translation_4_nereid(
+                    'nereid_test', 'nereid_template', 'es_ES', u'Hello €'
+                ),
+                u'Hola €'
+            )
+            self.assertIsNone(
+                IRTranslation.get_translation_4_nereid(
+                    'nereid', 'nereid_template', 'es_ES', u'Hello €'
+                )
+            )
+            self.assertIsNone(
+                IRTranslation.get_translation_4_nereid(
+                    None, 'nereid', 'es_ES', u'Hello €'
+                )
+            )
+
+            # Changes are seen after the next export
+            translation.value = u'Buenos Dias'
+            translation.save()
+            IRTranslation.export_nereid_catalog('es_ES')
+            IRTranslation._nereid_mapped_catalogs.clear()
+            self.assertEqual(
+                IRTranslation.get_translation_4_nereid(
+                    None, 'nereid_template', 'es_ES', u'Hello €'
+                ),
+                u'Buenos Dias'
+            )
+        finally:
+            config.remove_option('nereid', 'mapped_translations')
+            config.remove_option('nereid', 'translations_path')
+            IRTranslation._nereid_mapped_catalogs.clear()
+            shutil.rmtree(translations_path)
+
+    @with_transaction()
+    def test_0530_set_is_idempotent(self):
+        """
+        Setting the translations again does not create duplicates and does
+        not search translations per message
+        """
+        TranslationSet = POOL.get('ir.translation.set', type='wizard')
+        IRTranslation = POOL.get('ir.translation')
+
+        session_id, _, _ = TranslationSet.create()
+        set_wizard = TranslationSet(session_id)
+
+        set_wizard.set_nereid_template()
+        set_wizard.set_wtforms()
+        set_wizard.set_nereid()
+
+        counts = {}
+        for ttype in ('nereid_template', 'wtforms', 'nereid'):
+            counts[ttype] = IRTranslation.search([
+                ('type', '=', ttype),
+                ('lang', '=', 'en_US'),
+            ], count=True)
+            self.assertTrue(counts[ttype] > 0)
+
+        with patch.object(
+                IRTranslation, 'search',
+                side_effect=AssertionError('search called')):
+            set_wizard.set_nereid_template()
+            set_wizard.set_wtforms()
+            set_wizard.set_nereid()
+
+        for ttype in ('nereid_template', 'wtforms', 'nereid'):
+            self.assertEqual(
+                IRTranslation.search([
+                    ('type', '=', ttype),
+                    ('lang', '=', 'en_US'),
+                ], count=True),
+                counts[ttype]
+            )
+
+    @with_transaction()
+    def test_0540_extraction_cache(self):
+        """
+        Messages are extracted in a process pool if enabled and cached on
+        disk, so only changed files are extracted again
+        """
+        from trytond.modules.nereid import translation as nereid_translation
+        TranslationSet = POOL.get('ir.translation.set', type='wizard')
+
+        # In the current process by default
+        self.assertEqual(TranslationSet._get_extraction_processes(), 1)
+
+        cache_path = tempfile.mkdtemp()
+        source_path = tempfile.mkdtemp()
+        config.set('nereid', 'extraction_cache_path', cache_path)
+        config.set('nereid', 'extraction_processes', '2')
+        try:
+            tasks = []
+            for name, message in [('a.py', 'Apple'), ('b.py', 'Banana')]:
+                path = os.path.join(source_path, name)
+                with open(path, 'w') as file_obj:
+                    file_obj.write('_("%s")\n' % message)
+                tasks.append(('python', path, None))
+
+            self.assertEqual(
+                TranslationSet._extract_messages(tasks),
+                [
+                    [(1, u'Apple', [], None)],
+                    [(1, u'Banana', [], None)],
+                ]
+            )
+            self.assertEqual(len(os.listdir(cache_path)), 2)
+
+            # Nothing is extracted again from unchanged files
+            with patch.object(
+                    nereid_translation, '_extract_file',
+                    side_effect=AssertionError('extracted')):
+                self.assertEqual(
+                    TranslationSet._extract_messages(tasks),
+                    [
+                        [(1, u'Apple', [], None)],
+                        [(1, u'Banana', [], None)],
+                    ]
+                )
+
+            # Only the changed file is extracted again
+            with open(tasks[1][1], 'w') as file_obj:
+                file_obj.write('\n_("Blueberry")\n')
+            with patch.object(
+                    nereid_translation, '_extract_file',
+                    wraps=nereid_translation._extract_file) as extract_file:
+                self.assertEqual(
+                    TranslationSet._extract_messages(tasks),
+                    [
+                        [(1, u'Apple', [], None)],
+                        [(2, u'Blueberry', [], None)],
+                    ]
+                )
+                extract_file.assert_called_once_with(tasks[1])
+        finally:
+            config.remove_option('nereid', 'extraction_cache_path')
+            config.remove_option('nereid', 'extraction_processes')
+            shutil.rmtree(cache_path)
+            shutil.rmtree(source_path)
+
+    @with_transaction()
+    def test_0600_lookup_indexes(self):
+        """
+        The nereid module creates the indexes of its hot lookups, unless
+        the index of a unique constraint serves the lookup
+        """
+        TableHandler = backend.get('TableHandler')
+        for model, columns, constraint in [
+                ('ir.translation', ['lang', 'type', 'module'], None),
+                ('nereid.user', ['email', 'company'],
+                    'unique_email_company'),
+                ('nereid.static.file', ['folder', 'name'],
+                    'name_folder_uniq')]:
+            table = TableHandler(POOL.get(model), 'nereid')
+            index = '%s_%s_index' % (table.table_name, '_'.join(columns))
+            if constraint and '%s_%s' % (
+                    table.table_name, constraint) in table._constraints:
+                self.assertNotIn(index, table._indexes)
+            else:
+                self.assertIn(index, table._indexes)
+
 
 def suite():
     "Nereid test suite"
@@ -5,6 +5,9 @@ import json
 
 import trytond.tests.test_tryton
 from trytond.tests.test_tryton import POOL, USER, with_transaction
+from trytond.transaction import Transaction
+from nereid import current_website, current_locale
+from nereid.signals import transaction_start, transaction_stop
 from nereid.testing import NereidTestCase
 
 
@@ -73,6 +76,38 @@ class TestWebsite(NereidTestCase):
             self.assertEqual(data['status']['logged_id'], False)
             self.assertEqual(data['status']['messages'], [])
 
+    @with_transaction()
+    def test_0020_shared_globals(self):
+        """
+        The website and locale globals share their records within the
+        transaction of a request
+        """
+        self.setup_defaults()
+        app = self.get_app()
+
+        with app.test_request_context('/'):
+            website = current_website._get_current_object()
+            locale = current_locale._get_current_object()
+            self.assertIs(current_website._get_current_object(), website)
+            self.assertIs(current_locale._get_current_object(), locale)
+            self.assertEqual(website.name, 'localhost')
+            self.assertEqual(locale.code, 'en_US')
+
+            # Records read in another context are not shared with it
+            with Transaction().set_context(language='fr_FR'):
+                other = current_website._get_current_object()
+                self.assertIsNot(other, website)
+                self.assertIs(current_website._get_current_object(), other)
+                self.assertEqual(other._context['language'], 'fr_FR')
+            self.assertIs(current_website._get_current_object(), website)
+
+            # Cleared when a transaction of the request starts or stops
+            transaction_start.send(app)
+            self.assertIsNot(current_website._get_current_object(), website)
+            website = current_website._get_current_object()
+            transaction_stop.send(app)
+            self.assertIsNot(current_website._get_current_object(), website)
+
 
 def suite():
     "Nereid test suite"
@@ -13,21 +13,32 @@
 
 '''
 import os
+import time
 import polib
+import cPickle
+import hashlib
 import logging
+import tempfile
+import multiprocessing
+from itertools import count, islice
+from threading import Lock, local
 
 import wtforms
 from jinja2 import FileSystemLoader, Environment
 from jinja2.ext import babel_extract, GETTEXT_FUNCTIONS
 from babel.messages.extract import extract_from_dir
-from babel.messages.extract import extract_from_file
+from babel.messages.extract import extract_from_file, pathmatch
+from trytond import backend
 from trytond.model import fields
 from trytond.wizard import Wizard
 from trytond.transaction import Transaction
 from trytond.pool import Pool, PoolMeta
 from trytond.cache import Cache
-from trytond.tools import file_open, cursor_dict
+from trytond.tools import file_open, cursor_dict, grouped_slice
+from trytond.config import config
 from trytond.ir.translation import TrytonPOFile
+from nereid.contrib.catalog import MappedCatalog, catalog_key, save_mo
+from nereid.contrib.po import POWriter, iter_po_entries
 
 __all__ = [
     'Translation',
@@ -46,6 +57,46 @@ _nereid_types = [type[0] for type in NEREID_TRANSLATION_TYPES]
 
 __metaclass__ = PoolMeta
 
+#: Changing this invalidates the extraction cache of existing installations
+EXTRACTION_CACHE_VERSION = 1
+
+
+def _extract_file(task):
+    """
+    Extract the messages of a single file. This is the unit of work which
+    is fanned out across the process pool and so it has to be a module
+    level function.
+
+    :param task: a `(method, path, options)` tuple. The method is either
+                 'jinja' for nereid templates or a babel extraction method
+                 like 'python'.
+    :return: a list of the message tuples of the extraction method
+    """
+    method, path, options = task
+    if method == 'jinja':
+        with open(path) as file_obj:
+            return list(babel_extract(
+                file_obj, GETTEXT_FUNCTIONS, ['trans:'], options
+            ))
+    return extract_from_file(method, path, options=options)
+
+
+def _extraction_cache_key(task):
+    """
+    Returns the key of the extraction of a file in the disk cache or None
+    if the file does not exist.
+    """
+    method, path, options = task
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return hashlib.md5(repr((
+        EXTRACTION_CACHE_VERSION, os.path.abspath(path),
+        stat.st_mtime, stat.st_size, method,
+        sorted((options or {}).items()),
+    ))).hexdigest()
+
 
 class Translation:
     __name__ = 'ir.translation'
@@ -62,6 +113,16 @@ class Translation:
             if nereid_type not in cls.type.selection:
                 cls.type.selection.append(nereid_type)
 
+    @classmethod
+    def __register__(cls, module_name):
+        TableHandler = backend.get('TableHandler')
+
+        super(Translation, cls).__register__(module_name)
+
+        table = TableHandler(cls, module_name)
+        # The nereid catalogs are loaded by language, type and module
+        table.index_action(['lang', 'type', 'module'], 'add')
+
     @property
     def unique_key(self):
         if self.type in _nereid_types:
@@ -69,11 +130,10 @@ class Translation:
         return super(Translation, self).unique_key
 
     @classmethod
-    def translation_import(cls, lang, module, po_path):
+    def _get_import_fs_ids(cls, module):
         """
-        Override the entire method: upstream code needs refactoring to allow
-        for customization.
-        Based on trytond version: 3.2.4
+        Returns a dictionary of `(db_id, noupdate)` by fs_id by model for the
+        model data of the module.
         """
         pool = Pool()
         ModelData = pool.get('ir.model.data')
@@ -89,9 +149,44 @@ class Translation:
                 fs_id2prop.setdefault(extra_model, {})
                 fs_id2prop[extra_model][model_data.fs_id] = \
                     (model_data.db_id, model_data.noupdate)
+        return fs_id2prop
+
+    @staticmethod
+    def _get_import_res_id(fs_id2prop, translation, res_id):
+        """
+        Returns the res_id of the imported translation and whether the
+        record is noupdate.
+        """
+        noupdate = False
+        model = translation.name.split(',')[0]
+        if (model in fs_id2prop and
+                res_id in fs_id2prop[model]):
+            res_id, noupdate = fs_id2prop[model][res_id]
+
+        if res_id:
+            try:
+                res_id = int(res_id)
+            except ValueError:
+                res_id = None
+        if not res_id:
+            res_id = -1
+        return res_id, noupdate
+
+    @classmethod
+    def translation_import(cls, lang, module, po_path):
+        """
+        Override the entire method: upstream code needs refactoring to allow
+        for customization.
+        Based on trytond version: 3.2.4
+        """
+        fs_id2prop = cls._get_import_fs_ids(module)
+
+        logger = logging.getLogger('nereid.translation')
+        start = time.time()
 
         translations = set()
         to_create = []
+        to_override = []
         pofile = polib.pofile(po_path)
 
         id2translation = {}
@@ -112,38 +207,6 @@ class Translation:
             ):
                 id2translation[translation.id] = translation
 
-        def override_translation(ressource_id, new_translation):
-            res_id_module, res_id = ressource_id.split('.')
-            if res_id:
-                model_data, = ModelData.search([
-                        ('module', '=', res_id_module),
-                        ('fs_id', '=', res_id),
-                        ])
-                res_id = model_data.db_id
-            else:
-                res_id = -1
-            with Transaction().set_user(0), \
-                    Transaction().set_context(module=res_id_module):
-                domain = [
-                    ('name', '=', new_translation.name),
-                    ('res_id', '=', res_id),
-                    ('lang', '=', new_translation.lang),
-                    ('type', '=', new_translation.type),
-                    ('module', '=', res_id_module),
-                    ]
-                # Begin nereid changes
-                if new_translation.type in ('odt', 'view', 'wizard_button',
-                        'selection', 'error', 'nereid', 'nereid_template',
-                        'wtforms'):
-                        # End nereid changes
-                    domain.append(('src', '=', new_translation.src))
-                translation, = cls.search(domain)
-                if translation.value != new_translation.value:
-                    translation.value = new_translation.value
-                    translation.overriding_module = module
-                    translation.fuzzy = new_translation.fuzzy
-                    translation.save()
-
         # Make a first loop to retreive translation ids in the right order to
         # get better read locality and a full usage of the cache.
         translation_ids = []
@@ -156,6 +219,7 @@ class Translation:
             if processing and len(module_translations) > record_cache_size:
                 id2translation = dict((t.id, t)
                     for t in cls.browse(translation_ids))
+            to_write = {}
             for entry in pofile:
                 translation, res_id = cls.from_poentry(entry)
                 translation.lang = lang
@@ -163,22 +227,13 @@ class Translation:
                 noupdate = False
 
                 if '.' in res_id:
-                    override_translation(res_id, translation)
+                    if processing:
+                        to_override.append((res_id, translation))
                     continue
 
-                model = translation.name.split(',')[0]
-                if (model in fs_id2prop and
-                        res_id in fs_id2prop[model]):
-                    res_id, noupdate = fs_id2prop[model][res_id]
-
-                if res_id:
-                    try:
-                        res_id = int(res_id)
-                    except ValueError:
-                        res_id = None
-                if not res_id:
-                    res_id = -1
-
+                res_id, noupdate = cls._get_import_res_id(
+                    fs_id2prop, translation, res_id
+                )
                 translation.res_id = res_id
                 key = translation.unique_key
                 if not key:
@@ -193,21 +248,33 @@ class Translation:
                 if not ids:
                     to_create.append(translation._save_values)
                 else:
-                    to_write = []
-                    for translation_id in ids:
-                        old_translation = id2translation[translation_id]
-                        if (old_translation.value != translation.value or
-                                old_translation.fuzzy !=
-                                translation.fuzzy):
-                            to_write.append(old_translation)
-                    with Transaction().set_user(0), \
-                            Transaction().set_context(module=module):
-                        if to_write and not noupdate:
-                            cls.write(to_write, {
-                                    'value': translation.value,
-                                    'fuzzy': translation.fuzzy,
-                                    })
-                        translations |= set(cls.browse(ids))
+                    if not noupdate:
+                        for translation_id in ids:
+                            old_translation = id2translation[translation_id]
+                            if (old_translation.value != translation.value or
+                                    old_translation.fuzzy !=
+                                    translation.fuzzy):
+                                to_write[old_translation] = (
+                                    translation.value, translation.fuzzy
+                                )
+                    translations |= set(cls.browse(ids))
+
+            if to_write:
+                # Write the translations with the same value at once
+                value2records = {}
+                for record, values in to_write.iteritems():
+                    value2records.setdefault(values, []).append(record)
+                args = []
+                for (value, fuzzy), records in value2records.iteritems():
+                    args.extend((records, {
+                        'value': value,
+                        'fuzzy': fuzzy,
+                    }))
+                with Transaction().set_user(0), \
+                        Transaction().set_context(module=module):
+                    cls.write(*args)
+
+        cls._override_translations(lang, module, to_override)
 
         if to_create:
             with Transaction().set_user(0), \
@@ -221,8 +288,123 @@ class Translation:
                         ]))
             translations_to_delete = all_translations - translations
             cls.delete(list(translations_to_delete))
+
+        duration = time.time() - start
+        logger.info(
+            'Imported %s entries of %s (%s) in %.2fs: %.0f rows/s',
+            len(pofile), module, lang, duration,
+            len(pofile) / duration if duration else len(pofile)
+        )
         return len(translations)
 
+    @classmethod
+    def _override_translations(cls, lang, module, overrides):
+        """
+        Override the translations of other modules with the entries of the
+        imported module. The referenced records and the overridden
+        translations are looked up in batches and the changed translations
+        written grouped by value.
+
+        :param overrides: a list of `(ressource_id, translation)` tuples
+                          where the ressource_id is `module.fs_id`
+        """
+        pool = Pool()
+        ModelData = pool.get('ir.model.data')
+        model_data = ModelData.__table__()
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+
+        if not overrides:
+            return
+
+        fs_ids = {}
+        names = {}
+        for ressource_id, translation in overrides:
+            res_id_module, res_id = ressource_id.split('.')
+            if res_id:
+                fs_ids.setdefault(res_id_module, set()).add(res_id)
+            names.setdefault(res_id_module, set()).add(translation.name)
+
+        fs_id2db_id = {}
+        for res_id_module, module_fs_ids in fs_ids.iteritems():
+            for sub_fs_ids in grouped_slice(module_fs_ids):
+                cursor.execute(*model_data.select(
+                    model_data.fs_id, model_data.db_id,
+                    where=(model_data.module == res_id_module) &
+                    model_data.fs_id.in_(list(sub_fs_ids))
+                ))
+                for fs_id, db_id in cursor.fetchall():
+                    fs_id2db_id[(res_id_module, fs_id)] = db_id
+
+        # Begin nereid changes
+        src_types = (
+            'odt', 'view', 'wizard_button', 'selection', 'error',
+            'nereid', 'nereid_template', 'wtforms',
+        )
+        # End nereid changes
+
+        def key(module, name, res_id, type_, src):
+            if type_ in src_types:
+                return (module, name, res_id, type_, src)
+            return (module, name, res_id, type_)
+
+        key2rows = {}
+        for res_id_module, module_names in names.iteritems():
+            for sub_names in grouped_slice(module_names):
+                cursor.execute(*table.select(
+                    table.id, table.name, table.res_id, table.type,
+                    table.src, table.value,
+                    where=(table.lang == lang) &
+                    (table.module == res_id_module) &
+                    table.name.in_(list(sub_names))
+                ))
+                for id_, name, res_id, type_, src, value in cursor.fetchall():
+                    key2rows.setdefault(
+                        key(res_id_module, name, res_id, type_, src), []
+                    ).append((id_, value))
+
+        to_write = {}
+        for ressource_id, new_translation in overrides:
+            res_id_module, res_id = ressource_id.split('.')
+            if res_id:
+                if (res_id_module, res_id) not in fs_id2db_id:
+                    raise ValueError(
+                        'Unknown record %s in translation override' %
+                        ressource_id
+                    )
+                res_id = fs_id2db_id[(res_id_module, res_id)]
+            else:
+                res_id = -1
+            rows = key2rows.get(key(
+                res_id_module, new_translation.name, res_id,
+                new_translation.type, new_translation.src
+            ), [])
+            if len(rows) != 1:
+                raise ValueError(
+                    'Expected one translation of %s to override, found %s' %
+                    (ressource_id, len(rows))
+                )
+            (id_, value), = rows
+            if value != new_translation.value:
+                to_write.setdefault(res_id_module, {})[id_] = (
+                    new_translation.value, new_translation.fuzzy
+                )
+
+        for res_id_module, id2values in to_write.iteritems():
+            values2ids = {}
+            for id_, values in id2values.iteritems():
+                values2ids.setdefault(values, []).append(id_)
+            args = []
+            for (value, fuzzy), ids in values2ids.iteritems():
+                args.extend((cls.browse(ids), {
+                    'value': value,
+                    'overriding_module': module,
+                    'fuzzy': fuzzy,
+                }))
+            with Transaction().set_user(0), \
+                    Transaction().set_context(module=res_id_module):
+                cls.write(*args)
+
     @classmethod
     def translation_export(cls, lang, module):
         """
@@ -231,19 +413,9 @@ class Translation:
         Based on trytond version: 3.2.4
         """
         pool = Pool()
-        ModelData = pool.get('ir.model.data')
         Config = pool.get('ir.configuration')
 
-        models_data = ModelData.search([
-            ('module', '=', module),
-        ])
-        db_id2fs_id = {}
-        for model_data in models_data:
-            db_id2fs_id.setdefault(model_data.model, {})
-            db_id2fs_id[model_data.model][model_data.db_id] = model_data.fs_id
-            for extra_model in cls.extra_model_data(model_data):
-                db_id2fs_id.setdefault(extra_model, {})
-                db_id2fs_id[extra_model][model_data.db_id] = model_data.fs_id
+        db_id2fs_id = cls._get_export_fs_ids(module)
 
         pofile = TrytonPOFile(wrapwidth=78)
         pofile.metadata = {
@@ -256,43 +428,13 @@ class Translation:
                 ('module', '=', module),
             ], order=[])
         for translation in translations:
-            if (translation.overriding_module and
-                    translation.overriding_module != module):
-                cls.raise_user_error('translation_overridden', {
-                    'name': translation.name,
-                    'overriding_module': translation.overriding_module,
-                })
-            flags = [] if not translation.fuzzy else ['fuzzy']
-            trans_ctxt = '%(type)s:%(name)s:' % {
-                'type': translation.type,
-                'name': translation.name,
-            }
-            res_id = translation.res_id
-
-            # Begin nereid changes
-            # don't export nereid items with res_id == -1, because there
-            # is definitely something wrong with them (messages that weren't
-            # updated, but just imported)
-            if res_id == -1 and translation.type in _nereid_types:
-                continue
-            # append res_id generally for nereid items
-            if res_id >= 0:
-                if translation.type not in _nereid_types:
-                    model, _ = translation.name.split(',')
-                    if model in db_id2fs_id:
-                        res_id = db_id2fs_id[model].get(res_id)
-                    else:
-                        continue
-                trans_ctxt += '%s' % res_id
-            # End nereid changes
-
-            entry = polib.POEntry(
-                msgid=(translation.src or ''),
-                msgstr=(translation.value or ''),
-                msgctxt=trans_ctxt,
-                flags=flags
+            entry = cls._get_export_poentry(
+                module, db_id2fs_id, translation.type, translation.name,
+                translation.res_id, translation.src, translation.value,
+                translation.fuzzy, translation.overriding_module
             )
-            pofile.append(entry)
+            if entry is not None:
+                pofile.append(entry)
 
         if pofile:
             pofile.sort()
@@ -300,24 +442,277 @@ class Translation:
         else:
             return
 
-    # Begin nereid changes
-    _nereid_translation_cache = Cache(
-        'ir.translation', size_limit=10240, context=False
-    # End nereid changes
-    )
+    @classmethod
+    def _get_export_fs_ids(cls, module):
+        """
+        Returns a dictionary of fs_id by db_id by model for the model data of
+        the module.
+        """
+        ModelData = Pool().get('ir.model.data')
+
+        models_data = ModelData.search([
+            ('module', '=', module),
+        ])
+        db_id2fs_id = {}
+        for model_data in models_data:
+            db_id2fs_id.setdefault(model_data.model, {})
+            db_id2fs_id[model_data.model][model_data.db_id] = model_data.fs_id
+            for extra_model in cls.extra_model_data(model_data):
+                db_id2fs_id.setdefault(extra_model, {})
+                db_id2fs_id[extra_model][model_data.db_id] = model_data.fs_id
+        return db_id2fs_id
 
     @classmethod
-    def get_translation_4_nereid(cls, module, ttype, lang, source):
-        "Return translation for source"
-        ttype = unicode(ttype)
-        lang = unicode(lang)
-        source = unicode(source)
+    def _get_export_poentry(cls, module, db_id2fs_id, type_, name, res_id,
+                            src, value, fuzzy, overriding_module):
+        """
+        Returns the PO entry of an exported translation or None if the
+        translation is not exported.
+        """
+        if overriding_module and overriding_module != module:
+            cls.raise_user_error('translation_overridden', {
+                'name': name,
+                'overriding_module': overriding_module,
+            })
+        flags = [] if not fuzzy else ['fuzzy']
+        trans_ctxt = '%(type)s:%(name)s:' % {
+            'type': type_,
+            'name': name,
+        }
+
+        # Begin nereid changes
+        # don't export nereid items with res_id == -1, because there
+        # is definitely something wrong with them (messages that weren't
+        # updated, but just imported)
+        if res_id == -1 and type_ in _nereid_types:
+            return None
+        # append res_id generally for nereid items
+        if res_id >= 0:
+            if type_ not in _nereid_types:
+                model, _ = name.split(',')
+                if model in db_id2fs_id:
+                    res_id = db_id2fs_id[model].get(res_id)
+                else:
+                    return None
+            trans_ctxt += '%s' % res_id
+        # End nereid changes
+
+        return polib.POEntry(
+            msgid=(src or ''),
+            msgstr=(value or ''),
+            msgctxt=trans_ctxt,
+            flags=flags
+        )
+
+    @staticmethod
+    def _get_stream_cursor():
+        """
+        Returns a cursor to iterate over large results. On PostgreSQL it is a
+        server side cursor, so that the rows are fetched as they are read.
+        """
+        connection = Transaction().connection
+        if backend.name() == 'postgresql':
+            # psycopg2 creates a server side cursor for a named cursor
+            return connection.cursor('nereid_translation_stream')
+        return connection.cursor()
+
+    @classmethod
+    def translation_export_stream(cls, lang, module, fileobj,
+                                  batch_size=1000):
+        """
+        Write the translations of the module in the language to the file
+        object as a PO file. Unlike :meth:`translation_export` the entries
+        are read from the database in batches and written as they are read,
+        so that the memory used does not depend on the size of the catalog.
+        The entries are ordered by type, name, res_id and source.
+
+        Returns the number of entries written.
+        """
+        db_id2fs_id = cls._get_export_fs_ids(module)
+        table = cls.__table__()
 
-        cache_key = (lang, ttype, source, module)
+        writer = POWriter(fileobj, {
+            'Content-Type': 'text/plain; charset=utf-8',
+        })
+        cursor = cls._get_stream_cursor()
+        try:
+            cursor.execute(*table.select(
+                table.type, table.name, table.res_id, table.src,
+                table.value, table.fuzzy, table.overriding_module,
+                where=(table.lang == lang) & (table.module == module),
+                order_by=[table.type, table.name, table.res_id, table.src]
+            ))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    entry = cls._get_export_poentry(module, db_id2fs_id, *row)
+                    if entry is not None:
+                        writer.write(entry)
+        finally:
+            cursor.close()
+        return writer.count
+
+    @classmethod
+    def translation_import_stream(cls, lang, module, po_path,
+                                  batch_size=1000):
+        """
+        Import the translations of the module in the language from a PO
+        file like :meth:`translation_import`, but the entries are parsed
+        incrementally and processed in batches of `batch_size`. Besides the
+        batch, only the ids of the imported translations are kept in memory.
 
-        trans = cls._nereid_translation_cache.get(cache_key, -1)
-        if trans != -1:
-            return trans
+        Returns the number of translations of the module in the language.
+        """
+        logger = logging.getLogger('nereid.translation')
+        start = time.time()
+
+        fs_id2prop = cls._get_import_fs_ids(module)
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+
+        imported = set()
+        processed = 0
+        with open(po_path, 'rb') as fileobj:
+            po_entries = iter_po_entries(fileobj)
+            while True:
+                entries = list(islice(po_entries, batch_size))
+                if not entries:
+                    break
+                to_override = []
+                key2translation = {}
+                for entry in entries:
+                    processed += 1
+                    translation, res_id = cls.from_poentry(entry)
+                    translation.lang = lang
+                    translation.module = module
+
+                    if '.' in res_id:
+                        to_override.append((res_id, translation))
+                        continue
+
+                    res_id, noupdate = cls._get_import_res_id(
+                        fs_id2prop, translation, res_id
+                    )
+                    translation.res_id = res_id
+                    key = translation.unique_key
+                    if not key:
+                        raise ValueError('Unknow translation type: %s' %
+                            translation.type)
+                    key2translation[key] = (translation, noupdate)
+
+                cls._override_translations(lang, module, to_override)
+
+                key2rows = {}
+                names = set(t.name for t, _ in key2translation.itervalues())
+                for sub_names in grouped_slice(names):
+                    cursor.execute(*table.select(
+                        table.id, table.name, table.res_id, table.type,
+                        table.src, table.value, table.fuzzy,
+                        where=(table.lang == lang) &
+                        (table.module == module) &
+                        table.name.in_(list(sub_names))
+                    ))
+                    for (id_, name, res_id, type_, src, value, fuzzy) in \
+                            cursor.fetchall():
+                        key = cls(
+                            name=name, res_id=res_id, type=type_, src=src
+                        ).unique_key
+                        if key in key2translation:
+                            key2rows.setdefault(key, []).append(
+                                (id_, value, bool(fuzzy))
+                            )
+
+                to_create = []
+                to_write = {}
+                for key, (translation, noupdate) in \
+                        key2translation.iteritems():
+                    rows = key2rows.get(key)
+                    if not rows:
+                        to_create.append(translation._save_values)
+                        continue
+                    for id_, value, fuzzy in rows:
+                        imported.add(id_)
+                        if noupdate:
+                            continue
+                        if (value != translation.value or
+                                fuzzy != translation.fuzzy):
+                            to_write.setdefault(
+                                (translation.value, translation.fuzzy), []
+                            ).append(id_)
+
+                with Transaction().set_user(0), \
+                        Transaction().set_context(module=module):
+                    if to_write:
+                        args = []
+                        for (value, fuzzy), ids in to_write.iteritems():
+                            args.extend((cls.browse(ids), {
+                                'value': value,
+                                'fuzzy': fuzzy,
+                            }))
+                        cls.write(*args)
+                    if to_create:
+                        imported.update(
+                            t.id for t in cls.create(to_create)
+                        )
+
+        if imported:
+            cursor.execute(*table.select(
+                table.id,
+                where=(table.lang == lang) & (table.module == module)
+            ))
+            to_delete = [
+                id_ for id_, in cursor.fetchall() if id_ not in imported
+            ]
+            for sub_ids in grouped_slice(to_delete):
+                cls.delete(cls.browse(sub_ids))
+
+        duration = time.time() - start
+        logger.info(
+            'Imported %s entries of %s (%s) in %.2fs: %.0f rows/s',
+            processed, module, lang, duration,
+            processed / duration if duration else processed
+        )
+        return len(imported)
+
+    #: A Tryton cache for each catalog of nereid translations, keyed by
+    #: (lang, type, module). See :meth:`get_nereid_catalog`
+    _nereid_catalog_caches = {}
+    _nereid_catalog_caches_lock = Lock()
+
+    #: Every load of a catalog gets a new version from this counter
+    _nereid_catalog_versions = count(1)
+
+    @classmethod
+    def _get_nereid_catalog_cache(cls, lang, ttype, module):
+        """
+        Returns the cache of the catalog. Each catalog has its own named
+        cache, so that clearing it does not reset the other catalogs in
+        any of the workers.
+        """
+        key = (lang, ttype, module)
+        cache = cls._nereid_catalog_caches.get(key)
+        if cache is None:
+            with cls._nereid_catalog_caches_lock:
+                cache = cls._nereid_catalog_caches.get(key)
+                if cache is None:
+                    cache = Cache(
+                        'ir.translation.nereid_catalog.%s.%s.%s' % key,
+                        size_limit=1, context=False
+                    )
+                    cls._nereid_catalog_caches[key] = cache
+        return cache
+
+    @classmethod
+    def _load_nereid_catalog(cls, lang, ttype, module):
+        """
+        Returns a tuple of the version and the catalog
+        """
+        cache = cls._get_nereid_catalog_cache(lang, ttype, module)
+        rv = cache.get(None)
+        if rv is not None:
+            return rv
 
         cursor = Transaction().connection.cursor()
         table = cls.__table__()
@@ -326,35 +721,200 @@ class Translation:
             (table.type == ttype) &
             (table.value != '') &
             (table.value != None) &
-            (table.fuzzy == False) &
-            (table.src == source)
+            (table.fuzzy == False)
         )
         if module is not None:
             where &= (table.module == module)
 
-        cursor.execute(*table.select(table.value, where=where))
-        res = cursor.fetchone()
-        if res:
-            cls._nereid_translation_cache.set(cache_key, res[0])
-            return res[0]
-        else:
-            cls._nereid_translation_cache.set(cache_key, False)
+        cursor.execute(*table.select(
+            table.src, table.value, where=where, order_by=table.id
+        ))
+        catalog = {}
+        for source, value in cursor.fetchall():
+            catalog.setdefault(source, value)
+
+        rv = (next(cls._nereid_catalog_versions), catalog)
+        cache.set(None, rv)
+        return rv
+
+    @classmethod
+    def get_nereid_catalog(cls, lang, ttype, module=None):
+        """
+        Returns a dictionary of the translated values by source for the
+        given language and type. If module is None the catalog has the
+        translations of all the modules, where the first translation
+        of a source wins.
+
+        The catalog is loaded with a single query and cached until a
+        translation in it is created, written or deleted.
+        """
+        return cls._load_nereid_catalog(lang, ttype, module)[1]
+
+    @classmethod
+    def get_nereid_catalog_version(cls, lang, ttype, module=None):
+        """
+        Returns the version of the catalog in this process. The version
+        changes every time the catalog is reloaded after a change in its
+        translations.
+        """
+        return cls._load_nereid_catalog(lang, ttype, module)[0]
+
+    @classmethod
+    def get_nereid_translation_version(cls, module, ttype, lang):
+        """
+        Returns the version of the translations which
+        :meth:`get_translation_4_nereid` looks up for the arguments. The
+        translations do not change while the version is the same.
+        """
+        mapped_catalog = cls.get_nereid_mapped_catalog(lang)
+        if mapped_catalog is not None:
+            return mapped_catalog.identity
+        return cls.get_nereid_catalog_version(
+            unicode(lang), unicode(ttype), module
+        )
+
+    @classmethod
+    def get_translation_4_nereid(cls, module, ttype, lang, source):
+        "Return translation for source"
+        mapped_catalog = cls.get_nereid_mapped_catalog(lang)
+        if mapped_catalog is not None:
+            return mapped_catalog.get(catalog_key(ttype, module, source))
+
+        catalog = cls.get_nereid_catalog(unicode(lang), unicode(ttype), module)
+        return catalog.get(unicode(source))
+
+    @staticmethod
+    def get_nereid_catalog_path(lang):
+        """
+        Returns the path of the binary catalog of nereid translations for
+        the language. The catalogs are stored in the `translations_path` of
+        the `nereid` section of the Tryton config. By default it is:
+
+        <Tryton Data Path>/<Database Name>/nereid/translations
+        """
+        directory = config.get('nereid', 'translations_path')
+        if not directory:
+            directory = os.path.join(
+                config.get('database', 'path'),
+                Transaction().database.name,
+                'nereid', 'translations'
+            )
+        return os.path.join(directory, '%s.mo' % lang)
+
+    @classmethod
+    def export_nereid_catalog(cls, lang):
+        """
+        Compile the nereid translations of the language into a binary
+        catalog (see :mod:`nereid.contrib.catalog`) and return its path.
+
+        Workers look translations up in the exported catalogs when
+        `mapped_translations` is set in the `nereid` section of the Tryton
+        config. Changes to translations are seen after the next export.
+        """
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+        cursor.execute(*table.select(
+            table.type, table.module, table.src, table.value,
+            where=(
+                (table.lang == lang) &
+                table.type.in_(_nereid_types) &
+                (table.value != '') &
+                (table.value != None) &
+                (table.fuzzy == False)
+            ),
+            order_by=table.id
+        ))
+        messages = {}
+        for ttype, module, source, value in cursor.fetchall():
+            value = value.encode('utf-8')
+            messages.setdefault(catalog_key(ttype, module, source), value)
+            # The translation when no module is given, first one wins
+            messages.setdefault(catalog_key(ttype, None, source), value)
+
+        path = cls.get_nereid_catalog_path(lang)
+        save_mo(path, messages)
+        return path
+
+    #: Mapped catalogs by path, with the identity of the file and the
+    #: time when it was last checked for changes
+    _nereid_mapped_catalogs = {}
+    _nereid_mapped_catalogs_lock = Lock()
+
+    @classmethod
+    def get_nereid_mapped_catalog(cls, lang):
+        """
+        Returns the memory mapped catalog of the language, or None if
+        mapped translations are not enabled or the catalog was not
+        exported. The file is checked for a new export at most once a
+        second.
+        """
+        if not config.getboolean('nereid', 'mapped_translations',
+                default=False):
             return None
 
+        path = cls.get_nereid_catalog_path(lang)
+        now = time.time()
+        entry = cls._nereid_mapped_catalogs.get(path)
+        if entry is not None and now - entry[2] < 1:
+            return entry[0]
+
+        with cls._nereid_mapped_catalogs_lock:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                catalog, identity = None, None
+            else:
+                # Exports replace the file, so the inode changes too
+                identity = (stat.st_ino, stat.st_mtime)
+                if entry is not None and entry[1] == identity:
+                    catalog = entry[0]
+                else:
+                    catalog = MappedCatalog(path)
+            cls._nereid_mapped_catalogs[path] = (catalog, identity, now)
+        return catalog
+
+    @classmethod
+    def clear_nereid_catalogs(cls, keys):
+        """
+        Clear the caches of the catalogs with the given (lang, type, module)
+        keys and of the catalogs of all the modules for their language and
+        type.
+        """
+        cleared = set()
+        for lang, ttype, module in keys:
+            if ttype not in _nereid_types:
+                continue
+            for key in ((lang, ttype, module), (lang, ttype, None)):
+                if key not in cleared:
+                    cls._get_nereid_catalog_cache(*key).clear()
+                    cleared.add(key)
+
     @classmethod
     def delete(cls, translations):
-        cls._nereid_translation_cache.clear()
+        cls.clear_nereid_catalogs(
+            set((t.lang, t.type, t.module) for t in translations)
+        )
         return super(Translation, cls).delete(translations)
 
     @classmethod
     def create(cls, vlist):
-        cls._nereid_translation_cache.clear()
-        return super(Translation, cls).create(vlist)
+        translations = super(Translation, cls).create(vlist)
+        cls.clear_nereid_catalogs(
+            set((t.lang, t.type, t.module) for t in translations)
+        )
+        return translations
 
     @classmethod
-    def write(cls, translations, values):
-        cls._nereid_translation_cache.clear()
-        return super(Translation, cls).write(translations, values)
+    def write(cls, translations, values, *args):
+        actions = iter((translations, values) + args)
+        ids = []
+        for records, _ in zip(actions, actions):
+            ids.extend(map(int, records))
+        keys = set((t.lang, t.type, t.module) for t in cls.browse(ids))
+        super(Translation, cls).write(translations, values, *args)
+        # The language, type or module could have been changed
+        keys.update((t.lang, t.type, t.module) for t in cls.browse(ids))
+        cls.clear_nereid_catalogs(keys)
 
 
 class TranslationSet:
@@ -438,6 +998,7 @@ class TranslationSet:
         extract_options = cls._get_nereid_template_extract_options()
         logger = logging.getLogger('nereid.translation')
 
+        templates, tasks = [], []
         for module, directory in cls._get_installed_module_directories():
             template_dir = os.path.join(directory, 'templates')
             if not os.path.isdir(template_dir):
@@ -449,19 +1010,156 @@ class TranslationSet:
                     module, template_dir
                 )
             )
-            # now that there is a template directory, load the templates
-            # using a simple filesystem loader and load all the
-            # translations from it.
+            # now that there is a template directory, list the templates
+            # using a simple filesystem loader and extract the
+            # translations from all of them at once.
             loader = FileSystemLoader(template_dir)
             env = Environment(loader=loader)
             extensions = '.html,.jinja'
             for template in env.list_templates(extensions=extensions):
-                logger.info('Loading from: %s:%s' % (module, template))
-                file_obj = open(loader.get_source({}, template)[1])
-                for message_tuple in babel_extract(
-                        file_obj, GETTEXT_FUNCTIONS,
-                        ['trans:'], extract_options):
-                    yield (module, template) + message_tuple
+                templates.append((module, template))
+                tasks.append((
+                    'jinja', loader.get_source({}, template)[1],
+                    extract_options
+                ))
+
+        for (module, template), messages in zip(
+                templates, cls._extract_messages(tasks)):
+            for message_tuple in messages:
+                yield (module, template) + tuple(message_tuple)
+
+    @classmethod
+    def _get_extraction_cache_path(cls):
+        """
+        Returns the directory in which the messages extracted from files are
+        cached. The directory is the `extraction_cache_path` of the `nereid`
+        section of the Tryton config. By default it is:
+
+        <Tryton Data Path>/nereid/extraction
+        """
+        directory = config.get('nereid', 'extraction_cache_path')
+        if not directory:
+            directory = os.path.join(
+                config.get('database', 'path'), 'nereid', 'extraction'
+            )
+        return directory
+
+    @classmethod
+    def _get_extraction_processes(cls):
+        """
+        Returns the number of processes across which the extraction of
+        messages is fanned out. It is the `extraction_processes` of the
+        `nereid` section of the Tryton config, 1 (in the current process)
+        by default.
+
+        The process pool forks the current process, with its threads,
+        database connections and locks, so it should only be enabled where
+        the extraction runs in a process of its own (a script updating the
+        translations for example) and not in the threaded server.
+        """
+        return config.getint('nereid', 'extraction_processes', default=1)
+
+    @classmethod
+    def _extract_messages(cls, tasks):
+        """
+        Extract the messages of the files of the tasks (see `_extract_file`)
+        and return the list of messages of each task in the same order.
+
+        The messages of every file are cached on disk by path, modification
+        time and size of the file, so only the files which changed since the
+        last extraction are parsed again. Those are extracted in a process
+        pool if `extraction_processes` is set.
+        """
+        logger = logging.getLogger('nereid.translation')
+        cache_dir = cls._get_extraction_cache_path()
+
+        results = [None] * len(tasks)
+        keys = [_extraction_cache_key(task) for task in tasks]
+        missing = []
+        for index, key in enumerate(keys):
+            if key is not None:
+                try:
+                    with open(os.path.join(cache_dir, key), 'rb') as file_obj:
+                        results[index] = cPickle.load(file_obj)
+                    continue
+                except Exception:
+                    pass
+            missing.append(index)
+
+        if not missing:
+            return results
+
+        logger.info(
+            'Extracting messages from %s of %s files', len(missing), len(tasks)
+        )
+        processes = min(cls._get_extraction_processes(), len(missing))
+        missing_tasks = [tasks[index] for index in missing]
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                extracted = pool.map(_extract_file, missing_tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            extracted = map(_extract_file, missing_tasks)
+
+        for index, messages in zip(missing, extracted):
+            results[index] = messages
+            if keys[index] is None:
+                continue
+            try:
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                fd, temp_path = tempfile.mkstemp(dir=cache_dir)
+                with os.fdopen(fd, 'wb') as file_obj:
+                    cPickle.dump(messages, file_obj, cPickle.HIGHEST_PROTOCOL)
+                os.rename(temp_path, os.path.join(cache_dir, keys[index]))
+            except (IOError, OSError):
+                logger.warning(
+                    'Could not cache the messages of %s', tasks[index][1],
+                    exc_info=True
+                )
+        return results
+
+    @classmethod
+    def _get_nereid_messages(cls):
+        """
+        Extract localizable strings from the python code of installed
+        modules. The files are found the same way as
+        `babel.messages.extract.extract_from_dir` does.
+
+        For every string found this function yields a
+        `(module, filename, lineno, messages, comments, context)` tuple,
+        where filename is relative to the directory of the module.
+        """
+        files, tasks = [], []
+        for module, directory in cls._get_installed_module_directories():
+            # skip messages from test files
+            if 'tests' in directory:
+                continue
+            absname = os.path.abspath(directory)
+            for root, dirnames, filenames in os.walk(absname):
+                dirnames[:] = [
+                    subdir for subdir in dirnames
+                    if not (subdir.startswith('.') or subdir.startswith('_'))
+                ]
+                dirnames.sort()
+                filenames.sort()
+                for filename in filenames:
+                    filepath = os.path.join(root, filename)
+                    relative = os.path.relpath(filepath, absname).replace(
+                        os.sep, '/'
+                    )
+                    if not pathmatch('**.py', relative):
+                        continue
+                    files.append((module, relative))
+                    tasks.append(('python', filepath, None))
+
+        for (module, filename), messages in zip(
+                files, cls._extract_messages(tasks)):
+            for message_tuple in messages:
+                yield (module, filename) + tuple(message_tuple)
 
     @staticmethod
     def _get_nereid_template_messages_from_file(self, template_dir, template):
@@ -476,14 +1174,46 @@ class TranslationSet:
                 ['trans:'], extract_options):
             yield (template,) + message_tuple
 
+    @classmethod
+    def _get_existing_translation_keys(cls, ttype, with_res_id=False):
+        """
+        Returns the set of `(name, src, module)` keys of the en_US
+        translations of the given type, loaded with a single query. If
+        `with_res_id` is True, the keys also have the res_id as the last
+        element.
+        """
+        Translation = Pool().get('ir.translation')
+        translation = Translation.__table__()
+        cursor = Transaction().connection.cursor()
+
+        columns = [translation.name, translation.src, translation.module]
+        if with_res_id:
+            columns.append(translation.res_id)
+        cursor.execute(*translation.select(
+            *columns,
+            where=(translation.lang == 'en_US') & (translation.type == ttype)
+        ))
+        return set(cursor.fetchall())
+
+    @classmethod
+    def _create_translations(cls, to_create, chunk_size=1000):
+        """
+        Create the translations from the list of values in chunks, so that
+        a large extraction does not build a single huge insert.
+        """
+        Translation = Pool().get('ir.translation')
+        for sub_values in grouped_slice(to_create, chunk_size):
+            Translation.create(list(sub_values))
+
     def set_nereid_template(self):
         """
         Loads all nereid templates translatable strings into the database. The
         templates loaded are only the ones which are bundled with the tryton
         modules and available in the site packages.
         """
-        pool = Pool()
-        Translation = pool.get('ir.translation')
+        existing = self._get_existing_translation_keys(
+            'nereid_template', with_res_id=True
+        )
         to_create = []
         for module, template, lineno, function, messages, comments in \
                 self._get_nereid_template_messages():
@@ -497,16 +1227,10 @@ class TranslationSet:
                 messages = (messages, )
 
             for message in messages:
-                translations = Translation.search([
-                    ('lang', '=', 'en_US'),
-                    ('type', '=', 'nereid_template'),
-                    ('name', '=', template),
-                    ('src', '=', message),
-                    ('module', '=', module),
-                    ('res_id', '=', lineno),
-                ], limit=1)
-                if translations:
+                key = (template, message, module, lineno)
+                if key in existing:
                     continue
+                existing.add(key)
                 to_create.append({
                     'name': template,
                     'res_id': lineno,
@@ -516,8 +1240,7 @@ class TranslationSet:
                     'module': module,
                     'comments': comments and '\n'.join(comments) or None,
                 })
-        if to_create:
-            Translation.create(to_create)
+        self._create_translations(to_create)
 
     def set_wtforms(self):
         """
@@ -528,8 +1251,7 @@ class TranslationSet:
         an integer, then a message like “Not a valid integer value” would be
         displayed.
         """
-        pool = Pool()
-        Translation = pool.get('ir.translation')
+        existing = self._get_existing_translation_keys('wtforms')
         to_create = []
         for (filename, lineno, messages, comments, context) in \
                 extract_from_dir(os.path.dirname(wtforms.__file__)):
@@ -543,15 +1265,10 @@ class TranslationSet:
                 messages = (messages, )
 
             for message in messages:
-                translations = Translation.search([
-                    ('lang', '=', 'en_US'),
-                    ('type', '=', 'wtforms'),
-                    ('name', '=', filename),
-                    ('src', '=', message),
-                    ('module', '=', 'nereid'),
-                ], limit=1)
-                if translations:
+                key = (filename, message, 'nereid')
+                if key in existing:
                     continue
+                existing.add(key)
                 to_create.append({
                     'name': filename,
                     'res_id': lineno,
@@ -561,8 +1278,7 @@ class TranslationSet:
                     'module': 'nereid',
                     'comments': comments and '\n'.join(comments) or None,
                 })
-        if to_create:
-            Translation.create(to_create)
+        self._create_translations(to_create)
 
     @staticmethod
     def _get_babel_messages_from_file(self, template):
@@ -582,46 +1298,35 @@ class TranslationSet:
         function extracts the translation strings from code of installed
         modules.
         """
-        pool = Pool()
-        Translation = pool.get('ir.translation')
+        existing = self._get_existing_translation_keys('nereid')
         to_create = []
 
-        for module, directory in self._get_installed_module_directories():
-            # skip messages from test files
-            if 'tests' in directory:
-                continue
-            for (filename, lineno, messages, comments, context) in \
-                    extract_from_dir(directory,):
-
-                if isinstance(messages, basestring):
-                    # messages could be a tuple if the function is ngettext
-                    # where the messages for singular and plural are given as
-                    # a tuple.
-                    #
-                    # So convert basestrings to tuples
-                    messages = (messages, )
-
-                for message in messages:
-                    translations = Translation.search([
-                        ('lang', '=', 'en_US'),
-                        ('type', '=', 'nereid'),
-                        ('name', '=', filename),
-                        ('src', '=', message),
-                        ('module', '=', module),
-                    ], limit=1)
-                    if translations:
-                        continue
-                    to_create.append({
-                        'name': filename,
-                        'res_id': lineno,
-                        'lang': 'en_US',
-                        'src': message,
-                        'type': 'nereid',
-                        'module': module,
-                        'comments': comments and '\n'.join(comments) or None,
-                    })
-        if to_create:
-            Translation.create(to_create)
+        for module, filename, lineno, messages, comments, context in \
+                self._get_nereid_messages():
+
+            if isinstance(messages, basestring):
+                # messages could be a tuple if the function is ngettext
+                # where the messages for singular and plural are given as
+                # a tuple.
+                #
+                # So convert basestrings to tuples
+                messages = (messages, )
+
+            for message in messages:
+                key = (filename, message, module)
+                if key in existing:
+                    continue
+                existing.add(key)
+                to_create.append({
+                    'name': filename,
+                    'res_id': lineno,
+                    'lang': 'en_US',
+                    'src': message,
+                    'type': 'nereid',
+                    'module': module,
+                    'comments': comments and '\n'.join(comments) or None,
+                })
+        self._create_translations(to_create)
 
 
 class TranslationUpdate:
@@ -675,108 +1380,184 @@ class TranslationClean(Wizard):
     "Clean translation"
     __name__ = 'ir.translation.clean'
 
-    @staticmethod
-    def _clean_nereid_template(translation):
+    #: The index of the nereid sources used by the clean in progress
+    _nereid_index = local()
+
+    def transition_clean(self):
+        self._nereid_index.value = self._build_nereid_index()
+        try:
+            return super(TranslationClean, self).transition_clean()
+        finally:
+            del self._nereid_index.value
+
+    @classmethod
+    def _get_nereid_index(cls):
         """
-        Clean the template translations if the module is not installed, or if
-        the template is not there.
+        Returns the index of the clean in progress or a new one when the
+        clean methods are called on their own.
+        """
+        index = getattr(cls._nereid_index, 'value', None)
+        if index is None:
+            index = cls._new_nereid_index()
+        return index
+
+    @classmethod
+    def _new_nereid_index(cls):
+        """
+        Returns an empty index of the nereid sources. It is a dictionary
+        with:
+
+        * modules: the directory of every installed module by name
+        * templates: the set of templates of every template directory
+        * messages: the set of message keys of every extracted file by
+          `(method, path)`
+        """
+        TranslationSet = Pool().get('ir.translation.set', type='wizard')
+        modules = dict(TranslationSet._get_installed_module_directories())
+        return {
+            'modules': modules,
+            'templates': {},
+            'messages': {},
+        }
+
+    @classmethod
+    def _build_nereid_index(cls):
+        """
+        Build the index for all the nereid translations in the database.
+        The installed modules are looked up once and the source files of all
+        the translations are extracted in a single batch.
+        """
+        Translation = Pool().get('ir.translation')
+        translation = Translation.__table__()
+        cursor = Transaction().connection.cursor()
+
+        index = cls._new_nereid_index()
+        cursor.execute(*translation.select(
+            translation.type, translation.module, translation.name,
+            where=translation.type.in_(_nereid_types),
+            group_by=[translation.type, translation.module, translation.name]
+        ))
+        tasks = filter(None, [
+            cls._get_nereid_source(index, ttype, module, name)
+            for ttype, module, name in cursor.fetchall()
+        ])
+        cls._load_nereid_messages(index, tasks)
+        return index
+
+    @classmethod
+    def _get_nereid_source(cls, index, ttype, module, name):
+        """
+        Returns the extraction task (see `_extract_file`) of the source file
+        of a nereid translation or None if the source is not there anymore.
         """
         TranslationSet = Pool().get('ir.translation.set', type='wizard')
-        installed_modules = TranslationSet._get_installed_module_directories()
 
         # Clean if the module is not installed anymore
-        for module, directory in installed_modules:
-            if translation.module == module:
-                break
+        directory = index['modules'].get(module)
+        if directory is None:
+            return None
+
+        if ttype == 'nereid_template':
+            # Clean if the template directory does not exist
+            template_dir = os.path.join(directory, 'templates')
+            if not os.path.isdir(template_dir):
+                return None
+
+            # Clean if the template is not found
+            loader = FileSystemLoader(template_dir)
+            if template_dir not in index['templates']:
+                index['templates'][template_dir] = set(
+                    loader.list_templates()
+                )
+            if name not in index['templates'][template_dir]:
+                return None
+            return (
+                'jinja', loader.get_source({}, name)[1],
+                TranslationSet._get_nereid_template_extract_options()
+            )
+
+        if ttype == 'wtforms':
+            path = os.path.join(os.path.dirname(wtforms.__file__), name)
         else:
-            return True
+            # Clean any messages from tests
+            if 'tests' in name.split('/'):
+                return None
+            path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            return None
+        return ('python', path, None)
 
-        # Clean if the template directory does not exist
-        template_dir = os.path.join(directory, 'templates')
-        if not os.path.isdir(template_dir):
-            return True
+    @classmethod
+    def _load_nereid_messages(cls, index, tasks):
+        """
+        Extract the files of the tasks which are not in the index yet and
+        add the keys of their messages to the index.
+        """
+        TranslationSet = Pool().get('ir.translation.set', type='wizard')
 
-        # Clean if the template is not found
-        loader = FileSystemLoader(template_dir)
-        if translation.name not in loader.list_templates():
+        tasks = [
+            task for task in tasks
+            if (task[0], task[1]) not in index['messages']
+        ]
+        for (method, path, _), messages in zip(
+                tasks, TranslationSet._extract_messages(tasks)):
+            keys = index['messages'][(method, path)] = set()
+            for message_tuple in messages:
+                if method == 'jinja':
+                    lineno, _, strings, comments = message_tuple
+                    comments = comments and '\n'.join(comments) or None
+                else:
+                    lineno, strings, _, _ = message_tuple
+                if isinstance(strings, basestring):
+                    strings = (strings, )
+                for string in strings:
+                    if method == 'jinja':
+                        keys.add((lineno, string, comments))
+                    else:
+                        keys.add((lineno, string))
+
+    @classmethod
+    def _clean_nereid_source(cls, translation):
+        """
+        Returns True if the nereid translation has no equivalent in the
+        source files of the installed modules.
+        """
+        index = cls._get_nereid_index()
+        task = cls._get_nereid_source(
+            index, translation.type, translation.module, translation.name
+        )
+        if task is None:
             return True
+        cls._load_nereid_messages(index, [task])
 
+        if translation.type == 'nereid_template':
+            key = (translation.res_id, translation.src, translation.comments)
+        else:
+            key = (translation.res_id, translation.src)
         # Clean if the translation has changed (avoid duplicates)
-        # (translation has no equivalent in template)
-        found = False
-        for template, lineno, function, message, comments in \
-            TranslationSet._get_nereid_template_messages_from_file(
-                TranslationSet, template_dir, translation.name):
-            if (template, lineno, message, comments and
-                    '\n'.join(comments) or None) == \
-                (translation.name, translation.res_id, translation.src,
-                    translation.comments):
-                found = True
-                break
-        if not found:
-            return True
+        return key not in index['messages'][(task[0], task[1])]
+
+    @staticmethod
+    def _clean_nereid_template(translation):
+        """
+        Clean the template translations if the module is not installed, or if
+        the template is not there.
+        """
+        TranslationClean = Pool().get('ir.translation.clean', type='wizard')
+        return TranslationClean._clean_nereid_source(translation)
 
     @staticmethod
     def _clean_wtforms(translation):
         """
         Clean the translation if nereid is not installed
         """
-        TranslationSet = Pool().get('ir.translation.set', type='wizard')
-        installed_modules = TranslationSet._get_installed_module_directories()
-
-        # Clean if the module is not installed anymore
-        for module, directory in installed_modules:
-            if translation.module == module:
-                break
-        else:
-            return True
-
-        # Clean if the translation has changed (avoid duplicates)
-        # (translation has no equivalent in template)
-        babel_file = os.path.join(os.path.dirname(wtforms.__file__),
-            translation.name)
-        if not os.path.exists(babel_file):
-            return True
-        found = False
-        for template, lineno, message in \
-            TranslationSet._get_babel_messages_from_file(TranslationSet,
-                babel_file):
-            if (lineno, message) == (translation.res_id, translation.src):
-                found = True
-                break
-        if not found:
-            return True
+        TranslationClean = Pool().get('ir.translation.clean', type='wizard')
+        return TranslationClean._clean_nereid_source(translation)
 
     @staticmethod
     def _clean_nereid(translation):
         """
         Remove the nereid translations if the module is not installed
         """
-        TranslationSet = Pool().get('ir.translation.set', type='wizard')
-        installed_modules = TranslationSet._get_installed_module_directories()
-
-        # Clean if the module is not installed anymore
-        for module, directory in installed_modules:
-            if translation.module == module:
-                break
-        else:
-            return True
-
-        # Clean any messages from tests
-        if 'tests' in translation.name.split('/'):
-            return True
-
-        # Clean if the translation has changed (avoid duplicates)
-        # (translation has no equivalent in template)
-        babel_file = os.path.join(directory, translation.name)
-        if not os.path.exists(babel_file):
-            return True
-        found = False
-        for template, lineno, message in \
-            TranslationSet._get_babel_messages_from_file(TranslationSet,
-                babel_file):
-            if (lineno, message) == (translation.res_id, translation.src):
-                found = True
-                break
-        if not found:
-            return True
+        TranslationClean = Pool().get('ir.translation.clean', type='wizard')
+        return TranslationClean._clean_nereid_source(translation)
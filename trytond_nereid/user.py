@@ -4,7 +4,14 @@ import random
 import string
 import urllib
 import base64
+import hmac
+import time
+import uuid
+import logging
 import warnings
+from itertools import islice
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
 try:
     import hashlib
@@ -12,25 +19,43 @@ except ImportError:
     hashlib = None
     import sha
 
+try:
+    import bcrypt
+except ImportError:
+    bcrypt = None
+
+try:
+    import argon2
+except ImportError:
+    argon2 = None
+
 import pytz
+from sql.conditionals import Coalesce
+from sql.functions import CurrentTimestamp
 from flask_wtf import Form, RecaptchaField
 from wtforms import TextField, SelectField, validators, PasswordField
 from flask.ext.login import logout_user, AnonymousUserMixin, login_url, \
     login_user
 from werkzeug import redirect, abort
+from werkzeug.contrib.cache import NullCache
 
 from nereid import request, url_for, render_template, login_required, flash, \
     jsonify, route, current_website, current_user
 from nereid.ctx import has_request_context
+from nereid.jobs import defer
 from nereid.globals import current_app
 from nereid.signals import registration
 from nereid.templating import render_email
+from nereid.throttling import Limit, check_throttle
+from trytond import backend
 from trytond.model import ModelView, ModelSQL, fields, Unique
 from trytond.pool import Pool
+from trytond.cache import Cache
 from trytond.pyson import Eval, Bool, Not
 from trytond.transaction import Transaction
 from trytond.config import config
 from trytond.rpc import RPC
+from trytond.tools import grouped_slice
 from itsdangerous import URLSafeSerializer, TimestampSigner, SignatureExpired, \
     BadSignature, TimedJSONWebSignatureSerializer
 from .i18n import _
@@ -38,6 +63,58 @@ from .i18n import _
 __all__ = ['NereidUser', 'NereidAnonymousUser', 'Permission', 'UserPermission']
 
 
+class _AfterCommitDataManager(object):
+    """
+    A data manager of the transaction which calls functions once the
+    transaction is committed
+    """
+
+    def __init__(self):
+        self.functions = []
+
+    def __eq__(self, other):
+        return isinstance(other, _AfterCommitDataManager)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def tpc_begin(self, transaction):
+        pass
+
+    def commit(self, transaction):
+        pass
+
+    def tpc_vote(self, transaction):
+        pass
+
+    def tpc_abort(self, transaction):
+        pass
+
+    def tpc_finish(self, transaction):
+        for function in self.functions:
+            function()
+
+
+def _after_commit(function):
+    """
+    Call the function once the current transaction is committed
+    """
+    datamanager = Transaction().join(_AfterCommitDataManager())
+    if function not in datamanager.functions:
+        datamanager.functions.append(function)
+
+
+def _clear_cache(cache):
+    """
+    Clear the Tryton cache now and once the current transaction is
+    committed. Requests of the worker which read the data before the commit
+    could have cached it again in between. The reset of the cache is
+    published to the other workers after the commit.
+    """
+    cache.clear()
+    _after_commit(cache.clear)
+
+
 class RegistrationForm(Form):
     "Simple Registration form"
     name = TextField(_('Name'), [validators.DataRequired(), ])
@@ -127,12 +204,20 @@ class NereidUser(ModelSQL, ModelView):
 
     #: The password is the user password + the salt, which is
     #: then hashed together
+    #:
+    #: .. versionchanged:: 4.0.1.1
+    #:     Only the legacy passwords are stored in this field, the passwords
+    #:     set now are hashed into :attr:`password_hash`.
     password = fields.Sha('Password')
 
     #: The salt which was used to make the hash is separately
     #: stored. Needed for
     salt = fields.Char('Salt', size=8)
 
+    #: The hash of the password in the form <hash method>$<hash>. See
+    #: :meth:`hash_password`
+    password_hash = fields.Char('Password Hash', readonly=True)
+
     # The company of the website(s) to which the user is affiliated. This
     # allows websites of the same company to share authentication/users. It
     # does not make business or technical sense to have website of multiple
@@ -154,6 +239,21 @@ class NereidUser(ModelSQL, ModelView):
     email_verified = fields.Boolean("Email Verified")
     active = fields.Boolean('Active')
 
+    #: The version of the credentials of the user. It is bumped whenever
+    #: the password changes or the auth tokens of the user are revoked,
+    #: which invalidates the auth tokens issued before.
+    credential_version = fields.Integer('Credential Version', readonly=True)
+
+    #: Snapshots of the fields of the users loaded by Flask-Login, by id.
+    #: See :meth:`load_user`
+    _user_snapshot_cache = Cache('nereid.user.snapshot', context=False)
+
+    #: The permission values of the users, by id
+    _permissions_cache = Cache('nereid.user.permissions', context=False)
+
+    #: The serializers of auth tokens by (secret key, validity duration)
+    _token_serializers = {}
+
     @classmethod
     def get_display_name(cls, records, name):
         "Returns the display name"
@@ -195,6 +295,10 @@ class NereidUser(ModelSQL, ModelView):
     def default_email_verified():
         return False
 
+    @staticmethod
+    def default_credential_version():
+        return 1
+
     @staticmethod
     def default_active():
         """
@@ -210,29 +314,80 @@ class NereidUser(ModelSQL, ModelView):
         """
         Return a JSON serializable object that represents this record
         """
-        return {
-            'id': self.id,
-            'email': self.email,
-            'display_name': self.display_name,
-            'permissions': list(self.get_permissions()),
-        }
+        return self.serialize_many([self], purpose)[0]
 
-    def get_permissions(self):
+    @classmethod
+    def serialize_many(cls, users, purpose=None):
         """
-        Returns all the permissions as a list of names
+        Return a list of JSON serializable objects that represent the users,
+        in their order. The fields are read at once and the permissions of
+        the users not cached are loaded with a single query.
         """
-        # TODO: Cache this value for each user to avoid hitting the database
-        # everytime.
-        return frozenset([p.value for p in self.permissions])
+        values = dict(
+            (v['id'], v) for v in cls.read(
+                [u.id for u in users], ['email', 'display_name']
+            )
+        )
+        permissions = cls.get_permissions_many(users)
+        return [{
+            'id': user.id,
+            'email': values[user.id]['email'],
+            'display_name': values[user.id]['display_name'],
+            'permissions': list(permissions[user.id]),
+        } for user in users]
 
-    def has_permissions(self, perm_all=None, perm_any=None):
-        """Check if the user has all required permissions in perm_all and
-        has any permission from perm_any for access
+    def get_permissions(self):
+        """
+        Returns all the permissions as a frozenset of values
+        """
+        return self.get_permissions_many([self])[self.id]
 
-        :param perm_all: A set/frozenset of all permission values/keywords.
-        :param perm_any: A set/frozenset of any permission values/keywords.
+    @classmethod
+    def get_permissions_many(cls, users):
+        """
+        Returns a dictionary of the permission values (a frozenset) of the
+        users by id. The permissions of every user are cached until
+        permissions are changed or assigned. The permissions of the users
+        which are not cached are loaded with a single query.
+        """
+        pool = Pool()
+        Permission = pool.get('nereid.permission')
+        UserPermission = pool.get('nereid.permission-nereid.user')
+        permission = Permission.__table__()
+        user_permission = UserPermission.__table__()
+        cursor = Transaction().connection.cursor()
+
+        result = {}
+        missing = []
+        for user in users:
+            permissions = cls._permissions_cache.get(user.id)
+            if permissions is None:
+                missing.append(user.id)
+            else:
+                result[user.id] = permissions
+
+        if missing:
+            values = dict((user_id, set()) for user_id in missing)
+            for sub_ids in grouped_slice(missing):
+                cursor.execute(*user_permission.join(
+                    permission,
+                    condition=user_permission.permission == permission.id
+                ).select(
+                    user_permission.nereid_user, permission.value,
+                    where=user_permission.nereid_user.in_(list(sub_ids))
+                ))
+                for user_id, value in cursor.fetchall():
+                    values[user_id].add(value)
+            for user_id, permissions in values.iteritems():
+                result[user_id] = cls._permissions_cache.set(
+                    user_id, frozenset(permissions)
+                )
+        return result
 
-        :return: True/False
+    @staticmethod
+    def _check_permissions(permissions, perm_all=None, perm_any=None):
+        """
+        Check if the permissions include all of perm_all and any of perm_any
         """
         if not perm_all and not perm_any:
             # Access allowed if no permission is required
@@ -241,14 +396,43 @@ class NereidUser(ModelSQL, ModelView):
             perm_all = frozenset(perm_all if perm_all else [])
         if not isinstance(perm_any, (set, frozenset)):
             perm_any = frozenset(perm_any if perm_any else [])
-        current_user_permissions = self.get_permissions()
 
-        if perm_all and not perm_all.issubset(current_user_permissions):
+        if perm_all and not perm_all.issubset(permissions):
             return False
-        if perm_any and not perm_any.intersection(current_user_permissions):
+        if perm_any and not perm_any.intersection(permissions):
             return False
         return True
 
+    def has_permissions(self, perm_all=None, perm_any=None):
+        """Check if the user has all required permissions in perm_all and
+        has any permission from perm_any for access
+
+        :param perm_all: A set/frozenset of all permission values/keywords.
+        :param perm_any: A set/frozenset of any permission values/keywords.
+
+        :return: True/False
+        """
+        if not perm_all and not perm_any:
+            # Access allowed if no permission is required
+            return True
+        return self._check_permissions(
+            self.get_permissions(), perm_all, perm_any
+        )
+
+    @classmethod
+    def has_permissions_many(cls, users, perm_all=None, perm_any=None):
+        """
+        Same as :meth:`has_permissions` for many users at once. Returns a
+        dictionary of True/False by user id.
+        """
+        permissions = cls.get_permissions_many(users)
+        return dict(
+            (user.id, cls._check_permissions(
+                permissions[user.id], perm_all, perm_any
+            ))
+            for user in users
+        )
+
     @staticmethod
     def default_timezone():
         return "UTC"
@@ -270,6 +454,22 @@ class NereidUser(ModelSQL, ModelView):
             'match_password': RPC(readonly=True, instantiate=0),
         })
 
+    @classmethod
+    def __register__(cls, module_name):
+        TableHandler = backend.get('TableHandler')
+
+        super(NereidUser, cls).__register__(module_name)
+
+        table = TableHandler(cls, module_name)
+        # Users are looked up by email in the company of the website on
+        # login, registration and Basic authentication. The index of the
+        # unique constraint serves the lookup, but the constraint is not
+        # created on every backend or when existing users violate it.
+        if table.table_name + '_unique_email_company' in table._constraints:
+            table.index_action(['email', 'company'], 'remove')
+        else:
+            table.index_action(['email', 'company'], 'add')
+
     @property
     def _signer(self):
         return TimestampSigner(current_app.secret_key)
@@ -334,7 +534,7 @@ class NereidUser(ModelSQL, ModelView):
 
     @route(
         "/verify-email/<int:active_id>/<sign>", methods=["GET"],
-        readonly=False
+        writes_on_get=True
     )
     def verify_email(self, sign, max_age=24 * 60 * 60):
         """
@@ -461,9 +661,15 @@ class NereidUser(ModelSQL, ModelView):
 
     def send_activation_email(self):
         """
-        Send an activation email to the user
+        Send an activation email to the user. The email is rendered and
+        queued once the transaction of the request is committed, see
+        :func:`nereid.jobs.defer`.
+        """
+        defer(self._send_activation_email)
 
-        :param nereid_user: The browse record of the user
+    def _send_activation_email(self):
+        """
+        Render the activation email of the user and queue it
         """
         EmailQueue = Pool().get('email.queue')
 
@@ -490,13 +696,15 @@ class NereidUser(ModelSQL, ModelView):
         )
 
     @classmethod
-    @route('/send-magic-link/<email>', methods=['GET'], readonly=False)
+    @route(
+        '/send-magic-link/<email>', methods=['GET'], writes_on_get=True,
+        throttle=[Limit(20, 3600, key='ip'), Limit(5, 3600, key='email')]
+    )
     def send_magic_login_link(cls, email):
         """
-        Send a magic login email to the user
+        Send a magic login email to the user. The email is rendered and
+        queued once the transaction of the request is committed.
         """
-        EmailQueue = Pool().get('email.queue')
-
         try:
             nereid_user, = cls.search([
                 ('email', '=', email.lower()),
@@ -508,24 +716,32 @@ class NereidUser(ModelSQL, ModelView):
             current_app.logger.debug(message)
         else:
             message = "Please check your mail and follow the link"
-            email_message = render_email(
-                config.get('email', 'from'),
-                email, _('Magic Signin Link'),
-                text_template='emails/magic-login-text.jinja',
-                html_template='emails/magic-login-html.jinja',
-                nereid_user=nereid_user
-            )
-            EmailQueue.queue_mail(
-                config.get('email', 'from'), email, email_message.as_string()
-            )
+            defer(nereid_user._send_magic_login_email, email)
 
         return cls.build_response(
             message, redirect(url_for('nereid.website.home')), 200
         )
 
+    def _send_magic_login_email(self, email):
+        """
+        Render the magic login email of the user and queue it
+        """
+        EmailQueue = Pool().get('email.queue')
+
+        email_message = render_email(
+            config.get('email', 'from'),
+            email, _('Magic Signin Link'),
+            text_template='emails/magic-login-text.jinja',
+            html_template='emails/magic-login-html.jinja',
+            nereid_user=self
+        )
+        EmailQueue.queue_mail(
+            config.get('email', 'from'), email, email_message.as_string()
+        )
+
     @route(
         "/magic-login/<int:active_id>/<sign>",
-        methods=["GET"], readonly=False
+        methods=["GET"], writes_on_get=True
     )
     def magic_login(self, sign, max_age=5 * 60):
         """
@@ -648,7 +864,7 @@ class NereidUser(ModelSQL, ModelView):
 
     @route(
         "/activate-account/<int:active_id>/<sign>", methods=["GET"],
-        readonly=False
+        writes_on_get=True
     )
     def activate(self, sign, max_age=24 * 60 * 60):
         """A web request handler for activation of the user account. This
@@ -681,7 +897,12 @@ class NereidUser(ModelSQL, ModelView):
         return redirect(url_for('nereid.website.login'))
 
     @classmethod
-    @route("/reset-account", methods=["GET", "POST"])
+    @route(
+        "/reset-account", methods=["GET", "POST"], throttle=[
+            Limit(20, 3600, key='ip', methods=['POST']),
+            Limit(5, 3600, key='email', methods=['POST']),
+        ]
+    )
     def reset_account(cls):
         """
         Reset the password for the user.
@@ -719,9 +940,15 @@ class NereidUser(ModelSQL, ModelView):
 
     def send_reset_email(self):
         """
-        Send an account reset email to the user
+        Send an account reset email to the user. The email is rendered and
+        queued once the transaction of the request is committed, see
+        :func:`nereid.jobs.defer`.
+        """
+        defer(self._send_reset_email)
 
-        :param nereid_user: The browse record of the user
+    def _send_reset_email(self):
+        """
+        Render the account reset email of the user and queue it
         """
         EmailQueue = Pool().get('email.queue')
 
@@ -743,6 +970,10 @@ class NereidUser(ModelSQL, ModelView):
         :param password: The password of the user (string or unicode)
         :return: True or False
         """
+        if self.password_hash:
+            return self.check_password(password, self.password_hash)
+
+        # A legacy password, hashed by the Sha field
         password += self.salt or ''
         if isinstance(password, unicode):
             password = password.encode('utf-8')
@@ -752,6 +983,209 @@ class NereidUser(ModelSQL, ModelView):
             digest = sha.new(password).hexdigest()
         return (digest == self.password)
 
+    @staticmethod
+    def hash_method():
+        """
+        Returns the method used to hash new passwords. It is set with
+        password_hash_method in the nereid section of the configuration
+        and defaults to pbkdf2_sha256.
+        """
+        return config.get(
+            'nereid', 'password_hash_method', default='pbkdf2_sha256'
+        )
+
+    @classmethod
+    def hash_password(cls, password):
+        """
+        Hash the password with the method returned by :meth:`hash_method`.
+        The hash is prefixed by the name of the method, so that each method
+        is implemented by a pair of hash_<method> and check_<method> class
+        methods which downstream modules can extend.
+
+        Raises a ValueError if the configured method is unknown or the
+        library it needs is not installed.
+        """
+        if not password:
+            return None
+        hash_method = cls.hash_method()
+        hash_function = cls._get_password_function('hash_', hash_method)
+        if hash_function is None:
+            raise ValueError(
+                'Unsupported password_hash_method in the nereid section of '
+                'the configuration: %s (unknown method or library not '
+                'installed)' % hash_method
+            )
+        return hash_function(password)
+
+    @classmethod
+    def check_password(cls, password, hash_):
+        """
+        Returns True if the password matches the hash. A hash made with an
+        unknown method or one whose library is not installed never matches.
+        """
+        if not hash_:
+            return False
+        if isinstance(password, unicode):
+            password = password.encode('utf-8')
+        hash_method = hash_.split('$', 1)[0]
+        check_function = cls._get_password_function('check_', hash_method)
+        if check_function is None:
+            logging.getLogger('nereid.user').warning(
+                'Unsupported password hash method: %s', hash_method
+            )
+            return False
+        return check_function(password, hash_)
+
+    @classmethod
+    def password_needs_rehash(cls, hash_):
+        """
+        Returns True if the hash was not made with the current hash method
+        and its cost. The hash of a legacy password is None.
+        """
+        if not hash_:
+            return True
+        hash_method = hash_.split('$', 1)[0]
+        if hash_method != cls.hash_method():
+            return True
+        needs_rehash = cls._get_password_function(
+            'needs_rehash_', hash_method
+        )
+        return bool(needs_rehash and needs_rehash(hash_))
+
+    @classmethod
+    def _get_password_function(cls, prefix, hash_method):
+        """
+        Returns the class method named prefix followed by the hash method,
+        or None if the method is unknown or the library it needs is not
+        installed.
+        """
+        if (hash_method == 'bcrypt' and bcrypt is None) or \
+                (hash_method == 'argon2' and argon2 is None):
+            return None
+        return getattr(cls, prefix + hash_method, None)
+
+    @staticmethod
+    def _get_password_salt():
+        return ''.join(random.sample(
+            string.ascii_letters + string.digits, 8))
+
+    @classmethod
+    def hash_sha1(cls, password):
+        if isinstance(password, unicode):
+            password = password.encode('utf-8')
+        salt = cls._get_password_salt()
+        hash_ = hashlib.sha1(password + salt).hexdigest()
+        return '$'.join(['sha1', hash_, salt])
+
+    @classmethod
+    def check_sha1(cls, password, hash_):
+        hash_method, hash_, salt = hash_.split('$', 2)
+        assert hash_method == 'sha1'
+        return hmac.compare_digest(
+            str(hash_), hashlib.sha1(password + str(salt)).hexdigest()
+        )
+
+    @staticmethod
+    def _get_pbkdf2_rounds():
+        return config.getint('nereid', 'password_pbkdf2_rounds', default=30000)
+
+    @classmethod
+    def hash_pbkdf2_sha256(cls, password):
+        if isinstance(password, unicode):
+            password = password.encode('utf-8')
+        rounds = cls._get_pbkdf2_rounds()
+        salt = base64.b64encode(uuid.uuid4().bytes).rstrip('=')
+        hash_ = hashlib.pbkdf2_hmac('sha256', password, salt, rounds)
+        return '$'.join([
+            'pbkdf2_sha256', str(rounds), salt, base64.b64encode(hash_)
+        ])
+
+    @classmethod
+    def check_pbkdf2_sha256(cls, password, hash_):
+        hash_method, rounds, salt, hash_ = map(str, hash_.split('$', 3))
+        assert hash_method == 'pbkdf2_sha256'
+        return hmac.compare_digest(hash_, base64.b64encode(
+            hashlib.pbkdf2_hmac('sha256', password, salt, int(rounds))
+        ))
+
+    @classmethod
+    def needs_rehash_pbkdf2_sha256(cls, hash_):
+        return int(hash_.split('$', 2)[1]) < cls._get_pbkdf2_rounds()
+
+    @staticmethod
+    def _get_bcrypt_rounds():
+        return config.getint('nereid', 'password_bcrypt_rounds', default=12)
+
+    @classmethod
+    def hash_bcrypt(cls, password):
+        if isinstance(password, unicode):
+            password = password.encode('utf-8')
+        hash_ = bcrypt.hashpw(
+            password, bcrypt.gensalt(cls._get_bcrypt_rounds())
+        ).decode('utf-8')
+        return '$'.join(['bcrypt', hash_])
+
+    @classmethod
+    def check_bcrypt(cls, password, hash_):
+        hash_method, hash_ = hash_.split('$', 1)
+        assert hash_method == 'bcrypt'
+        hash_ = hash_.encode('utf-8')
+        return hmac.compare_digest(hash_, bcrypt.hashpw(password, hash_))
+
+    @classmethod
+    def needs_rehash_bcrypt(cls, hash_):
+        # bcrypt$$2b$<rounds>$<salt and hash>
+        return int(hash_.split('$')[3]) < cls._get_bcrypt_rounds()
+
+    @staticmethod
+    def _get_argon2_hasher():
+        return argon2.PasswordHasher(
+            time_cost=config.getint(
+                'nereid', 'password_argon2_time_cost', default=2
+            ),
+            memory_cost=config.getint(
+                'nereid', 'password_argon2_memory_cost', default=19456
+            ),
+        )
+
+    @classmethod
+    def hash_argon2(cls, password):
+        hash_ = cls._get_argon2_hasher().hash(password)
+        return '$'.join(['argon2', hash_])
+
+    @classmethod
+    def check_argon2(cls, password, hash_):
+        hash_method, hash_ = hash_.split('$', 1)
+        assert hash_method == 'argon2'
+        try:
+            return cls._get_argon2_hasher().verify(hash_, password)
+        except argon2.exceptions.VerificationError:
+            return False
+
+    @classmethod
+    def needs_rehash_argon2(cls, hash_):
+        hasher = cls._get_argon2_hasher()
+        if not hasattr(hasher, 'check_needs_rehash'):
+            return False
+        return hasher.check_needs_rehash(hash_.split('$', 1)[1])
+
+    def rehash_password(self, password):
+        """
+        Hash the password of the user again with the current hash method,
+        when the password was verified by a legacy or weaker hash. The
+        credential version is not bumped as the password does not change.
+        Nothing is written in a readonly transaction.
+        """
+        if Transaction().readonly:
+            return
+        if not self.password_needs_rehash(self.password_hash):
+            return
+        self.write([self], {
+            'password_hash': self.hash_password(password),
+            'password': None,
+            'salt': None,
+        })
+
     @classmethod
     def authenticate(cls, email, password):
         """Assert credentials and if correct return the
@@ -786,10 +1220,93 @@ class NereidUser(ModelSQL, ModelView):
 
         user, = users
         if user.match_password(password):
+            user.rehash_password(password)
             return user
 
         return None
 
+    @classmethod
+    def _clear_permissions_cache(cls):
+        """
+        Clear the cached permissions of the users, now and once the
+        transaction is committed
+        """
+        _clear_cache(cls._permissions_cache)
+
+    @classmethod
+    def _get_snapshot_fields(cls):
+        """
+        Returns the names of the fields kept in the snapshot of a user loaded
+        by Flask-Login. Downstream modules can add the fields their templates
+        use on every request.
+        """
+        return [
+            'active', 'email', 'name', 'email_verified', 'timezone',
+            'party', 'company', 'credential_version', 'write_date',
+        ]
+
+    @classmethod
+    def get_user_snapshot(cls, user_id):
+        """
+        Returns a dictionary of the values of the snapshot fields of the
+        user (including inactive ones) or None if there is no such user.
+
+        The snapshots are cached in each worker by user and write date, so
+        that writing a user only misses its own snapshot in all the workers.
+        """
+        keys = cls._get_user_snapshot_keys([user_id])
+        if not keys:
+            return None
+        key, = keys
+        snapshot = cls._user_snapshot_cache.get(key)
+        if snapshot is not None:
+            return snapshot
+
+        with Transaction().set_context(active_test=False):
+            snapshots = cls.search_read(
+                [('id', '=', user_id)],
+                fields_names=cls._get_snapshot_fields()
+            )
+        if not snapshots:
+            return None
+        snapshot, = snapshots
+        cls._user_snapshot_cache.set(key, snapshot)
+        return snapshot
+
+    @classmethod
+    def _get_user_snapshot_keys(cls, ids):
+        """
+        Returns the keys of the snapshot cache of the existing users, which
+        are the pairs of their id and write date.
+        """
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        keys = []
+        for sub_ids in grouped_slice(ids):
+            cursor.execute(*table.select(
+                table.id, table.write_date,
+                where=table.id.in_(list(sub_ids))
+            ))
+            keys.extend(tuple(row) for row in cursor.fetchall())
+        return keys
+
+    @classmethod
+    def _evict_user_snapshots(cls, ids):
+        """
+        Evict the snapshots of the users cached under their current write
+        date from the cache of this worker, now and once the transaction is
+        committed. Within a transaction the write date may not change on
+        every write (it is the start time of the transaction on PostgreSQL),
+        so a snapshot cached in between would otherwise be kept.
+        """
+        keys = cls._get_user_snapshot_keys(ids)
+
+        def evict():
+            for key in keys:
+                cls._user_snapshot_cache.set(key, None)
+        evict()
+        _after_commit(evict)
+
     @classmethod
     def load_user(cls, user_id):
         """
@@ -798,17 +1315,89 @@ class NereidUser(ModelSQL, ModelView):
         :param user_id: Unicode ID of the user
         """
         try:
-            with Transaction().set_context(active_test=False):
-                user, = cls.search([('id', '=', int(user_id))])
+            user_id = int(user_id)
         except ValueError:
             return None
 
-        # Instead of returning the active record returned in the above search
-        # we are creating a new record here. This is because the returned
-        # active record seems to carry around the context setting of
-        # active_test and any nested lookup from the record will result in
-        # records being fetched which are inactive.
-        return cls(int(user_id))
+        snapshot = cls.get_user_snapshot(user_id)
+        if snapshot is None:
+            return None
+
+        # Instead of returning a record from a search with active_test
+        # disabled, we are creating a new record here. This is because such
+        # a record carries around the context setting of active_test and any
+        # nested lookup from the record will result in records being fetched
+        # which are inactive.
+        user = cls(user_id)
+
+        # Fill the record cache with the snapshot so that reading these
+        # fields does not hit the database
+        values = {}
+        for name, value in snapshot.iteritems():
+            field = cls._fields.get(name)
+            if field is None:
+                continue
+            if field._type == 'many2one':
+                value = field.get_target()(value) if value else None
+            values[name] = value
+        user._local_cache[user_id] = values
+        return user
+
+    @staticmethod
+    def _get_basic_auth_cache_key(email, password):
+        """
+        Returns the cache key of verified Basic auth credentials. The key is
+        an HMAC of the credentials with the secret key of the application,
+        so the cache never holds the password.
+        """
+        secret_key = current_app.secret_key
+        if isinstance(secret_key, unicode):
+            secret_key = secret_key.encode('utf-8')
+        message = u'%s:%s:%s' % (
+            current_website.company.id, email.lower(), password
+        )
+        digest = hmac.new(
+            secret_key, message.encode('utf-8'), hashlib.sha256
+        ).hexdigest()
+        return '%s-basic-auth-%s' % (current_app.database_name, digest)
+
+    @classmethod
+    def authenticate_basic(cls, email, password):
+        """
+        Authenticate the credentials of a Basic authorization header. API
+        clients send the credentials on every request, so verified
+        credentials are remembered in the cache of the application for
+        BASIC_AUTH_CACHE_TIMEOUT seconds instead of hashing the password
+        again. Changing the password bumps the credential version of the
+        user, which invalidates the remembered credentials.
+
+        The other attempts are throttled with the limits of the
+        BASIC_AUTH_THROTTLE setting.
+        """
+        timeout = current_app.basic_auth_cache_timeout
+        if not (email and password):
+            return None
+
+        key = cls._get_basic_auth_cache_key(email, password)
+        cached = timeout and current_app.cache.get(key)
+        if cached:
+            user_id, version = cached
+            user = cls.load_user(user_id)
+            if user is not None and \
+                    user.email == email.lower() and \
+                    (user.credential_version or 0) == version:
+                return user
+
+        # Only the attempts which verify the password are throttled
+        check_throttle(
+            current_app.basic_auth_throttle, 'basic-auth', email=email
+        )
+        user = cls.authenticate(email, password)
+        if user and timeout:
+            current_app.cache.set(
+                key, (user.id, user.credential_version or 0), timeout=timeout
+            )
+        return user
 
     @classmethod
     def load_user_from_header(cls, header_val):
@@ -825,7 +1414,7 @@ class NereidUser(ModelSQL, ModelView):
             except TypeError:
                 pass
             else:
-                user = cls.authenticate(*header_val.split(':', 1))
+                user = cls.authenticate_basic(*header_val.split(':', 1))
                 if user and user.is_active:
                     return user
 
@@ -838,6 +1427,116 @@ class NereidUser(ModelSQL, ModelView):
                             .replace('Token ', '', 1)
             return cls.load_user_from_token(token)
 
+    @classmethod
+    def get_token_serializer(cls):
+        """
+        Returns the serializer of auth tokens for the secret key and token
+        validity duration of the current application. Serializers are
+        reused across requests.
+        """
+        key = (current_app.secret_key, current_app.token_validity_duration)
+        serializer = cls._token_serializers.get(key)
+        if serializer is None:
+            serializer = cls._token_serializers[key] = \
+                TimedJSONWebSignatureSerializer(key[0], expires_in=key[1])
+        return serializer
+
+    @staticmethod
+    def _get_revoked_token_key(token_id):
+        return '%s-revoked-auth-token-%s' % (
+            current_app.database_name, token_id
+        )
+
+    @classmethod
+    def is_auth_token_revoked(cls, token_id):
+        """
+        Returns True if the token with the given id was revoked with
+        :meth:`revoke_auth_token`
+        """
+        if not token_id:
+            return False
+        return bool(
+            current_app.cache.get(cls._get_revoked_token_key(token_id))
+        )
+
+    @classmethod
+    def revoke_auth_token(cls, token):
+        """
+        Revoke a single auth token until it expires. The revoked tokens are
+        kept in the cache of the application, so the cache must be shared by
+        the workers (memcached for example) for the revocation to be seen
+        everywhere. To revoke all the tokens of a user use
+        :meth:`revoke_auth_tokens`.
+
+        Returns True if the token was revoked, False if the token is not
+        valid or the cache of the application is a NullCache which cannot
+        keep the revocation.
+        """
+        if isinstance(current_app.cache, NullCache):
+            current_app.logger.warning(
+                'Auth token not revoked: the NullCache cannot keep revoked '
+                'tokens, use revoke_auth_tokens or a shared cache'
+            )
+            return False
+        try:
+            data, header = cls.get_token_serializer().loads(
+                token, return_header=True
+            )
+        except BadSignature:
+            # Expired tokens are not valid anyway
+            return False
+        if not data.get('jti'):
+            return False
+        timeout = max(int(header['exp'] - time.time()), 1)
+        current_app.cache.set(
+            cls._get_revoked_token_key(data['jti']), True, timeout=timeout
+        )
+        return True
+
+    @classmethod
+    def revoke_auth_tokens(cls, users):
+        """
+        Revoke all the auth tokens issued to the users so far by bumping
+        their credential version
+        """
+        cls._bump_credential_version([user.id for user in users])
+
+    @classmethod
+    def _bump_credential_version(cls, ids):
+        """
+        Increment the credential version of the users. The version is
+        incremented in the UPDATE itself rather than read and written back,
+        so that concurrent bumps are never lost. The write date and user
+        are set like :meth:`write` does.
+        """
+        ModelAccess = Pool().get('ir.model.access')
+        ModelAccess.check(cls.__name__, 'write')
+
+        table = cls.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        for sub_ids in grouped_slice(ids):
+            cursor.execute(*table.update(
+                [
+                    table.credential_version, table.write_date,
+                    table.write_uid,
+                ],
+                [
+                    Coalesce(table.credential_version, 0) + 1,
+                    CurrentTimestamp(), transaction.user,
+                ],
+                where=table.id.in_(list(sub_ids))
+            ))
+
+        # Clean the record caches of the transaction as a write does
+        transaction.counter += 1
+        for cache in transaction.cache.itervalues():
+            if cls.__name__ in cache:
+                for id_ in ids:
+                    if id_ in cache[cls.__name__]:
+                        cache[cls.__name__][id_].clear()
+        cls._evict_user_snapshots(ids)
+
     @classmethod
     def load_user_from_token(cls, token):
         """
@@ -845,23 +1544,32 @@ class NereidUser(ModelSQL, ModelView):
 
         :param token: The token sent in the user's request
         """
-        serializer = TimedJSONWebSignatureSerializer(
-            current_app.secret_key,
-            expires_in=current_app.token_validity_duration
-        )
-
         try:
-            data = serializer.loads(token)
+            data = cls.get_token_serializer().loads(token)
         except SignatureExpired:
             return None     # valid token, but expired
         except BadSignature:
             return None     # invalid token
 
-        user = cls(data['id'])
-        if user.password != data['password']:
-            # The password has been changed by the user. So the token
-            # should also be invalid.
-            return None
+        if 'password' in data:
+            # A token issued before credential versions
+            user = cls(data['id'])
+            if user.password != data['password']:
+                # The password has been changed by the user. So the token
+                # should also be invalid.
+                return None
+        else:
+            if cls.is_auth_token_revoked(data.get('jti')):
+                return None
+
+            # The user comes from the snapshot cache, so the common case
+            # does not read the user table.
+            user = cls.load_user(data['id'])
+            if user is None:
+                return None
+            if (user.credential_version or 0) != data.get('version'):
+                # The password was changed or the tokens were revoked
+                return None
 
         if user.is_active:
             # Login only if the login_user method returns True for the user
@@ -870,16 +1578,14 @@ class NereidUser(ModelSQL, ModelView):
     def get_auth_token(self):
         """
         Return an authentication token for the user. The auth token uniquely
-        identifies the user and includes the salted hash of the password, then
-        encrypted with a Timed serializer.
+        identifies the user and includes the version of its credentials, then
+        signed with a Timed serializer. Changing the password or revoking the
+        tokens of the user bumps the version and invalidates the token.
 
         The token_validity_duration can be set in application configuration
         using TOKEN_VALIDITY_DURATION
         """
-        serializer = TimedJSONWebSignatureSerializer(
-            current_app.secret_key,
-            expires_in=current_app.token_validity_duration
-        )
+        serializer = self.get_token_serializer()
         local_txn = None
         if Transaction().connection is None:
             # Flask-Login can call get_auth_token outside the context
@@ -890,7 +1596,11 @@ class NereidUser(ModelSQL, ModelView):
             )
             self = self.__class__(self.id)
         try:
-            return serializer.dumps({'id': self.id, 'password': self.password})
+            return serializer.dumps({
+                'id': self.id,
+                'version': self.credential_version or 0,
+                'jti': uuid.uuid4().hex,
+            })
         finally:
             if local_txn is not None:
                 # TODO: Find a better way to close transaction
@@ -932,18 +1642,19 @@ class NereidUser(ModelSQL, ModelView):
     def get_id(self):
         return unicode(self.id)
 
-    @staticmethod
-    def _convert_values(values):
+    @classmethod
+    def _convert_values(cls, values):
         """
         A helper method which looks if the password is specified in the values.
-        If it is, then the salt is also made and added
+        If it is, then the password is hashed into password_hash and the
+        legacy password and salt are cleared.
 
         :param values: A dictionary of field: value pairs
         """
         if 'password' in values and values['password']:
-            values['salt'] = ''.join(random.sample(
-                string.ascii_letters + string.digits, 8))
-            values['password'] += values['salt']
+            values['password_hash'] = cls.hash_password(values['password'])
+            values['password'] = None
+            values['salt'] = None
 
         if 'email' in values and values['email']:
             values['email'] = values['email'].lower()
@@ -953,21 +1664,156 @@ class NereidUser(ModelSQL, ModelView):
     @classmethod
     def create(cls, vlist):
         """
-        Create, but add salt before saving
+        Create, but hash the password before saving
 
         :param vlist: List of dictionary of Values
         """
         vlist = [cls._convert_values(vals.copy()) for vals in vlist]
         return super(NereidUser, cls).create(vlist)
 
+    @classmethod
+    def provision_users(cls, users, company, chunk_size=1000,
+                        processes=None, commit=False, progress=None):
+        """
+        Create users in bulk, like when migrating the customers of another
+        platform. `users` is an iterable of dictionaries of the values of
+        the users, which is consumed in chunks of `chunk_size`. For each
+        chunk, the parties, their email contact mechanisms and the users are
+        created with one call each.
+
+        The dictionaries have an `email` and may have:
+
+            * `name`: The name of the user and of the party
+            * `password`: The password, which is hashed in a pool of
+              `processes` threads (the number of CPUs by default)
+            * `password_hash`: A hash which :meth:`check_password`
+              supports, instead of the password
+            * `party`: The id of an existing party, for which no party is
+              created
+            * other values of fields of the user
+
+        Users whose email already exists in the company are skipped, so
+        a failed run can be restarted with the same users. With `commit`
+        the transaction is committed after each chunk for that purpose.
+        `progress` is called with the number of users created and skipped
+        so far after each chunk.
+
+        Returns the number of users created and skipped.
+        """
+        pool = Pool()
+        Party = pool.get('party.party')
+        ContactMechanism = pool.get('party.contact_mechanism')
+        logger = logging.getLogger('nereid.user')
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+
+        if processes is None:
+            processes = cpu_count()
+        hash_pool = ThreadPool(processes) if processes > 1 else None
+
+        start = time.time()
+        created = skipped = 0
+        users = iter(users)
+        try:
+            while True:
+                chunk = list(islice(users, chunk_size))
+                if not chunk:
+                    break
+
+                # Skip the users which exist or are repeated in the chunk
+                emails = set(values['email'].lower() for values in chunk)
+                for sub_emails in grouped_slice(emails):
+                    cursor.execute(*table.select(
+                        table.email,
+                        where=(table.company == company.id) &
+                        table.email.in_(list(sub_emails))
+                    ))
+                    emails.difference_update(e for e, in cursor.fetchall())
+                to_provision = []
+                for values in chunk:
+                    email = values['email'].lower()
+                    if email not in emails:
+                        skipped += 1
+                        continue
+                    emails.remove(email)
+                    to_provision.append(values)
+
+                passwords = [v.get('password') for v in to_provision]
+                if hash_pool is not None:
+                    hashes = hash_pool.map(cls.hash_password, passwords)
+                else:
+                    hashes = map(cls.hash_password, passwords)
+
+                new_parties = [
+                    v for v in to_provision if not v.get('party')
+                ]
+                parties = Party.create([{
+                    'name': v.get('name') or v['email'],
+                    'addresses': [],
+                } for v in new_parties])
+                ContactMechanism.create([{
+                    'party': party.id,
+                    'type': 'email',
+                    'value': v['email'],
+                } for party, v in zip(parties, new_parties)])
+                party_ids = iter(party.id for party in parties)
+
+                vlist = []
+                for values, hash_ in zip(to_provision, hashes):
+                    values = values.copy()
+                    values.pop('password', None)
+                    if hash_:
+                        values['password_hash'] = hash_
+                    if not values.get('party'):
+                        values['party'] = next(party_ids)
+                    values['email'] = values['email'].lower()
+                    values['company'] = company.id
+                    vlist.append(values)
+                cls.create(vlist)
+                created += len(vlist)
+
+                if commit:
+                    Transaction().commit()
+                logger.info(
+                    'Provisioned %s users (%s skipped, %.0f users/s)',
+                    created, skipped,
+                    created / max(time.time() - start, 0.001)
+                )
+                if progress is not None:
+                    progress(created, skipped)
+        finally:
+            if hash_pool is not None:
+                hash_pool.close()
+        return created, skipped
+
     @classmethod
     def write(cls, nereid_users, values, *args):
         """
-        Update salt before saving
+        Hash the passwords before saving
         """
-        return super(NereidUser, cls).write(
-            nereid_users, cls._convert_values(values), *args
-        )
+        password_changed = []
+        to_write = []
+        actions = iter((nereid_users, values) + args)
+        for records, record_values in zip(actions, actions):
+            if record_values.get('password'):
+                password_changed.extend(r.id for r in records)
+            to_write.extend(
+                (records, cls._convert_values(record_values.copy()))
+            )
+
+        rv = super(NereidUser, cls).write(*to_write)
+        if password_changed:
+            # Invalidate the auth tokens issued with the old password
+            cls._bump_credential_version(password_changed)
+        cls._evict_user_snapshots([u.id for u in nereid_users] + [
+            r.id for records in args[::2] for r in records
+        ])
+        return rv
+
+    @classmethod
+    def delete(cls, nereid_users):
+        super(NereidUser, cls).delete(nereid_users)
+        cls._clear_permissions_cache()
 
     @staticmethod
     def get_gravatar_url(email, **kwargs):
@@ -1107,6 +1953,16 @@ class Permission(ModelSQL, ModelView):
                 'Permissions must be unique by value'),
         ]
 
+    @classmethod
+    def write(cls, permissions, values, *args):
+        super(Permission, cls).write(permissions, values, *args)
+        Pool().get('nereid.user')._clear_permissions_cache()
+
+    @classmethod
+    def delete(cls, permissions):
+        super(Permission, cls).delete(permissions)
+        Pool().get('nereid.user')._clear_permissions_cache()
+
 
 class UserPermission(ModelSQL):
     "Nereid User Permissions"
@@ -1120,3 +1976,19 @@ class UserPermission(ModelSQL):
         'nereid.user', 'User',
         ondelete='CASCADE', select=True, required=True
     )
+
+    @classmethod
+    def create(cls, vlist):
+        records = super(UserPermission, cls).create(vlist)
+        Pool().get('nereid.user')._clear_permissions_cache()
+        return records
+
+    @classmethod
+    def write(cls, user_permissions, values, *args):
+        super(UserPermission, cls).write(user_permissions, values, *args)
+        Pool().get('nereid.user')._clear_permissions_cache()
+
+    @classmethod
+    def delete(cls, user_permissions):
+        super(UserPermission, cls).delete(user_permissions)
+        Pool().get('nereid.user')._clear_permissions_cache()
@@ -1,6 +1,7 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 import warnings
+from threading import Lock
 
 import pytz
 from werkzeug import abort, redirect
@@ -14,6 +15,8 @@ from nereid import jsonify, flash, render_template, url_for, cache, \
 from nereid.globals import request
 from nereid.exceptions import WebsiteNotFound
 from nereid.helpers import login_required, key_from_list, get_flashed_messages
+from nereid.routing import TrieMap
+from nereid.throttling import Limit
 from nereid.signals import failed_login
 from trytond.model import ModelView, ModelSQL, fields, Unique
 from trytond.transaction import Transaction
@@ -154,9 +157,7 @@ class WebSite(ModelSQL, ModelView):
         if country not in [c.id for c in current_website.countries]:
             abort(404)
         subdivisions = Subdivision.search([('country', '=', country)])
-        return jsonify(
-            result=[s.serialize() for s in subdivisions]
-        )
+        return jsonify(result=Subdivision.serialize_many(subdivisions))
 
     def stats(self, **arguments):
         """
@@ -172,7 +173,10 @@ class WebSite(ModelSQL, ModelView):
         return render_template('home.jinja')
 
     @classmethod
-    @route('/login', methods=['GET', 'POST'])
+    @route('/login', methods=['GET', 'POST'], throttle=[
+        Limit(30, 60, key='ip', methods=['POST']),
+        Limit(10, 300, key='email', methods=['POST']),
+    ])
     def login(cls):
         """
         Simple login based on the email and password
@@ -345,24 +349,44 @@ class WebSite(ModelSQL, ModelView):
         """
         return {}
 
+    #: The URL map of each website, by the id of the website
     _url_adapter_cache = Cache('nereid.website.url_adapter', context=False)
 
+    #: URL maps shared by websites with the same routing profile
+    #: (see :meth:`get_routing_profile`)
+    _url_map_cache = Cache('nereid.website.url_map', context=False)
+
+    #: Ensures that only one thread builds a missing URL map
+    _url_map_lock = Lock()
+
     @classmethod
     def clear_url_adapter_cache(cls, *args):
         """
         A method which conveniently clears the cache
+
+        The shared URL maps are not cleared since everything that goes
+        into a map is a part of its routing profile.
         """
         cls._url_adapter_cache.clear()
 
-    def get_url_adapter(self, app):
+    def get_routing_profile(self, app):
         """
-        Returns the URL adapter for the website
-        """
-        cache_rv = self._url_adapter_cache.get(self.id)
+        Returns the key of the URL map of the website. Websites with the
+        same routing profile share the same compiled URL map.
 
-        if cache_rv is not None:
-            return cache_rv
+        Downstream modules which change :meth:`build_url_map` based on the
+        fields of a website must add them to the profile.
+        """
+        return (
+            app.trie_url_matching,
+            self.default_locale.code if self.locales else None,
+            app.url_rules_hash,
+        )
 
+    def build_url_map(self, app):
+        """
+        Returns a new URL map for the routing profile of the website
+        """
         url_rules = app.get_urls()[:]
 
         # Add the static url
@@ -373,7 +397,7 @@ class WebSite(ModelSQL, ModelView):
             )
         )
 
-        url_map = Map()
+        url_map = TrieMap() if app.trie_url_matching else Map()
         if self.locales:
             # Create the URL map with locale prefix
             url_map.add(
@@ -391,8 +415,27 @@ class WebSite(ModelSQL, ModelView):
         for rule in app.url_map._rules:
             url_map.add(rule.empty())
 
-        self._url_adapter_cache.set(self.id, url_map)
+        return url_map
 
+    def get_url_adapter(self, app):
+        """
+        Returns the URL adapter for the website
+        """
+        url_map = self._url_adapter_cache.get(self.id)
+        if url_map is not None:
+            return url_map
+
+        profile = self.get_routing_profile(app)
+        url_map = self._url_map_cache.get(profile)
+        if url_map is None:
+            with self._url_map_lock:
+                # Another thread could have built it while waiting
+                url_map = self._url_map_cache.get(profile)
+                if url_map is None:
+                    url_map = self.build_url_map(app)
+                    self._url_map_cache.set(profile, url_map)
+
+        self._url_adapter_cache.set(self.id, url_map)
         return url_map
 
     def get_current_locale(self, req):